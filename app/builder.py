@@ -0,0 +1,127 @@
+import glob
+import hashlib
+import os
+import subprocess
+import threading
+import time
+from .paths import AMD_DIR, BUILD_DIR
+
+BINARY_PREFIX = "apple-music-downloader-"
+
+build_lock = threading.Lock()
+build_status = {
+    "state": "idle",            # idle, building, ready, failed
+    "key": None,
+    "binary": None,
+    "builds": 0,
+    "last_build_seconds": None,
+    "total_build_seconds": 0.0,
+    "built_at": None,
+    "error": None,
+}
+
+def read_text(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def git_head():
+    """Commit the downloader checkout is at, read from .git without running git; None if not a checkout.
+
+    Read on every call (two small files), so a checkout appearing or moving is
+    picked up by the next job.
+    """
+    git_dir = os.path.join(AMD_DIR, ".git")
+    if os.path.isfile(git_dir):  # worktree or submodule: "gitdir: <path>"
+        pointer = read_text(git_dir) or ""
+        if not pointer.startswith("gitdir: "):
+            return None
+        git_dir = os.path.join(AMD_DIR, pointer[len("gitdir: "):])
+    head = read_text(os.path.join(git_dir, "HEAD"))
+    if not head or not head.startswith("ref: "):
+        return head  # detached HEAD holds the commit itself
+    ref = head[len("ref: "):]
+    commit = read_text(os.path.join(git_dir, ref))
+    if commit:
+        return commit
+    for line in (read_text(os.path.join(git_dir, "packed-refs")) or "").splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == ref:
+            return parts[0]
+    return None
+
+def compute_build_key():
+    """Build cache key: downloader git HEAD plus a hash of go.mod/go.sum"""
+    head = git_head() or "nogit"
+
+    digest = hashlib.sha256()
+    for name in ("go.mod", "go.sum"):
+        path = os.path.join(AMD_DIR, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(name.encode())
+                digest.update(f.read())
+    return f"{head[:12]}-{digest.hexdigest()[:12]}"
+
+def binary_path_for(key):
+    return os.path.join(BUILD_DIR, BINARY_PREFIX + key)
+
+def remove_stale_binaries(keep):
+    """Delete cached binaries from previous build keys"""
+    for path in glob.glob(os.path.join(BUILD_DIR, BINARY_PREFIX + "*")):
+        if path != keep and not path.endswith(".tmp"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def ensure_downloader_binary(log=None):
+    """Return the path of the cached downloader binary, building it if the key changed.
+
+    Returns None if the build fails; the error is kept in build_status.
+    """
+    log = log or print
+    with build_lock:
+        key = compute_build_key()
+        binary = binary_path_for(key)
+        if os.path.exists(binary):
+            if build_status["key"] != key:
+                build_status.update(state="ready", key=key, binary=binary, error=None)
+            return binary
+
+        build_status.update(state="building", key=key, binary=None, error=None)
+        log(f"🔨 Building downloader binary ({key})...")
+        os.makedirs(BUILD_DIR, exist_ok=True)
+        tmp_binary = f"{binary}.{os.getpid()}.tmp"  # several processes may build at once
+        started = time.time()
+        try:
+            result = subprocess.run(
+                ["go", "build", "-o", tmp_binary, "."],
+                cwd=AMD_DIR, capture_output=True, text=True
+            )
+        except Exception as e:
+            build_status.update(state="failed", error=str(e))
+            log(f"❌ Downloader build failed: {e}")
+            return None
+        elapsed = time.time() - started
+        build_status["builds"] += 1
+        build_status["last_build_seconds"] = round(elapsed, 3)
+        build_status["total_build_seconds"] = round(build_status["total_build_seconds"] + elapsed, 3)
+
+        if result.returncode != 0:
+            error = (result.stderr or result.stdout).strip()
+            build_status.update(state="failed", error=error)
+            log(f"❌ Downloader build failed with exit code {result.returncode}: {error}")
+            return None
+
+        os.replace(tmp_binary, binary)
+        remove_stale_binaries(keep=binary)
+        build_status.update(state="ready", binary=binary, built_at=time.time())
+        log(f"✅ Downloader binary built in {elapsed:.1f}s")
+        return binary
+
+def start_background_build():
+    """Warm the build cache without blocking startup"""
+    threading.Thread(target=ensure_downloader_binary, daemon=True).start()
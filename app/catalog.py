@@ -0,0 +1,182 @@
+import json
+import re
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from .config_store import downloader_config
+from .settings import get_setting
+from . import store
+
+# Album and playlist links are resolved into their tracks through the Apple
+# Music catalog API, so each track can be queued as its own job; artist links
+# (for subscriptions) resolve to the tracks of all their albums. Lookups are
+# cached in webui.db for `catalog-cache-seconds`. `catalog-url` points both
+# the API and the web player (where the bearer token comes from, as in the
+# downloader) at a stand-in service such as bench/stub_catalog.py.
+API_URL = "https://amp-api.music.apple.com"
+WEB_URL = "https://music.apple.com"
+REQUEST_TIMEOUT = 15
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+MAX_PAGES = 100  # 30000 tracks at the playlist page size
+COLLECTION_KINDS = ("albums", "playlists")
+
+LINK_RE = re.compile(r"^https?://(?:beta\.|classical\.)?music\.apple\.com/(\w{2})/(album|playlist|artist)/(?:[^/?#]+/)?([\w.-]+)/?(?:\?(.*))?$")
+SCRIPT_RE = re.compile(r"/assets/index~?[^/\"']+\.js")
+TOKEN_RE = re.compile(r"eyJh[^\"]*")
+PLACEHOLDER_TOKENS = ("", "your-authorization-token")
+# Catalog item type -> link path the downloader accepts for a single item
+TRACK_PATHS = {"songs": "song", "music-videos": "music-video"}
+
+_token = None
+_token_lock = threading.Lock()
+
+class CatalogError(Exception):
+    pass
+
+def parse_link(link, kinds=COLLECTION_KINDS):
+    """(storefront, kind, id) for a whole album/playlist/artist link of one of kinds, else None.
+
+    Album links to one track (?i=<id>) are not collections.
+    """
+    match = LINK_RE.match((link or "").strip())
+    if not match:
+        return None
+    storefront, kind, collection_id, query = match.groups()
+    if kind + "s" not in kinds:
+        return None
+    if kind == "album" and "i" in urllib.parse.parse_qs(query or ""):
+        return None
+    return storefront, kind + "s", collection_id
+
+def track_link(storefront, track):
+    return f"{WEB_URL}/{storefront}/{TRACK_PATHS[track['type']]}/{track['id']}"
+
+def base_urls():
+    stand_in = get_setting("catalog-url")
+    return (stand_in.rstrip("/"),) * 2 if stand_in else (API_URL, WEB_URL)
+
+def fetch(url, headers=None):
+    request = urllib.request.Request(url, headers=dict(headers or {}, **{"User-Agent": USER_AGENT}))
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        return response.read().decode("utf-8")
+
+def bearer_token(refresh=False):
+    """authorization-token from config.yaml, else the one in the web player's script"""
+    global _token
+    configured = str(downloader_config.get("authorization-token") or "")
+    if configured not in PLACEHOLDER_TOKENS:
+        return configured
+    with _token_lock:
+        if _token and not refresh:
+            return _token
+        web_url = base_urls()[1]
+        script = SCRIPT_RE.search(fetch(web_url))
+        if not script:
+            raise CatalogError("web player script not found")
+        token = TOKEN_RE.search(fetch(web_url + script.group(0)))
+        if not token:
+            raise CatalogError("no token in the web player script")
+        _token = token.group(0)
+        return _token
+
+def api_get(path):
+    """GET a catalog API path (with query), retrying once with a fresh token on 401"""
+    api_url = base_urls()[0]
+    for attempt in range(2):
+        headers = {"Authorization": f"Bearer {bearer_token(refresh=attempt > 0)}", "Origin": WEB_URL}
+        media_user_token = downloader_config.get("media-user-token")
+        if media_user_token and media_user_token != "your-media-user-token":
+            headers["Media-User-Token"] = media_user_token
+        try:
+            return json.loads(fetch(api_url + path, headers))
+        except urllib.error.HTTPError as e:
+            if e.code == 401 and attempt == 0:
+                continue
+            if e.code == 404:
+                raise CatalogError("not found in the catalog")
+            raise CatalogError(f"catalog returned HTTP {e.code}")
+    raise CatalogError("catalog rejected the token")
+
+def follow_pages(page):
+    """Items of a paged relationship, fetching its "next" pages"""
+    items = list(page.get("data", []))
+    pages = 1
+    while page.get("next") and pages < MAX_PAGES:
+        page = api_get(page["next"])
+        items += page.get("data", [])
+        pages += 1
+    return items
+
+def fetch_item(storefront, kind, item_id, relationship):
+    """A catalog item and every entry of one of its relationships"""
+    query = {"include": relationship}
+    language = downloader_config.get("language")
+    if language:
+        query["l"] = language
+    data = api_get(f"/v1/catalog/{storefront}/{kind}/{item_id}?{urllib.parse.urlencode(query)}")
+    if not data.get("data"):
+        raise CatalogError("not found in the catalog")
+    item = data["data"][0]
+    return item, follow_pages(item.get("relationships", {}).get(relationship, {}))
+
+def fetch_collection(storefront, kind, collection_id):
+    """Title and tracks of an album/playlist"""
+    item, items = fetch_item(storefront, kind, collection_id, "tracks")
+    tracks = [{
+        "id": track["id"],
+        "type": track["type"],
+        "name": track.get("attributes", {}).get("name"),
+        "album": track.get("attributes", {}).get("albumName"),
+        "artist": track.get("attributes", {}).get("artistName"),
+    } for track in items if track.get("type") in TRACK_PATHS]
+    return {"title": item.get("attributes", {}).get("name"), "tracks": tracks}
+
+def fetch_artist(storefront, artist_id):
+    """Name of an artist and the tracks of all their albums (album track lists come from the cache)"""
+    item, albums = fetch_item(storefront, "artists", artist_id, "albums")
+    tracks, seen = [], set()
+    for album in albums:
+        for track in lookup(storefront, "albums", album["id"])["tracks"]:
+            if track["id"] not in seen:
+                seen.add(track["id"])
+                tracks.append(track)
+    return {"title": item.get("attributes", {}).get("name"), "tracks": tracks}
+
+def lookup(storefront, kind, collection_id, fresh=False):
+    """Title and tracks of a collection, from the cache unless fresh is set or the entry expired"""
+    key = f"{kind}:{storefront}:{collection_id}"
+    ttl = int(get_setting("catalog-cache-seconds"))
+    collection = store.get_catalog(key, ttl) if ttl and not fresh else None
+    if collection is None:
+        if kind == "artists":
+            collection = fetch_artist(storefront, collection_id)
+        else:
+            collection = fetch_collection(storefront, kind, collection_id)
+        if ttl:
+            store.put_catalog(key, collection)
+            store.prune_catalog(ttl)
+    return collection
+
+def resolve(link, kinds=COLLECTION_KINDS, fresh=False):
+    """{"kind", "title", "links": [(track link, title)], "albums": [album of each track]} for a
+    collection link of one of kinds, None otherwise.
+
+    fresh skips the cached track list of the collection itself (an artist's
+    albums still come from the cache). Raises CatalogError when the collection
+    cannot be listed.
+    """
+    parsed = parse_link(link, kinds)
+    if not parsed:
+        return None
+    storefront, kind, collection_id = parsed
+    try:
+        collection = lookup(storefront, kind, collection_id, fresh)
+    except (OSError, ValueError, KeyError) as e:
+        raise CatalogError(str(e))
+    return {
+        "kind": kind[:-1],
+        "title": collection["title"],
+        "links": [(track_link(storefront, track), track["name"]) for track in collection["tracks"]],
+        "albums": [track.get("album") for track in collection["tracks"]],  # None in older cache entries
+    }
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import threading
+import yaml
+from .paths import CONFIG_PATH
+
+# Define fields that should be integers
+integer_fields = {
+    'alac-max', 'atmos-max', 'limit-max', 'max-memory-limit', 'mv-max'
+}
+
+# Define fields that should be booleans
+boolean_fields = {
+    'embed-lrc', 'save-lrc-file', 'save-artist-cover', 'save-animated-artwork',
+    'emby-animated-artwork', 'embed-cover', 'get-m3u8-from-device',
+    'use-songinfo-for-playlist', 'dl-albumcover-for-playlist',
+    'convert-after-download', 'convert-keep-original', 'convert-skip-if-source-matches'
+}
+
+# Define fields that are folder paths and need Windows to WSL translation
+path_fields = {
+    'alac-save-folder', 'atmos-save-folder', 'aac-save-folder'
+}
+
+def translate_path_to_wsl(path):
+    """Translate Windows paths to WSL paths when saving config"""
+    if not path:
+        return path
+    # Check if it's a Windows-style path (e.g., C:/, D:/)
+    if len(path) >= 3 and path[1:3] == ':\\':
+        # Convert C:\ to /mnt/c/
+        drive = path[0].lower()
+        rest = path[3:].replace('\\', '/')
+        return f"/mnt/{drive}/{rest}"
+    elif len(path) >= 3 and path[1:3] == ':/':
+        # Convert C:/ to /mnt/c/
+        drive = path[0].lower()
+        rest = path[3:]
+        return f"/mnt/{drive}/{rest}"
+    return path
+
+def normalize_config(config_data):
+    """Return a copy of the downloader config with field types converted"""
+    normalized = {}
+    for key, value in config_data.items():
+        if key in integer_fields:
+            try:
+                normalized[key] = int(value) if value else 0
+            except (ValueError, TypeError):
+                normalized[key] = 0
+        elif key in boolean_fields:
+            # Handle boolean conversion
+            if isinstance(value, str):
+                normalized[key] = value.lower() in ('true', '1', 'yes', 'on')
+            else:
+                normalized[key] = bool(value)
+        elif key in path_fields:
+            # Translate Windows paths to WSL format
+            normalized[key] = translate_path_to_wsl(str(value)) if value is not None else value
+        else:
+            # Strings remain as strings (default)
+            normalized[key] = value
+    return normalized
+
+def validate_config(config_data):
+    """List fields whose type does not match integer_fields/boolean_fields/path_fields"""
+    problems = []
+    for key, value in config_data.items():
+        if key in integer_fields and (not isinstance(value, int) or isinstance(value, bool)):
+            problems.append(f"{key} should be an integer, got {value!r}")
+        elif key in boolean_fields and not isinstance(value, bool):
+            problems.append(f"{key} should be true/false, got {value!r}")
+        elif key in path_fields and value is not None and not isinstance(value, str):
+            problems.append(f"{key} should be a path, got {value!r}")
+    return problems
+
+class CachedYamlFile:
+    """YAML file parsed once and re-parsed only when its mtime/size changes.
+
+    load() returns the shared cached dict, callers must treat it as read-only.
+    """
+
+    def __init__(self, path, normalize=None, validate=None):
+        self.path = path
+        self.normalize = normalize
+        self.validate = validate
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.data = None
+        self.problems = []
+
+    def load(self):
+        stat = os.stat(self.path)  # raises FileNotFoundError like open() did
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self.stamp:
+            return self.data
+        with self.lock:
+            if stamp != self.stamp:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    data = yaml.safe_load(file) or {}
+                self.problems = self.validate(data) if self.validate else []
+                for problem in self.problems:
+                    print(f"⚠️ {os.path.basename(self.path)}: {problem}")
+                self.data = self.normalize(data) if self.normalize else data
+                self.stamp = stamp
+            return self.data
+
+    def get(self, key, default=None):
+        try:
+            return self.load().get(key, default)
+        except FileNotFoundError:
+            return default
+
+    def save(self, data):
+        """Write via temp file + rename so readers never see a half-written file"""
+        with self.lock:
+            directory = os.path.dirname(self.path) or "."
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".yaml")
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                    yaml.dump(data, file, default_flow_style=False, allow_unicode=True)
+                    file.flush()
+                    os.fsync(file.fileno())
+                if os.path.exists(self.path):
+                    os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777)
+                else:
+                    os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            # Force a re-stat on the next read
+            self.stamp = None
+
+downloader_config = CachedYamlFile(CONFIG_PATH, normalize=normalize_config, validate=validate_config)
+
+# Save folder per download format, with the downloader's defaults
+FORMAT_FOLDERS = {
+    "alac": ("alac-save-folder", "AM-DL downloads"),
+    "atmos": ("atmos-save-folder", "AM-DL-Atmos downloads"),
+    "aac": ("aac-save-folder", "AM-DL-AAC downloads"),
+}
+
+def download_folders():
+    """Save folders from config.yaml keyed by alac/atmos/aac"""
+    config = downloader_config.load()
+    return {name: config.get(key, default) for name, (key, default) in FORMAT_FOLDERS.items()}
@@ -0,0 +1,291 @@
+import os
+import queue
+import re
+import shlex
+import subprocess
+import threading
+import time
+from collections import deque
+from .config_store import downloader_config
+from .logstore import LogStore
+from .settings import get_setting
+from . import iomux, library, metrics, store
+
+# convert-after-download, run by the web UI instead of inside the downloader:
+# finished downloads hand their files to this pool so the download worker can
+# take the next link straight away. Each conversion is its own ffmpeg process,
+# and the pool runs one per CPU by default.
+
+# convert-format -> (output extension, ffmpeg codec args, keep cover art);
+# "copy" remuxes into the source's own container
+CONVERT_FORMATS = {
+    "flac": (".flac", ["-c:a", "flac"], True),
+    "mp3": (".mp3", ["-c:a", "libmp3lame", "-q:a", "2", "-id3v2_version", "3"], True),
+    "opus": (".opus", ["-c:a", "libopus", "-b:a", "192k"], False),
+    "wav": (".wav", ["-c:a", "pcm_s24le"], False),
+    "copy": (None, ["-c", "copy"], True),
+}
+CONVERTIBLE_EXTENSIONS = {".m4a", ".mp4"}
+DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+PROGRESS_RE = re.compile(r"^(\w+)=(\S*)$")  # ffmpeg -progress key=value lines
+
+tasks = {}
+tasks_lock = threading.Lock()
+task_queue = queue.Queue()
+workers = []
+
+logs = LogStore(name="convert", maxlen=5000)
+
+class Conversion:
+    """One downloaded file waiting for or going through ffmpeg"""
+
+    def __init__(self, conversion_id, job_id, source, target_format, created_at=None):
+        self.id = conversion_id
+        self.job_id = job_id
+        self.source = source
+        self.format = target_format
+        self.target = None
+        self.status = "queued"  # queued, running, completed, skipped, failed
+        self.error = None
+        self.percent = None
+        self.process = None
+        self.created_at = created_at or time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def save(self):
+        store.save_conversion(self.to_dict())
+
+    def log(self, line):
+        logs.append(f"[#{self.job_id}] {line}")
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        self.save()
+        metrics.inc("amdl_conversions_total", format=self.format, status=status)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "job_id": self.job_id,
+            "source": self.source,
+            "target": self.target,
+            "format": self.format,
+            "status": self.status,
+            "error": self.error,
+            "percent": self.percent,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+def enabled():
+    """True when config.yaml asks for conversion and the web UI runs it"""
+    try:
+        wanted = downloader_config.load().get("convert-after-download")
+    except Exception:
+        return False
+    return bool(wanted) and bool(get_setting("webui-conversion"))
+
+def downloader_overrides():
+    """config.yaml changes for a download whose conversion is done here"""
+    return {"convert-after-download": False} if enabled() else {}
+
+def target_format():
+    target = str(downloader_config.get("convert-format") or "flac").lower()
+    return target if target in CONVERT_FORMATS else None
+
+def target_path(source, target):
+    extension = CONVERT_FORMATS[target][0] or os.path.splitext(source)[1]
+    return os.path.splitext(source)[0] + extension
+
+def build_command(config, source, output, target):
+    _, codec_args, keep_cover = CONVERT_FORMATS[target]
+    cmd = [config.get("ffmpeg-path") or "ffmpeg", "-hide_banner", "-nostdin", "-y",
+           "-i", source, "-map_metadata", "0"]
+    if keep_cover:
+        cmd += ["-map", "0:a", "-map", "0:v?", "-c:v", "copy", "-disposition:v", "attached_pic"]
+    else:
+        cmd += ["-map", "0:a"]
+    cmd += codec_args + shlex.split(config.get("convert-extra-args") or "")
+    return cmd + ["-progress", "pipe:1", "-nostats", output]
+
+def submit_job_files(job):
+    """Queue the audio files a finished download wrote; returns how many were queued"""
+    target = target_format()
+    if not target:
+        job.log(f"⚠️ Unknown convert-format {downloader_config.get('convert-format')!r}, not converting")
+        return 0
+    queued = 0
+    for source in library.job_file_paths(job.id):
+        if os.path.splitext(source)[1].lower() not in CONVERTIBLE_EXTENSIONS:
+            continue
+        # A retried job lists the files of its earlier attempts again
+        converted = store.completed_conversion(source, target)
+        if converted and os.path.exists(converted):
+            continue
+        with tasks_lock:
+            if queued_for(source):
+                continue
+            conversion = Conversion(store.create_conversion(job.id, source, target), job.id, source, target)
+            tasks[conversion.id] = conversion
+        start(conversion)
+        queued += 1
+    if queued:
+        job.log(f"🔄 Queued {queued} file(s) for {target} conversion")
+    return queued
+
+def queued_for(source):
+    """The queued or running conversion of source, if any (tasks_lock held)"""
+    return next((conversion for conversion in tasks.values() if conversion.source == source), None)
+
+def enqueue(conversion):
+    """Queue a conversion unless its source is queued already; returns whether it was"""
+    with tasks_lock:
+        if queued_for(conversion.source):
+            return False
+        tasks[conversion.id] = conversion
+    start(conversion)
+    return True
+
+def start(conversion):
+    ensure_workers()
+    task_queue.put(conversion)
+
+def resume_unfinished_conversions():
+    """Re-queue conversions that were queued or running when the last engine stopped"""
+    resumed = []
+    for conversion_id in store.requeue_unfinished_conversions():
+        row = store.load_conversion(conversion_id)
+        conversion = Conversion(row["id"], row["job_id"], row["source"], row["format"], row["created_at"])
+        if enqueue(conversion):
+            resumed.append(conversion)
+        else:
+            conversion.finish("skipped", "duplicate of a queued conversion")
+    return resumed
+
+def count_conversions(status):
+    with tasks_lock:
+        return sum(1 for conversion in tasks.values() if conversion.status == status)
+
+def active_conversions():
+    """Compact progress of running conversions for status updates"""
+    with tasks_lock:
+        running = [conversion for conversion in tasks.values() if conversion.status == "running"]
+    return [{
+        "id": conversion.id,
+        "job_id": conversion.job_id,
+        "file": os.path.basename(conversion.source),
+        "format": conversion.format,
+        "percent": int(conversion.percent) if conversion.percent is not None else None,
+    } for conversion in running]
+
+class FfmpegOutput:
+    """Parses ffmpeg's output (on the I/O loop) into the conversion's percent"""
+
+    def __init__(self, conversion):
+        self.conversion = conversion
+        self.duration = None
+        self.output = deque(maxlen=10)  # ffmpeg's last words, for the failure log
+
+    def feed(self, line):
+        line = line.strip()
+        match = DURATION_RE.search(line)
+        if match and self.duration is None:
+            hours, minutes, seconds = match.groups()
+            self.duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            return
+        match = PROGRESS_RE.match(line)
+        if match:
+            if match.group(1) == "out_time_us" and self.duration and match.group(2).isdigit():
+                self.conversion.percent = min(100.0, int(match.group(2)) / 1e6 / self.duration * 100)
+        elif line:
+            self.output.append(line)
+
+def run_conversion(conversion):
+    config = downloader_config.load()
+    source = conversion.source
+    name = os.path.basename(source)
+    if not os.path.exists(source):
+        conversion.log(f"❌ {name}: file no longer exists")
+        conversion.finish("failed", "source missing")
+        return
+
+    target = target_path(source, conversion.format)
+    conversion.target = target
+    if config.get("convert-skip-if-source-matches") and \
+            os.path.splitext(source)[1].lower() == os.path.splitext(target)[1].lower():
+        conversion.log(f"⏭️ {name} is already {conversion.format}, skipping")
+        conversion.finish("skipped")
+        return
+
+    # Write next to the target and rename, so an interrupted run leaves no half
+    # file; the conversion ID keeps two runs for the same target apart
+    base, extension = os.path.splitext(target)
+    partial = f"{base}.part{conversion.id}{extension}"
+    cmd = build_command(config, source, partial, conversion.format)
+    conversion.status = "running"
+    conversion.started_at = time.time()
+    conversion.save()
+    conversion.log(f"🔄 Converting {name} to {conversion.format}")
+    try:
+        conversion.process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+    except Exception as e:
+        conversion.log(f"❌ Error starting ffmpeg: {str(e)}")
+        conversion.finish("failed", str(e))
+        return
+
+    ffmpeg = FfmpegOutput(conversion)
+    exit_code = iomux.watch(conversion.process, ffmpeg.feed).wait()
+    output = ffmpeg.output
+    metrics.observe("amdl_conversion_duration_seconds", time.time() - conversion.started_at,
+                    format=conversion.format)
+
+    if exit_code != 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        for line in output:
+            conversion.log(f"   {line}")
+        conversion.log(f"❌ Converting {name} failed with exit code: {exit_code}")
+        conversion.finish("failed", output[-1] if output else f"exit code {exit_code}")
+        return
+
+    os.replace(partial, target)
+    keep_source = bool(config.get("convert-keep-original"))
+    if target != source and not keep_source:
+        os.remove(source)
+    library.record_converted_file(conversion.job_id, source, target, keep_source)
+    conversion.percent = 100
+    conversion.log(f"✅ {os.path.basename(target)}")
+    conversion.finish("completed")
+
+def worker_loop():
+    while True:
+        conversion = task_queue.get()
+        try:
+            run_conversion(conversion)
+        except Exception as e:
+            conversion.log(f"❌ Unexpected conversion error: {str(e)}")
+            conversion.finish("failed", str(e))
+        finally:
+            # Finished conversions live on in the shared store only
+            with tasks_lock:
+                tasks.pop(conversion.id, None)
+            task_queue.task_done()
+
+def ensure_workers():
+    """Start the conversion pool (size from `conversion-workers`, default CPU count) once"""
+    with tasks_lock:
+        if workers:
+            return
+        count = max(1, int(get_setting("conversion-workers") or os.cpu_count() or 1))
+        for _ in range(count):
+            worker = threading.Thread(target=worker_loop, daemon=True)
+            worker.start()
+            workers.append(worker)
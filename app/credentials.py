@@ -0,0 +1,61 @@
+import base64
+import json
+import os
+from .paths import PROJECT_DIR
+
+def get_credentials_path(instance=0):
+    """Get the path to the credentials file (extra wrapper instances may have their own)"""
+    name = ".credentials" if instance == 0 else f".credentials-{instance}"
+    return os.path.join(PROJECT_DIR, name)
+
+def save_credentials(email, password, instance=0):
+    """Save credentials to file (base64 encoded for basic obfuscation)"""
+    try:
+        credentials = {
+            "email": base64.b64encode(email.encode()).decode(),
+            "password": base64.b64encode(password.encode()).decode()
+        }
+        with open(get_credentials_path(instance), 'w') as f:
+            json.dump(credentials, f)
+        return True
+    except Exception as e:
+        print(f"Error saving credentials: {e}")
+        return False
+
+def load_credentials(instance=0):
+    """Load and decode saved credentials"""
+    try:
+        credentials_path = get_credentials_path(instance)
+        if os.path.exists(credentials_path):
+            with open(credentials_path, 'r') as f:
+                credentials = json.load(f)
+            email = base64.b64decode(credentials["email"]).decode()
+            password = base64.b64decode(credentials["password"]).decode()
+            return email, password
+    except Exception as e:
+        print(f"Error loading credentials: {e}")
+    return None, None
+
+def save_pending_login(email, password):
+    """Hand a manual login to the engine process without putting the password in the database"""
+    return save_credentials(email, password, "pending")
+
+def take_pending_login():
+    """Credentials of a login forwarded by save_pending_login; the file is removed once read"""
+    email, password = load_credentials("pending")
+    delete_credentials("pending")
+    return email, password
+
+def has_own_credentials(instance):
+    return instance != 0 and os.path.exists(get_credentials_path(instance))
+
+def delete_credentials(instance=0):
+    """Delete saved credentials"""
+    try:
+        credentials_path = get_credentials_path(instance)
+        if os.path.exists(credentials_path):
+            os.remove(credentials_path)
+        return True
+    except Exception as e:
+        print(f"Error deleting credentials: {e}")
+        return False
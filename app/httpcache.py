@@ -0,0 +1,150 @@
+import gzip
+import hashlib
+import os
+import threading
+from flask import jsonify, request, url_for
+from . import app
+from .settings import get_setting
+
+try:
+    import brotli  # optional, preferred over gzip by clients that accept it
+except ImportError:
+    brotli = None
+
+# Bandwidth for remote browsers. Polled read endpoints answer with an ETag
+# over their JSON body, so an unchanged answer is a bodyless 304. Larger
+# text responses are compressed. Static files get a content hash in their
+# URL (asset_url) and may then be cached for a year without revalidation;
+# third-party scripts and styles come from static/vendor/ (installed by
+# provision.py, or by the engine at startup when an older install lacks
+# them). Pages only fall back to the CDN when `asset-cdn-fallback` is set, and
+# the log names every file that is missing either way.
+COMPRESS_MIN_BYTES = 1024
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "text/")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CDN_ASSETS = {
+    "vendor/axios.min.js": "https://cdn.jsdelivr.net/npm/axios@1.7.7/dist/axios.min.js",
+    "vendor/bootstrap.min.css": "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+}
+
+_lock = threading.Lock()
+_asset_hashes = {}      # path -> (mtime, size, hash)
+_compressed_static = {}  # (path, ETag, encoding) -> compressed bytes
+_cdn_warned = set()
+
+def conditional_json(payload):
+    """jsonify with a content-hash ETag; a matching If-None-Match gets 304"""
+    response = jsonify(payload)
+    response.add_etag(weak=True)  # weak: still valid once the body is compressed
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+def content_hash(path):
+    """Short hash of a file's bytes (cached until it changes), or None if it is missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    with _lock:
+        cached = _asset_hashes.get(path)
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    with _lock:
+        _asset_hashes[path] = (stat.st_mtime, stat.st_size, digest)
+    return digest
+
+@app.template_global()
+def asset_url(filename):
+    """URL of a static file that changes whenever its content does"""
+    version = content_hash(os.path.join(app.static_folder, filename))
+    if version is None and filename in CDN_ASSETS:
+        fallback = bool(get_setting("asset-cdn-fallback"))
+        if (filename, fallback) not in _cdn_warned:
+            _cdn_warned.add((filename, fallback))
+            if fallback:
+                print(f"⚠️ app/static/{filename} is missing, pages load it from {CDN_ASSETS[filename]}; "
+                      "install it with: python3 provision.py --assets-only")
+            else:
+                print(f"❌ app/static/{filename} is missing, pages will not load it; install it with: "
+                      "python3 provision.py --assets-only (or set asset-cdn-fallback: true in webui.yaml)")
+        if fallback:
+            return CDN_ASSETS[filename]
+    return url_for("static", filename=filename, v=version) if version else url_for("static", filename=filename)
+
+def install_missing_assets():
+    """Fetch the vendored scripts/styles in the background if they are missing (engine process only)"""
+    missing = [name for name in CDN_ASSETS if not os.path.exists(os.path.join(app.static_folder, name))]
+    if not missing:
+        return
+
+    def install():
+        try:
+            import provision  # project root, next to main.py
+            ok = provision.Provisioner(os.environ.get("AMDL_ARTIFACT_CACHE") or provision.DEFAULT_CACHE_DIR,
+                                       allow_unpinned=provision.unpinned_allowed()).install_assets()
+        except Exception as e:
+            ok = False
+            print(f"Error installing web assets: {e}")
+        if not ok:
+            print(f"⚠️ Could not install {', '.join(missing)}. "
+                  "Retry with: python3 provision.py --assets-only")
+    threading.Thread(target=install, daemon=True).start()
+
+def accepted_encoding():
+    if brotli and request.accept_encodings["br"]:
+        return "br"
+    if request.accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+def compress_static(response, encoding):
+    """Compressed bytes of a static file response, compressed once per file version"""
+    key = (request.path, response.headers.get("ETag"), encoding)
+    with _lock:
+        data = _compressed_static.get(key)
+    response.direct_passthrough = False
+    if data is not None:
+        response.close()  # the file send_file opened is not read
+    else:
+        data = compress(response.get_data(), encoding)
+        with _lock:
+            _compressed_static[key] = data
+    return data
+
+@app.after_request
+def cache_and_compress(response):
+    static = request.endpoint == "static"
+    if static and request.args.get("v") and response.status_code in (200, 304):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+
+    if response.status_code != 200 or "Content-Encoding" in response.headers \
+            or not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES):
+        return response
+    if response.is_streamed and not static:
+        return response  # /events and other generators
+    response.vary.add("Accept-Encoding")
+    length = response.content_length
+    encoding = accepted_encoding()
+    if not encoding or length is None or length < COMPRESS_MIN_BYTES:
+        return response
+
+    if static:
+        data = compress_static(response, encoding)
+    else:
+        data = compress(response.get_data(), encoding)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
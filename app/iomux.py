@@ -0,0 +1,178 @@
+import os
+import re
+import selectors
+import threading
+
+# One thread owns the stdout/stdin pipes of every child process (wrappers,
+# downloads, conversions) instead of a blocking reader thread per pipe.
+# Output is split into lines (\r redraws count as line breaks, as with
+# universal newlines) and handed to the watcher's on_line; when the pipe
+# closes and the process has exited, on_exit gets the exit code. Callbacks
+# run on the loop thread and must not block.
+LINE_BREAK_RE = re.compile(rb"\r\n|\r|\n")
+READ_SIZE = 65536
+REAP_INTERVAL = 0.1  # seconds between exit checks for processes whose output ended
+
+_lock = threading.Lock()
+_selector = None
+_wakeup = None       # (read fd, write fd) to interrupt select() from other threads
+_new_watches = []
+_pending_writes = set()
+_exiting = []        # watches whose output ended, waiting for the process to exit
+_loop_thread = None
+
+class Watch:
+    """A child process whose output is read by the loop"""
+
+    def __init__(self, process, on_line, on_exit=None):
+        self.process = process
+        self.on_line = on_line
+        self.on_exit = on_exit
+        self.buffer = b""
+        self.outbox = bytearray()  # bytes waiting to be written to stdin
+        self.exit_code = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the output is drained and the process has exited; returns the exit code"""
+        self.done.wait(timeout)
+        return self.exit_code
+
+    def feed(self, data):
+        parts = LINE_BREAK_RE.split(self.buffer + data)
+        self.buffer = parts.pop()
+        for part in parts:
+            self.dispatch(part)
+
+    def dispatch(self, raw):
+        try:
+            self.on_line(raw.decode("utf-8", "replace"))
+        except Exception as e:
+            print(f"Error handling output of process {self.process.pid}: {e}")
+
+def watch(process, on_line, on_exit=None):
+    """Read a Popen's stdout on the loop (it must be a binary PIPE); returns its Watch"""
+    watcher = Watch(process, on_line, on_exit)
+    os.set_blocking(process.stdout.fileno(), False)
+    if process.stdin:
+        os.set_blocking(process.stdin.fileno(), False)
+    with _lock:
+        _new_watches.append(watcher)
+    ensure_loop()
+    wake()
+    return watcher
+
+def write(watcher, text):
+    """Queue text for the process's stdin; the loop writes it when the pipe accepts it"""
+    if not watcher.process.stdin or watcher.process.stdin.closed:
+        raise BrokenPipeError("process stdin is closed")
+    with _lock:
+        watcher.outbox += text.encode("utf-8")
+        _pending_writes.add(watcher)
+    wake()
+
+def wake():
+    if _wakeup:
+        try:
+            os.write(_wakeup[1], b"\0")
+        except BlockingIOError:
+            pass  # already woken
+
+def ensure_loop():
+    global _selector, _wakeup, _loop_thread
+    with _lock:
+        if _loop_thread:
+            return
+        _selector = selectors.DefaultSelector()
+        _wakeup = os.pipe()
+        for fd in _wakeup:
+            os.set_blocking(fd, False)
+        _selector.register(_wakeup[0], selectors.EVENT_READ, None)
+        _loop_thread = threading.Thread(target=loop, daemon=True)
+        _loop_thread.start()
+
+def loop():
+    while True:
+        try:
+            run_once()
+        except Exception as e:
+            print(f"Error in process I/O loop: {e}")
+
+def run_once():
+    for key, _ in _selector.select(REAP_INTERVAL if _exiting else None):
+        if key.data is None:
+            try:
+                while os.read(_wakeup[0], 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            continue
+        watcher, stream = key.data
+        if stream == "stdout":
+            read_output(watcher)
+        else:
+            flush_input(watcher)
+
+    with _lock:
+        new_watches, _new_watches[:] = list(_new_watches), []
+        writes = list(_pending_writes)
+        _pending_writes.clear()
+    for watcher in new_watches:
+        _selector.register(watcher.process.stdout, selectors.EVENT_READ, (watcher, "stdout"))
+    for watcher in writes:
+        stdin = watcher.process.stdin
+        if stdin and not stdin.closed and stdin.fileno() not in _selector.get_map():
+            _selector.register(stdin, selectors.EVENT_WRITE, (watcher, "stdin"))
+
+    for watcher in list(_exiting):
+        exit_code = watcher.process.poll()
+        if exit_code is None:
+            continue
+        _exiting.remove(watcher)
+        watcher.exit_code = exit_code
+        if watcher.on_exit:
+            try:
+                watcher.on_exit(exit_code)
+            except Exception as e:
+                print(f"Error handling exit of process {watcher.process.pid}: {e}")
+        watcher.done.set()
+
+def read_output(watcher):
+    try:
+        data = os.read(watcher.process.stdout.fileno(), READ_SIZE)
+    except BlockingIOError:
+        return
+    except OSError:
+        data = b""
+    if data:
+        watcher.feed(data)
+        return
+    # End of output: flush the last partial line, then wait for the exit status
+    if watcher.buffer:
+        watcher.dispatch(watcher.buffer)
+        watcher.buffer = b""
+    _selector.unregister(watcher.process.stdout)
+    watcher.process.stdout.close()
+    stdin = watcher.process.stdin
+    if stdin and not stdin.closed:
+        if stdin.fileno() in _selector.get_map():
+            _selector.unregister(stdin)
+        try:
+            stdin.close()
+        except OSError:
+            pass
+    _exiting.append(watcher)
+
+def flush_input(watcher):
+    stdin = watcher.process.stdin
+    with _lock:
+        try:
+            written = os.write(stdin.fileno(), watcher.outbox)
+            del watcher.outbox[:written]
+        except BlockingIOError:
+            return
+        except OSError:
+            watcher.outbox.clear()  # the process closed its stdin or exited
+        empty = not watcher.outbox
+    if empty:
+        _selector.unregister(stdin)
@@ -0,0 +1,544 @@
+import random
+import signal
+import subprocess
+import threading
+import time
+from .builder import build_status, ensure_downloader_binary
+from .config_store import download_folders
+from .logstore import LogStore
+from .procstats import ProcessTree, process_table
+from .progress import JobProgress
+from .settings import get_setting
+from .scheduler import Scheduler, control_lock, signal_group, throttle_loop
+from . import catalog, converter, iomux, library, logfiles, metrics, store, wrappers
+
+FORMAT_ARGS = {
+    "ATMOS": ["--atmos"],
+    "AAC": ["--aac"],
+    "STANDARD": [],
+}
+
+# Which save folder each job format writes to
+FORMAT_FOLDERS = {
+    "ATMOS": "atmos",
+    "AAC": "aac",
+    "STANDARD": "alac",
+}
+
+MAX_REQUEUES = 3  # re-runs of a download whose wrapper died under it
+SAMPLE_INTERVAL = 1  # seconds between /proc samples of a running download
+RETRY_BACKOFF_MAX = 3600  # seconds; longest wait before an automatic retry
+CANCEL_GRACE = 5  # seconds a cancelled downloader gets to exit before SIGKILL
+
+jobs = {}  # queued and running jobs only; finished ones live in the shared store
+jobs_lock = threading.Lock()
+job_queue = Scheduler()  # priority lanes and concurrency caps, see scheduler
+workers = []
+
+# Hook set by routes: the shared downloader log
+shared_log = print
+
+class Job:
+    """A single downloader invocation and its status/log"""
+
+    def __init__(self, job_id, link, format_choice, created_at=None, output_folder=None, priority="normal",
+                 collection=None, title=None):
+        self.id = job_id
+        self.link = link
+        self.format = format_choice
+        self.priority = priority
+        self.collection = collection  # album/playlist link this track was expanded from
+        self.title = title
+        self.output_folder = output_folder
+        self.status = "queued"  # queued, running, completed, failed, cancelled
+        self.exit_code = None
+        self.logs = LogStore(name=f"job:{job_id}", maxlen=2000)
+        self.log_name = f"jobs/{job_id}"  # full output on disk, see logfiles
+        self.progress = JobProgress(self.id)
+        self.process = None
+        self.tree = None  # ProcessTree of the running download
+        self.throttled = False  # stopped by the bandwidth limit
+        self.paused = False     # held (queued) or stopped (running) by the user
+        self.paused_phase = None  # phase to go back to on resume
+        self.cancelled = False
+        self.wrapper = None
+        self.requeues = 0
+        self.retries = 0      # automatic retries after failures, see schedule_retry
+        self.retry_at = None  # the scheduler holds the job back until then
+        # Tracks ("Track N of M" numbers) finished over all attempts, and files written
+        self.checkpoint = {"tracks_total": None, "done": [], "files": 0}
+        self.created_at = created_at or time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def save(self):
+        """Publish the job's state to the shared store"""
+        store.save_job(self.to_dict())
+
+    def log(self, line):
+        self.logs.append(line)
+        logfiles.write(self.log_name, line)
+        shared_log(f"[#{self.id}] {line}")
+
+    def to_dict(self, include_logs=False):
+        data = {
+            "id": self.id,
+            "link": self.link,
+            "format": self.format,
+            "priority": self.priority,
+            "collection": self.collection,
+            "title": self.title,
+            "output_folder": self.output_folder,
+            "status": self.status,
+            "paused": self.paused,
+            "wrapper": self.wrapper.index if self.wrapper else None,
+            "exit_code": self.exit_code,
+            "retries": self.retries,
+            "retry_at": self.retry_at,
+            "checkpoint": self.checkpoint,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress.to_dict(),
+        }
+        if include_logs:
+            data["logs"] = self.logs.tail()
+        return data
+
+def resolve_format(format_choice, special_audio):
+    """Map the UI format selection to a job format, or None if invalid"""
+    if not special_audio:
+        return "STANDARD"
+    if format_choice in ("ATMOS", "AAC"):
+        return format_choice
+    return None
+
+def output_folder_for(format_choice):
+    try:
+        return download_folders()[FORMAT_FOLDERS[format_choice]]
+    except Exception:
+        return None  # config.yaml missing or unreadable
+
+def create_job(link, format_choice, priority="normal", collection=None, title=None):
+    """Record a download in the job history and return its ID"""
+    return store.create_job(link, format_choice, output_folder_for(format_choice), priority=priority,
+                            collection=collection, title=title)
+
+def submit_job(link, format_choice, priority="normal", collection=None, title=None):
+    """Record a download in the job history, queue it and return its Job"""
+    return enqueue_job(create_job(link, format_choice, priority, collection, title))
+
+def enqueue_job(job_id, resumed=False, retried=False):
+    """Queue a job already recorded in the job history (engine process only)"""
+    row = store.load_job(job_id)
+    job = Job(row["id"], row["link"], row["format"], row["created_at"], row["output_folder"], row["priority"],
+              row["collection"], row["title"])
+    job.retries = row["retries"]
+    job.retry_at = row["retry_at"]
+    job.checkpoint = row["checkpoint"] or job.checkpoint
+    with jobs_lock:
+        jobs[job.id] = job
+    if resumed:
+        job.log(f"♻️ Resuming {job.format.lower()} download after restart: {job.link}")
+    elif retried:
+        job.retry_at = None
+        job.log(f"🔁 Retrying {job.format.lower()} download: {job.link}")
+        job.save()
+    else:
+        lane = "" if job.priority == "normal" else f" ({job.priority} priority)"
+        name = f"{job.title} ({job.link})" if job.title else job.link
+        job.log(f"🕒 Queued {job.format.lower()} download{lane}: {name}")
+    ensure_workers()
+    job_queue.put(job)
+    return job
+
+def resume_unfinished_jobs():
+    """Re-queue jobs that were queued or running when the last engine stopped"""
+    return [enqueue_job(job_id, resumed=True) for job_id in store.requeue_unfinished_jobs()]
+
+def forget_job(job):
+    """Drop a finished job (already saved) from memory; history is read from the store"""
+    store.flush_logs()  # its last lines must be readable there right away
+    with jobs_lock:
+        if jobs.get(job.id) is job:
+            del jobs[job.id]
+
+def get_job(job_id):
+    with jobs_lock:
+        return jobs.get(job_id)
+
+def list_jobs():
+    with jobs_lock:
+        return list(jobs.values())
+
+def count_jobs(status):
+    with jobs_lock:
+        return sum(1 for job in jobs.values() if job.status == status)
+
+def running_job_dicts():
+    return [job.to_dict() for job in list_jobs() if job.status == "running"]
+
+def active_progress():
+    """Compact progress of running jobs for status updates"""
+    summaries = []
+    for job in list_jobs():
+        if job.status == "running":
+            progress = job.progress
+            summaries.append({
+                "id": job.id,
+                "phase": progress.phase,
+                "current_track": progress.current_track,
+                "tracks_done": progress.tracks_done,
+                "tracks_total": progress.tracks_total,
+                "percent": int(progress.percent) if progress.percent is not None else None,
+                "throughput_bps": progress.throughput_bps,
+                "throttled": job.throttled,
+                "paused": job.paused,
+            })
+    return summaries
+
+def handle_job_line(job, line):
+    """One line of downloader output (on the I/O loop)"""
+    line = line.strip()
+    if not line:
+        return
+    # Progress-bar redraws only update the progress record (and the log file)
+    if job.progress.feed(line):
+        logfiles.write(job.log_name, line)
+    else:
+        job.log(line)
+
+def sample_running_jobs():
+    """Charge each running download's process-tree CPU/RSS/I/O to its current phase"""
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        running = [(job, job.tree) for job in list_jobs() if job.tree and job.status == "running"]
+        # One /proc scan per tick, shared by every job's tree
+        table = process_table() if running else None
+        for job, tree in running:
+            try:
+                job.progress.account(tree.sample(table))
+            except Exception as e:
+                print(f"Error sampling job #{job.id} resources: {e}")
+
+def run_job(job):
+    """Run one queued job to completion on the current worker thread"""
+    # Hold the job until a wrapper is logged in rather than failing it
+    wrapper = None if job.cancelled else wrappers.acquire()
+    while not wrapper and not job.cancelled:
+        time.sleep(1)
+        wrapper = wrappers.acquire()
+    if job.cancelled:
+        if wrapper:
+            wrappers.release(wrapper)
+        finish_cancelled(job)
+        return
+    job.wrapper = wrapper
+    job.retry_at = None
+    generation = wrapper.generation
+    try:
+        run_with_wrapper(job, wrapper)
+    finally:
+        wrappers.release(wrapper)
+
+    # A download cut off by a wrapper crash waits for the restarted wrapper
+    wrapper_lost = wrapper.generation != generation or not wrapper.ready()
+    if job.status == "failed" and wrapper_lost and job.requeues < MAX_REQUEUES:
+        job.requeues += 1
+        job.status = "queued"
+        job.exit_code = job.started_at = job.finished_at = None
+        job.progress = JobProgress(job.id)
+        job.log(f"♻️ Wrapper went down during the download, re-queueing (attempt {job.requeues + 1})")
+        job.save()
+        job_queue.put(job)
+    elif job.status == "failed" and job.exit_code is not None and job.retries < int(get_setting("job-retries")):
+        schedule_retry(job)
+    elif job.status in ("completed", "failed", "cancelled"):
+        if job.status == "failed":
+            job.save()
+        metrics.inc("amdl_jobs_total", format=job.format, status=job.status)
+        if job.started_at:
+            metrics.observe("amdl_job_duration_seconds", job.finished_at - job.started_at,
+                            format=job.format, status=job.status)
+        for phase, entry in job.progress.phases().items():
+            metrics.inc("amdl_job_phase_seconds_total", entry["seconds"], format=job.format, phase=phase)
+
+def run_with_wrapper(job, wrapper):
+    binary = ensure_downloader_binary(log=job.log)
+    if not binary:
+        job.status = "failed"
+        job.finished_at = time.time()
+        job.log(f"❌ Failed to build downloader: {build_status['error']}")
+        return  # saved by run_job, see below
+
+    runs = pending_runs(job)
+    if runs[0][0] is not None:
+        job.log(f"🧩 Resuming from checkpoint: {len(runs)} of {job.checkpoint['tracks_total']} tracks still missing")
+
+    job.started_at = time.time()
+    job.status = "running"
+    job.save()
+    convert = converter.enabled()
+    job.exit_code = 0
+    for number, link in runs:
+        if number is not None:
+            job.log(f"🎯 Track {number} of {job.checkpoint['tracks_total']}")
+        exit_code = run_downloader(job, wrapper, binary, link, convert)
+        if job.cancelled:
+            discard_partial_track(job)
+        update_checkpoint(job, number, exit_code)
+        if job.cancelled:
+            break
+        if exit_code != 0:
+            job.exit_code = exit_code
+            # Later tracks would fail the same way without a wrapper or a binary
+            if exit_code is None or not wrapper.ready():
+                break
+
+    job.finished_at = time.time()
+    job.progress.finish(job.exit_code)
+    # Files finished before a failure count towards the checkpoint too
+    try:
+        library.record_job_files(job, FORMAT_FOLDERS[job.format], job.progress.files)
+        job.checkpoint["files"] = len(library.job_file_paths(job.id))
+    except Exception as e:
+        job.log(f"⚠️ Could not index downloaded files: {e}")
+    if job.cancelled:
+        finish_cancelled(job)
+        return
+    if job.exit_code == 0:
+        job.status = "completed"
+        job.log("✅ Download completed successfully!")
+        # Conversion runs in its own pool; this worker moves on to the next link
+        if convert:
+            try:
+                converter.submit_job_files(job)
+            except Exception as e:
+                job.log(f"⚠️ Could not queue files for conversion: {e}")
+    else:
+        job.status = "failed"
+        if job.exit_code is not None:
+            job.log(f"❌ Download failed with exit code: {job.exit_code}")
+        # Saved by run_job once it knows whether the job is queued again, so the
+        # history never shows it failed (and retryable) while it is re-queued
+        return
+    job.save()
+
+def run_downloader(job, wrapper, binary, link, convert):
+    """One downloader process for link; returns its exit code, or None if it did not start"""
+    cmd = [binary] + FORMAT_ARGS[job.format] + [link]
+    job.log(f"🎵 Starting {job.format.lower()} download: {link}")
+    job.log(f"⚡ Executing: {' '.join(cmd)}")
+    try:
+        cwd = wrapper.downloader_dir(converter.downloader_overrides() if convert else None)
+        if wrapper.index:
+            job.log(f"🔀 Using wrapper instance {wrapper.index}")
+        job.process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,  # apple-music-downloader directory, or this wrapper's config copy
+            start_new_session=True  # own process group, for pause/resume/cancel
+        )
+    except Exception as e:
+        job.log(f"❌ Error starting download: {str(e)}")
+        return None
+
+    job.tree = ProcessTree(job.process.pid)
+    exit_code = iomux.watch(job.process, lambda line: handle_job_line(job, line)).wait()
+    job.tree = None
+    return exit_code
+
+def pending_runs(job):
+    """(track number, link) for each downloader run the job still needs.
+
+    Without a checkpoint that is the whole link (number None). With one, each
+    missing track of the album/playlist is requested by its own song link; if
+    the collection cannot be listed the whole link runs again, and the
+    downloader skips the files that already exist.
+    """
+    done = set(job.checkpoint["done"])
+    if not done:
+        return [(None, job.link)]
+    try:
+        collection = catalog.resolve(job.link)
+    except catalog.CatalogError as e:
+        job.log(f"⚠️ Could not list the tracks of {job.link} ({e}), downloading the whole link again")
+        return [(None, job.link)]
+    if not collection or len(collection["links"]) != job.checkpoint["tracks_total"]:
+        return [(None, job.link)]
+    missing = [(number, link) for number, (link, _) in enumerate(collection["links"], 1) if number not in done]
+    return missing or [(None, job.link)]
+
+def update_checkpoint(job, number, exit_code):
+    """Fold one downloader run into the job's record of finished tracks"""
+    checkpoint = job.checkpoint
+    if number is None:
+        checkpoint["tracks_total"] = job.progress.tracks_total or checkpoint["tracks_total"]
+        done = set(job.progress.completed_tracks)
+        if exit_code == 0 and checkpoint["tracks_total"]:
+            done = set(range(1, checkpoint["tracks_total"] + 1))
+    else:
+        done = {number} if exit_code == 0 else set()
+    checkpoint["done"] = sorted(set(checkpoint["done"]) | done)
+    job.save()
+
+def discard_partial_track(job):
+    """Remove what a cancel left of the track in progress, so a resume downloads it again"""
+    progress = job.progress
+    if progress.current_track is None:
+        return
+    progress.completed_tracks.discard(progress.current_track)
+    if not progress.track_title or not progress.track_started_at:
+        return
+    try:
+        # The tracks it finished tell where its album directory is
+        library.record_job_files(job, FORMAT_FOLDERS[job.format], progress.files)
+        removed = library.remove_partial_files(job, progress.track_started_at, progress.track_title)
+    except Exception as e:
+        job.log(f"⚠️ Could not clean up the interrupted track: {e}")
+        return
+    if removed:
+        job.log(f"🧹 Removed {len(removed)} partial file(s) of track {progress.current_track}")
+
+def finish_cancelled(job):
+    job.status = "cancelled"
+    job.finished_at = time.time()
+    done, total = len(job.checkpoint["done"]), job.checkpoint["tracks_total"]
+    kept = f", {done} of {total} finished tracks kept for a resume" if done and total else ""
+    job.log(f"🛑 Download cancelled{kept}")
+    job.save()
+
+def pause_job(job_id):
+    """Hold a queued job, or stop a running downloader (SIGSTOP) and free its slot; False if not active"""
+    job = get_job(job_id)
+    with control_lock:
+        if not job or job.paused or job.cancelled:
+            return False
+        if job.status == "queued":
+            if not job_queue.hold(job):
+                return False  # a worker is starting it
+            job.log("⏸️ Held in the queue")
+        elif job.status == "running" and job.process and job.process.poll() is None:
+            job.paused = True
+            job.throttled = False  # the user's pause takes over from the bandwidth limit
+            signal_group(job.process, signal.SIGSTOP)
+            job.paused_phase = job.progress.phase
+            job.progress.set_phase("paused", time.time())
+            job_queue.release(job)
+            ensure_spare_workers()
+            job.log("⏸️ Paused")
+        else:
+            return False
+        job.save()
+        return True
+
+def resume_job(job_id):
+    """Let a paused job continue; False if it is not paused"""
+    job = get_job(job_id)
+    with control_lock:
+        if not job or not job.paused:
+            return False
+        job.paused = False
+        if job.status == "running" and job.process:
+            job_queue.reclaim(job)
+            job.progress.set_phase(job.paused_phase or "download", time.time())
+            signal_group(job.process, signal.SIGCONT)
+        job_queue.notify()
+        job.log("▶️ Resumed")
+        job.save()
+        return True
+
+def cancel_job(job_id):
+    """Stop a job for good: dequeue it, or terminate its downloader (then kill it after CANCEL_GRACE)"""
+    job = get_job(job_id)
+    if not job or job.cancelled or job.status not in ("queued", "running"):
+        return False
+    with control_lock:
+        if job.paused:
+            resume_job(job_id)
+        job.cancelled = True
+    if job.status == "queued":
+        if job_queue.remove(job):
+            finish_cancelled(job)
+            forget_job(job)  # never reached a worker
+        return True  # otherwise a worker just took it, and run_job stops it
+    process = job.process
+    if process:
+        threading.Thread(target=terminate_process, args=(process,), daemon=True).start()
+    return True
+
+def terminate_process(process):
+    signal_group(process, signal.SIGTERM)
+    signal_group(process, signal.SIGCONT)  # a throttled group only sees SIGTERM once it runs
+    try:
+        process.wait(CANCEL_GRACE)
+    except subprocess.TimeoutExpired:
+        signal_group(process, signal.SIGKILL)
+
+def schedule_retry(job):
+    """Queue a failed download again after an exponential backoff"""
+    job.retries += 1
+    delay = min(RETRY_BACKOFF_MAX, float(get_setting("retry-backoff-seconds")) * 2 ** (job.retries - 1))
+    delay *= random.uniform(0.8, 1.2)  # spread out the retries of a batch that failed together
+    done, total = len(job.checkpoint["done"]), job.checkpoint["tracks_total"]
+    kept = f", {done} of {total} tracks already done" if done and total else ""
+    job.log(f"🔁 Retrying in {delay:.0f}s (retry {job.retries} of {get_setting('job-retries')}){kept}")
+    job.status = "queued"
+    job.exit_code = job.started_at = job.finished_at = None
+    job.progress = JobProgress(job.id)
+    job.retry_at = time.time() + delay
+    job.save()
+    metrics.inc("amdl_job_retries_total", format=job.format)
+    job_queue.put(job)
+
+def worker_loop():
+    while True:
+        job = job_queue.take()
+        try:
+            run_job(job)
+        except Exception as e:
+            job.status = "failed"
+            job.finished_at = time.time()
+            job.log(f"❌ Unexpected error: {str(e)}")
+            job.save()
+        finally:
+            if job.paused:
+                # Its downloader ended while stopped; the slot was given back on pause
+                job.paused = False
+                job_queue.notify()
+            else:
+                job_queue.done(job)
+            logfiles.close(job.log_name)
+            if job.status in ("completed", "failed", "cancelled"):
+                forget_job(job)
+
+def pool_size():
+    """`download-workers`, or more when `download-concurrency` allows more downloads at once"""
+    return max(1, int(get_setting("download-workers")), int(get_setting("download-concurrency") or 0))
+
+def ensure_spare_workers():
+    """One worker per download slot plus one per paused download, so pausing frees a slot for real"""
+    paused = sum(1 for job in list_jobs() if job.paused and job.status == "running")
+    with jobs_lock:
+        while len(workers) < pool_size() + paused:
+            worker = threading.Thread(target=worker_loop, daemon=True)
+            worker.start()
+            workers.append(worker)
+
+def ensure_workers():
+    """Start the worker pool (see pool_size) once; later calls grow it to a raised limit"""
+    with jobs_lock:
+        started = bool(workers)
+    if started:
+        ensure_spare_workers()
+        return
+    with jobs_lock:
+        if workers:
+            return
+        for _ in range(pool_size()):
+            worker = threading.Thread(target=worker_loop, daemon=True)
+            worker.start()
+            workers.append(worker)
+        threading.Thread(target=sample_running_jobs, daemon=True).start()
+        threading.Thread(target=throttle_loop, args=(list_jobs,), daemon=True).start()
@@ -0,0 +1,485 @@
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from . import metrics, store
+from .config_store import download_folders
+from .paths import AMD_DIR
+from .settings import get_setting
+
+try:
+    import mutagen  # optional, used for artist/album/title tags
+except ImportError:
+    mutagen = None
+
+AUDIO_EXTENSIONS = {".m4a", ".mp4", ".flac", ".mp3", ".opus", ".ogg", ".wav", ".aac", ".ec3", ".ac3"}
+TRACK_NAME_RE = re.compile(r"^(\d+)[.\s_-]+(.+)$")
+PARTIAL_SUFFIXES = (".part", ".tmp")  # unfinished files, see remove_partial_files
+
+library_status = {
+    "files": 0,
+    "refreshing": False,
+    "last_refresh": None,
+    "last_refresh_seconds": None,
+    "dirs_rescanned": 0,
+}
+refresh_lock = threading.Lock()
+
+# Sort keys accepted by query_library and the columns they order by
+SORT_COLUMNS = {
+    "artist": ["artist", "album", "track_number", "track"],
+    "album": ["album", "track_number", "track"],
+    "track": ["track"],
+    "number": ["track_number"],
+    "size": ["size"],
+    "modified": ["mtime"],
+    "folder": ["folder", "artist", "album", "track_number"],
+}
+QUERY_CACHE_SIZE = 256
+JOB_FILES_GRACE = 24 * 3600  # superseded jobs keep their file lists this long after finishing
+
+# Listings are cached per index version; any change to the index bumps it
+query_cache = OrderedDict()
+query_cache_version = None
+query_cache_lock = threading.Lock()
+
+def resolve_folder(folder):
+    """Save folders in config.yaml are relative to the downloader directory"""
+    return os.path.normpath(os.path.join(AMD_DIR, os.path.expanduser(folder)))
+
+def first_tag(tags, key):
+    values = tags.get(key) if tags else None
+    return str(values[0]) if values else None
+
+def identify(root, path):
+    """Artist/album/track for a file, from tags when available, else from its path.
+
+    The downloader lays files out as <folder>/<artist>/<album>/<NN. track>.ext
+    (the artist level is optional).
+    """
+    parts = os.path.relpath(path, root).split(os.sep)
+    stem = os.path.splitext(parts[-1])[0]
+    identity = {
+        "artist": parts[-3] if len(parts) >= 3 else None,
+        "album": parts[-2] if len(parts) >= 2 else None,
+        "track": stem,
+        "track_number": None,
+    }
+    match = TRACK_NAME_RE.match(stem)
+    if match:
+        identity["track_number"] = int(match.group(1))
+        identity["track"] = match.group(2)
+
+    if mutagen:
+        try:
+            tags = mutagen.File(path, easy=True)
+        except Exception:
+            tags = None
+        for key, tag in (("artist", "albumartist"), ("artist", "artist"), ("album", "album"), ("track", "title")):
+            value = first_tag(tags, tag)
+            if value:
+                identity[key] = value
+        number = first_tag(tags, "tracknumber")
+        if number and number.split("/")[0].isdigit():
+            identity["track_number"] = int(number.split("/")[0])
+    return identity
+
+def index_directory(conn, name, root, directory, entries):
+    """Re-index the audio files directly inside one changed directory"""
+    known = {row["path"]: (row["size"], row["mtime"]) for row in conn.execute(
+        "SELECT path, size, mtime FROM library_files WHERE dir = ?", (directory,))}
+    present = set()
+    for entry in entries:
+        if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in AUDIO_EXTENSIONS:
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        present.add(entry.path)
+        if known.get(entry.path) == (stat.st_size, stat.st_mtime):
+            continue
+        identity = identify(root, entry.path)
+        conn.execute(
+            "INSERT OR REPLACE INTO library_files (path, dir, folder, size, mtime, artist, album, track, track_number) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (entry.path, directory, name, stat.st_size, stat.st_mtime,
+             identity["artist"], identity["album"], identity["track"], identity["track_number"])
+        )
+    removed = [(path,) for path in known if path not in present]
+    conn.executemany("DELETE FROM library_files WHERE path = ?", removed)
+
+def scan_folder(name, root):
+    """Incrementally index one save folder; only directories whose mtime changed are re-read.
+
+    Returns the number of directories re-indexed or dropped.
+    """
+    conn = store.connect()
+    prefix = root.rstrip(os.sep) + os.sep
+    known_dirs = {row["path"]: row["mtime"] for row in conn.execute(
+        "SELECT path, mtime FROM library_dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+        (root, len(prefix), prefix))}
+    seen = set()
+    rescanned = 0
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            mtime = os.stat(directory).st_mtime
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        seen.add(directory)
+        stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+        if known_dirs.get(directory) == mtime:
+            continue
+        conn.execute("BEGIN")
+        try:
+            index_directory(conn, name, root, directory, entries)
+            conn.execute("INSERT OR REPLACE INTO library_dirs (path, mtime) VALUES (?, ?)", (directory, mtime))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        rescanned += 1
+
+    # Directories that disappeared take their files with them
+    for directory in set(known_dirs) - seen:
+        conn.execute("DELETE FROM library_files WHERE dir = ?", (directory,))
+        conn.execute("DELETE FROM library_dirs WHERE path = ?", (directory,))
+        rescanned += 1
+    return rescanned
+
+def trim_index(roots):
+    """Drop what no lookup reads anymore; returns the number of directories dropped.
+
+    That is the index of folders no longer configured as save folders, and
+    the file lists of finished jobs a newer completed download of the same
+    link and format has replaced (completed_download only reads the newest).
+    """
+    conn = store.connect()
+    prefixes = tuple(root.rstrip(os.sep) + os.sep for root in roots)
+    stale = [row["path"] for row in conn.execute("SELECT path FROM library_dirs")
+             if row["path"] not in roots and not row["path"].startswith(prefixes)]
+    for directory in stale:
+        conn.execute("DELETE FROM library_files WHERE dir = ?", (directory,))
+        conn.execute("DELETE FROM library_dirs WHERE path = ?", (directory,))
+    conn.execute(
+        "DELETE FROM job_files WHERE job_id IN (SELECT id FROM jobs AS old WHERE finished_at < ? "
+        "AND EXISTS (SELECT 1 FROM jobs WHERE link = old.link AND format = old.format "
+        "AND status = 'completed' AND id > old.id))",
+        (time.time() - JOB_FILES_GRACE,)
+    )
+    conn.execute("DELETE FROM job_files WHERE job_id NOT IN (SELECT id FROM jobs)")
+    return len(stale)
+
+def index_directories(name, root, directories):
+    """Re-index just these directories of one save folder, without walking the rest"""
+    conn = store.connect()
+    indexed = 0
+    for directory in directories:
+        try:
+            mtime = os.stat(directory).st_mtime
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        conn.execute("BEGIN")
+        try:
+            index_directory(conn, name, root, directory, entries)
+            conn.execute("INSERT OR REPLACE INTO library_dirs (path, mtime) VALUES (?, ?)", (directory, mtime))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        indexed += 1
+    if indexed:
+        store.set_state("library_version", store.get_state("library_version", 0) + 1)
+    return indexed
+
+def changed_directories(root):
+    """Directories of a save folder that changed since they were indexed.
+
+    Indexed directories are only stat'ed; just the changed ones are listed,
+    which is where new directories (a new album or artist) show up.
+    """
+    prefix = root.rstrip(os.sep) + os.sep
+    known = {row["path"]: row["mtime"] for row in store.connect().execute(
+        "SELECT path, mtime FROM library_dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+        (root, len(prefix), prefix))}
+    pending = [root] if root not in known else []
+    for directory, mtime in known.items():
+        try:
+            if os.stat(directory).st_mtime != mtime:
+                pending.append(directory)
+        except OSError:
+            continue  # gone; the next full refresh drops it
+    changed = []
+    while pending:
+        directory = pending.pop()
+        changed.append(directory)
+        try:
+            with os.scandir(directory) as it:
+                pending.extend(entry.path for entry in it
+                               if entry.is_dir(follow_symlinks=False) and entry.path not in known)
+        except OSError:
+            continue
+    return changed
+
+def refresh_library(names=None):
+    """Bring the index of the ALAC/Atmos/AAC save folders up to date"""
+    with refresh_lock:
+        library_status["refreshing"] = True
+        started = time.time()
+        rescanned = 0
+        try:
+            folders = {name: resolve_folder(folder) for name, folder in download_folders().items()}
+            for name, root in folders.items():
+                if names is None or name in names:
+                    rescanned += scan_folder(name, root)
+            if names is None:
+                rescanned += trim_index(set(folders.values()))
+        finally:
+            library_status["refreshing"] = False
+        library_status.update(
+            files=store.connect().execute("SELECT COUNT(*) FROM library_files").fetchone()[0],
+            last_refresh=time.time(),
+            last_refresh_seconds=round(time.time() - started, 3),
+            dirs_rescanned=rescanned,
+        )
+        if rescanned:
+            store.set_state("library_version", store.get_state("library_version", 0) + 1)
+        store.set_state("library_status", library_status)
+        return rescanned
+
+def record_job_files(job, folder_name, reported):
+    """Remember which indexed files a job produced (after each attempt).
+
+    `reported` holds (file name or path, time) for each "Decrypted <name>" line
+    of the downloader. Downloads run side by side in the same folders, so only
+    files it named are taken, from the job's album directory: the one that
+    already holds its files, else the one holding most of them. A name found
+    in several albums goes to the file written closest to when it was reported.
+
+    Only the directories the files are in are re-indexed: those of reported
+    paths and earlier attempts, else the directories that changed.
+    """
+    if not reported:
+        return
+    root = resolve_folder(download_folders()[folder_name])
+    conn = store.connect()
+    since = (job.started_at or job.created_at) - 1
+    reported_at = {os.path.basename(name): at for name, at in reported}
+    own_dirs = set(job_dirs(job.id))
+    dirs = own_dirs | {os.path.dirname(name) for name, _ in reported if os.path.isabs(name)}
+    index_directories(folder_name, root, dirs)
+    candidates = reported_rows(conn, folder_name, since, reported_at, dirs)
+    if len(candidates) < len(reported_at):
+        index_directories(folder_name, root, changed_directories(root))
+        candidates = reported_rows(conn, folder_name, since, reported_at)
+    votes = Counter(row["dir"] for rows in candidates.values() for row in rows)
+
+    # Retries record the job's files again; only count the bytes new since the last attempt
+    before = conn.execute("SELECT SUM(size) FROM job_files WHERE job_id = ?", (job.id,)).fetchone()[0]
+    for name, rows in candidates.items():
+        row = max(rows, key=lambda row: (row["dir"] in own_dirs, votes[row["dir"]],
+                                         -abs(row["mtime"] - reported_at[name])))
+        conn.execute(
+            "INSERT OR REPLACE INTO job_files (job_id, path, size, artist, album, track) VALUES (?, ?, ?, ?, ?, ?)",
+            (job.id, row["path"], row["size"], row["artist"], row["album"], row["track"])
+        )
+    written = conn.execute("SELECT SUM(size) FROM job_files WHERE job_id = ?", (job.id,)).fetchone()[0]
+    metrics.inc("amdl_bytes_written_total", max(0, (written or 0) - (before or 0)), folder=folder_name)
+
+def reported_rows(conn, folder_name, since, reported_at, dirs=None):
+    """Indexed files written since `since` named like a reported file, by name (optionally only in dirs)"""
+    query = "SELECT path, dir, size, mtime, artist, album, track FROM library_files WHERE folder = ? AND mtime >= ?"
+    params = [folder_name, since]
+    if dirs is not None:
+        if not dirs:
+            return {}
+        query += f" AND dir IN ({', '.join('?' * len(dirs))})"
+        params += sorted(dirs)
+    candidates = {}
+    for row in conn.execute(query, params):
+        name = os.path.basename(row["path"])
+        if name in reported_at:
+            candidates.setdefault(name, []).append(row)
+    return candidates
+
+def job_file_paths(job_id):
+    return [row["path"] for row in store.connect().execute(
+        "SELECT path FROM job_files WHERE job_id = ? ORDER BY path", (job_id,))]
+
+def job_dirs(job_id):
+    """Directories the files recorded for a job are in (its album directory)"""
+    return sorted({os.path.dirname(path) for path in job_file_paths(job_id)})
+
+def track_name(file_name):
+    """Track title in a downloader file name ("NN. Title.ext"), with or without a partial suffix"""
+    for suffix in PARTIAL_SUFFIXES:
+        if file_name.endswith(suffix):
+            file_name = file_name[:-len(suffix)]
+    stem = os.path.splitext(file_name)[0]
+    match = TRACK_NAME_RE.match(stem)
+    return match.group(2) if match else stem
+
+def remove_partial_files(job, since, title):
+    """Delete the files of a track a cancel interrupted; returns the removed paths.
+
+    Only the job's album directory (where its recorded files are) is looked
+    at, and only files named exactly after the track, written since `since`
+    and not recorded as a finished file of any job.
+    """
+    conn = store.connect()
+    removed = []
+    for directory in job_dirs(job.id):
+        try:
+            with os.scandir(directory) as it:
+                entries = [entry for entry in it if entry.is_file() and track_name(entry.name) == title]
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < since - 1:
+                    continue
+            except OSError:
+                continue
+            if conn.execute("SELECT 1 FROM job_files WHERE path = ?", (entry.path,)).fetchone():
+                continue
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            conn.execute("DELETE FROM library_files WHERE path = ?", (entry.path,))
+            removed.append(entry.path)
+    return removed
+
+def record_converted_file(job_id, source, target, keep_source):
+    """Add a converted file to its job's files, replacing the source unless it was kept"""
+    conn = store.connect()
+    identity = conn.execute(
+        "SELECT artist, album, track FROM job_files WHERE job_id = ? AND path = ?", (job_id, source)
+    ).fetchone()
+    if not keep_source and source != target:
+        conn.execute("DELETE FROM job_files WHERE job_id = ? AND path = ?", (job_id, source))
+    conn.execute(
+        "INSERT OR REPLACE INTO job_files (job_id, path, size, artist, album, track) VALUES (?, ?, ?, ?, ?, ?)",
+        (job_id, target, os.path.getsize(target), *(identity or (None, None, None)))
+    )
+
+def still_present(conn, folder_name, file):
+    """Whether a recorded job file is in the library: by artist/album/track, else by path and size"""
+    if file["track"]:
+        row = conn.execute(
+            "SELECT path FROM library_files WHERE track = ? AND album IS ? AND artist IS ? AND folder = ? LIMIT 1",
+            (file["track"], file["album"], file["artist"], folder_name)
+        ).fetchone()
+        return bool(row) and os.path.exists(row["path"])
+    try:
+        return os.path.getsize(file["path"]) == file["size"]
+    except OSError:
+        return False
+
+def completed_download(link, format_choice, folder_name):
+    """ID of an earlier completed job for this link/format whose tracks are all still in the library"""
+    conn = store.connect()
+    row = conn.execute(
+        "SELECT id FROM jobs WHERE link = ? AND format = ? AND status = 'completed' ORDER BY id DESC LIMIT 1",
+        (link, format_choice)
+    ).fetchone()
+    if not row:
+        return None
+    files = conn.execute("SELECT path, size, artist, album, track FROM job_files WHERE job_id = ?",
+                         (row["id"],)).fetchall()
+    if not files or not all(still_present(conn, folder_name, file) for file in files):
+        return None
+    return row["id"]
+
+def indexed_tracks(folder_name, tracks):
+    """The (album, track) pairs of tracks that are already in a save folder's index"""
+    wanted = {(album.casefold(), track.casefold()): (album, track) for album, track in tracks if album and track}
+    found = set()
+    conn = store.connect()
+    names = sorted({track for _, track in wanted.values()})
+    for start in range(0, len(names), 500):
+        chunk = names[start:start + 500]
+        for row in conn.execute(
+                f"SELECT album, track FROM library_files WHERE folder = ? AND track IN ({', '.join('?' * len(chunk))})",
+                [folder_name] + chunk):
+            key = ((row["album"] or "").casefold(), row["track"].casefold())
+            if key in wanted:
+                found.add(wanted[key])
+    return found
+
+def like_pattern(text, prefix):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%" if prefix else "%" + escaped + "%"
+
+def run_query(search, match, folder, artist, album, sort, descending, limit, offset):
+    conditions, params = [], []
+    if search:
+        # Prefix matches can use the artist/album/track indexes, substrings scan
+        pattern = like_pattern(search, match == "prefix")
+        conditions.append("(artist LIKE ? ESCAPE '\\' OR album LIKE ? ESCAPE '\\' OR track LIKE ? ESCAPE '\\')")
+        params += [pattern] * 3
+    for column, value in (("folder", folder), ("artist", artist), ("album", album)):
+        if value:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    direction = " DESC" if descending else ""
+    order = ", ".join(column + direction for column in SORT_COLUMNS[sort] + ["path"])
+    conn = store.connect()
+    total = conn.execute(f"SELECT COUNT(*) FROM library_files{where}", params).fetchone()[0]
+    rows = conn.execute(
+        "SELECT path, folder, artist, album, track, track_number, size, mtime "
+        f"FROM library_files{where} ORDER BY {order} LIMIT ? OFFSET ?",
+        params + [limit, offset]
+    ).fetchall()
+    return {"total": total, "files": [dict(row) for row in rows]}
+
+def query_library(search=None, match="substring", folder=None, artist=None, album=None,
+                  sort="artist", descending=False, limit=100, offset=0):
+    """One page of indexed files, filtered by search text and exact folder/artist/album.
+
+    Raises ValueError for an unknown sort key or match mode.
+    """
+    global query_cache_version
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort key: {sort}")
+    if match not in ("prefix", "substring"):
+        raise ValueError(f"Unknown match mode: {match}")
+
+    version = store.get_state("library_version", 0)
+    key = (search, match, folder, artist, album, sort, descending, limit, offset)
+    with query_cache_lock:
+        if version != query_cache_version:
+            query_cache.clear()
+            query_cache_version = version
+        if key in query_cache:
+            query_cache.move_to_end(key)
+            return query_cache[key]
+
+    page = run_query(search, match, folder, artist, album, sort, descending, limit, offset)
+    page["version"] = version
+    with query_cache_lock:
+        if version == query_cache_version:
+            query_cache[key] = page
+            if len(query_cache) > QUERY_CACHE_SIZE:
+                query_cache.popitem(last=False)
+    return page
+
+def start_library_refresher():
+    """Build the index once, then keep it current in the background"""
+    def loop():
+        while True:
+            try:
+                refresh_library()
+            except Exception as e:
+                print(f"Error refreshing library index: {e}")
+            time.sleep(max(10, int(get_setting("library-refresh-seconds"))))
+    threading.Thread(target=loop, daemon=True).start()
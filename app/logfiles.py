@@ -0,0 +1,207 @@
+import gzip
+import itertools
+import json
+import os
+import shutil
+import threading
+from .paths import PROJECT_DIR
+from .settings import get_setting
+
+# Full output of every job (logs/jobs/<id>) and wrapper session
+# (logs/wrappers/<index>/<started>) on disk. Lines are handed to a background
+# writer and appended in batches; a file that grows past `log-file-bytes` is
+# gzipped into a numbered segment, and so is the last one when the log closes.
+# <name>.index.json records each segment's line and byte counts so a range
+# read only decompresses the segments it covers. Registered secrets (the
+# wrapper password) are masked before a line is queued.
+LOG_DIR = os.path.join(PROJECT_DIR, "logs")
+FLUSH_INTERVAL = 0.5  # seconds between batched writes
+
+_lock = threading.Lock()
+_wake = threading.Condition(_lock)
+_pending = {}    # name -> [lines] waiting for the writer
+_closing = set()
+_open_files = {}  # name -> LogFile, writer thread only
+_writer = None
+_secrets = set()  # passwords and the like, masked before anything is queued
+
+def add_secret(text):
+    """Never write `text` to a log file (see redact)"""
+    if text:
+        with _lock:
+            _secrets.add(text)
+
+def redact(line):
+    for secret in tuple(_secrets):
+        if secret in line:
+            line = line.replace(secret, "***")
+    return line
+
+def base_path(name):
+    return os.path.join(LOG_DIR, *name.split("/"))
+
+def load_index(name):
+    try:
+        with open(base_path(name) + ".index.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+class LogFile:
+    """The active (uncompressed) file of one log and its compressed segments"""
+
+    def __init__(self, name):
+        self.name = name
+        self.base = base_path(name)
+        self.active = self.base + ".log"
+        self.segments = load_index(name)
+        os.makedirs(os.path.dirname(self.base), exist_ok=True)
+        self.handle = open(self.active, "a", encoding="utf-8")
+        self.bytes = self.handle.tell()
+        self.lines = count_lines(self.active) if self.bytes else 0
+
+    def write(self, lines):
+        limit = int(get_setting("log-file-bytes"))
+        chunk = []
+        for line in lines:
+            chunk.append(line + "\n")
+            self.bytes += len(chunk[-1].encode("utf-8"))
+            self.lines += 1
+            if self.bytes >= limit:
+                self.handle.write("".join(chunk))
+                chunk = []
+                self.seal()
+                self.handle = open(self.active, "a", encoding="utf-8")
+        self.handle.write("".join(chunk))
+        self.handle.flush()
+
+    def seal(self):
+        """Compress the active file into the next segment"""
+        self.handle.close()
+        if not self.lines:
+            os.remove(self.active)
+            return
+        segment = f"{os.path.basename(self.base)}.{len(self.segments) + 1}.log.gz"
+        with open(self.active, "rb") as source, gzip.open(os.path.join(os.path.dirname(self.base), segment), "wb") as target:
+            shutil.copyfileobj(source, target)
+        self.segments.append({"file": segment, "lines": self.lines, "bytes": self.bytes})
+        tmp_path = self.base + ".index.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.segments, f)
+        os.replace(tmp_path, self.base + ".index.json")
+        os.remove(self.active)
+        self.lines = self.bytes = 0
+
+def count_lines(path):
+    with open(path, "rb") as f:
+        return sum(block.count(b"\n") for block in iter(lambda: f.read(1024 * 1024), b""))
+
+def write(name, line):
+    """Queue a line for the log file `name` (e.g. "jobs/12"); never blocks on disk"""
+    with _lock:
+        _pending.setdefault(name, []).append(redact(line))
+    ensure_writer()
+
+def close(name):
+    """Flush and compress the log once its queued lines are written"""
+    with _lock:
+        _closing.add(name)
+        _wake.notify()
+    ensure_writer()
+
+def flush_pending():
+    global _pending
+    with _lock:
+        batch, _pending = _pending, {}
+        closing = set(_closing)
+        _closing.clear()
+    for name, lines in batch.items():
+        try:
+            if name not in _open_files:
+                _open_files[name] = LogFile(name)
+            _open_files[name].write(lines)
+        except Exception as e:
+            print(f"Error writing log file {name}: {e}")
+    for name in closing:
+        log_file = _open_files.pop(name, None)
+        try:
+            if log_file:
+                log_file.seal()
+        except Exception as e:
+            print(f"Error closing log file {name}: {e}")
+
+def ensure_writer():
+    global _writer
+    if _writer:
+        return
+    with _lock:
+        if _writer:
+            return
+
+        def loop():
+            while True:
+                with _wake:
+                    _wake.wait(FLUSH_INTERVAL)
+                flush_pending()
+        _writer = threading.Thread(target=loop, daemon=True)
+        _writer.start()
+
+# --- Reading ---
+
+def parts(name):
+    """(path, lines, bytes, compressed) for each segment and the active file, oldest first"""
+    directory = os.path.dirname(base_path(name))
+    result = [(os.path.join(directory, segment["file"]), segment["lines"], segment["bytes"], True)
+              for segment in load_index(name)]
+    active = base_path(name) + ".log"
+    if os.path.exists(active):
+        result.append((active, count_lines(active), os.path.getsize(active), False))
+    return result
+
+def open_part(path, compressed):
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+def exists(name):
+    return bool(parts(name))
+
+def read_lines(name, offset=0, limit=1000):
+    """Lines [offset, offset + limit) of a log and its total line count"""
+    lines, total = [], 0
+    for path, count, _, compressed in parts(name):
+        start = total
+        total += count
+        if len(lines) >= limit or offset >= total:
+            continue
+        with open_part(path, compressed) as f:
+            wanted = itertools.islice(f, max(offset - start, 0), max(offset - start, 0) + limit - len(lines))
+            lines.extend(line.decode("utf-8", "replace").rstrip("\n") for line in wanted)
+    return lines, total
+
+def read_bytes(name, offset=0, limit=65536):
+    """Uncompressed bytes [offset, offset + limit) of a log and its total size"""
+    chunks, total, taken = [], 0, 0
+    for path, _, size, compressed in parts(name):
+        start = total
+        total += size
+        if taken >= limit or offset >= total:
+            continue
+        with open_part(path, compressed) as f:
+            f.seek(max(offset - start, 0))
+            chunk = f.read(limit - taken)
+        chunks.append(chunk)
+        taken += len(chunk)
+    return b"".join(chunks), total
+
+def sessions(prefix):
+    """Names of the logs under a directory such as "wrappers/0", newest first"""
+    directory = base_path(prefix)
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return []
+    names = set()
+    for entry in entries:
+        for suffix in (".index.json", ".log"):
+            if entry.endswith(suffix):
+                names.add(entry[:-len(suffix)])
+    return sorted(names, reverse=True)
@@ -0,0 +1,101 @@
+import itertools
+import threading
+from collections import deque
+from . import metrics
+
+# One sequence for every store, so a single cursor covers wrapper, downloader and job logs
+_sequence = itertools.count(1)
+_lock = threading.Lock()
+_changed = threading.Condition(_lock)
+last_seq = 0
+
+# Set by the engine process to copy lines into the shared store
+mirror = None
+mirror_clear = None
+
+def resume_sequence(start):
+    """Continue numbering after `start` (e.g. the last sequence in the shared store)"""
+    global _sequence, last_seq
+    with _lock:
+        last_seq = max(last_seq, start)
+        _sequence = itertools.count(last_seq + 1)
+
+def current_cursor():
+    return last_seq
+
+def wait_for_lines(cursor, timeout):
+    """Block until any store has lines newer than cursor (or timeout); return the cursor"""
+    with _changed:
+        _changed.wait_for(lambda: last_seq > cursor, timeout)
+        return last_seq
+
+class LogStore:
+    """Bounded log buffer where every line gets a monotonically increasing sequence number"""
+
+    def __init__(self, name=None, maxlen=2000):
+        self.name = name  # stream name in the shared store
+        self.kind = (name or "log").split(":")[0]  # job:<id> streams share one metrics label
+        self.lines = deque(maxlen=maxlen)  # (seq, line) pairs, oldest first
+        self.cleared_at = 0
+        self.evicted_at = 0  # seq of the newest line pushed out by maxlen
+
+    def append(self, line):
+        global last_seq
+        with _lock:
+            last_seq = next(_sequence)
+            if len(self.lines) == self.lines.maxlen:
+                self.evicted_at = self.lines[0][0]
+            self.lines.append((last_seq, line))
+            if mirror and self.name:
+                mirror(self.name, last_seq, line)
+            _changed.notify_all()
+        metrics.inc("amdl_log_lines_total", stream=self.kind)
+
+    def preload(self, rows):
+        """Seed the buffer with (seq, line) rows, e.g. from the shared store after a restart"""
+        with _lock:
+            for row in rows:
+                if len(self.lines) == self.lines.maxlen:
+                    self.evicted_at = self.lines[0][0]
+                self.lines.append(row)
+
+    def clear(self):
+        """Drop all lines; readers behind this point are told to reset their view"""
+        global last_seq
+        with _lock:
+            # Consume a sequence number so every existing cursor is behind the clear
+            last_seq = next(_sequence)
+            self.lines.clear()
+            self.cleared_at = last_seq
+            _changed.notify_all()
+        if mirror_clear and self.name:
+            mirror_clear(self.name, self.cleared_at)
+
+    def since(self, seq, upto=None):
+        """Return (lines with seq < line seq <= upto, reset flag)
+
+        Read the cursor first and pass it as `upto` so lines appended while
+        several stores are being read are not skipped by the next call.
+        """
+        with _lock:
+            newer = []
+            # Walk back from the newest line, a caller that is up to date costs nothing
+            for line_seq, line in reversed(self.lines):
+                if line_seq <= seq:
+                    break
+                if upto is None or line_seq <= upto:
+                    newer.append(line)
+            newer.reverse()
+            # A clear after `upto` is reported on the caller's next read. A
+            # caller behind lines that were already evicted has a gap and is
+            # told to reset too, the lines returned are then all that is kept.
+            reset = seq < self.cleared_at <= (last_seq if upto is None else upto) or seq < self.evicted_at
+            return newer, reset
+
+    def tail(self, count=None):
+        with _lock:
+            lines = [line for _, line in self.lines]
+        return lines[-count:] if count else lines
+
+    def __len__(self):
+        return len(self.lines)
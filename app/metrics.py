@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+from . import store
+
+# Counters and histograms are kept per process and published to the shared
+# store, so /metrics on any worker reports the sum over all processes.
+# Point-in-time gauges are computed from the shared status when scraped.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+CONVERSION_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+FLUSH_INTERVAL = 5  # seconds between publishing this process's metrics
+STALE_AFTER = 60    # a snapshot not republished for this long belongs to a dead or hung process
+
+_lock = threading.Lock()
+_families = {}
+_flusher_started = False
+
+def define(name, kind, help_text, buckets=None):
+    _families[name] = {"type": kind, "help": help_text, "buckets": buckets, "samples": {}}
+
+define("amdl_jobs_total", "counter", "Finished downloads by format and status")
+define("amdl_job_duration_seconds", "histogram", "Download run time by format and status", JOB_BUCKETS)
+define("amdl_job_phase_seconds_total", "counter", "Time finished downloads spent in each phase")
+define("amdl_job_retries_total", "counter", "Automatic retries of failed downloads by format")
+define("amdl_bandwidth_throttled_seconds_total", "counter", "Time downloads were stopped by the bandwidth limit")
+define("amdl_conversions_total", "counter", "Finished file conversions by target format and status")
+define("amdl_conversion_duration_seconds", "histogram", "ffmpeg run time per file by target format", CONVERSION_BUCKETS)
+define("amdl_subscription_syncs_total", "counter", "Syncs of followed playlists/artists by status")
+define("amdl_subscription_sync_duration_seconds", "histogram", "Time to list a subscription and queue its new tracks",
+       CONVERSION_BUCKETS)
+define("amdl_bytes_written_total", "counter", "Bytes of audio files written to the save folders")
+define("amdl_log_lines_total", "counter", "Log lines ingested by stream (rate() for lines per second)")
+define("amdl_2fa_prompts_total", "counter", "2FA prompts from the wrapper")
+define("amdl_http_request_duration_seconds", "histogram", "Request latency by endpoint", LATENCY_BUCKETS)
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def inc(name, amount=1, **labels):
+    key = label_key(labels)
+    samples = _families[name]["samples"]
+    with _lock:
+        samples[key] = samples.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    family = _families[name]
+    key = label_key(labels)
+    with _lock:
+        sample = family["samples"].get(key)
+        if sample is None:
+            sample = family["samples"][key] = {"buckets": [0] * len(family["buckets"]), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(family["buckets"]):
+            if value <= bound:
+                sample["buckets"][i] += 1
+                break
+        sample["sum"] += value
+        sample["count"] += 1
+
+def snapshot():
+    """This process's counters/histograms as a JSON-friendly dict"""
+    with _lock:
+        return {
+            name: [[dict(key), dict(value, buckets=list(value["buckets"])) if isinstance(value, dict) else value]
+                   for key, value in family["samples"].items()]
+            for name, family in _families.items() if family["samples"]
+        }
+
+def flush():
+    store.set_state(f"metrics:{os.getpid()}", {"published_at": time.time(), "samples": snapshot()})
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by someone else
+    return True
+
+def published_snapshots():
+    """Snapshots of the other live processes; those of exited or silent ones are deleted"""
+    snapshots = []
+    for key, value in store.get_states("metrics:"):
+        pid = key.split(":", 1)[1]
+        if pid == str(os.getpid()):
+            continue
+        if not isinstance(value, dict) or "published_at" not in value or not pid.isdigit() \
+                or not pid_alive(int(pid)) or time.time() - value["published_at"] > STALE_AFTER:
+            store.delete_state(key)
+            continue
+        snapshots.append(value["samples"])
+    return snapshots
+
+def start_flusher():
+    """Publish this process's metrics periodically (once per process)"""
+    global _flusher_started
+    with _lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+
+    def loop():
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                flush()
+            except Exception as e:
+                print(f"Error publishing metrics: {e}")
+    threading.Thread(target=loop, daemon=True).start()
+
+def collect():
+    """Sum this process's live metrics with the last published ones of every other live process"""
+    snapshots = [snapshot()] + published_snapshots()
+    totals = {}
+    for snap in snapshots:
+        for name, samples in snap.items():
+            if name not in _families:
+                continue
+            merged = totals.setdefault(name, {})
+            for labels, value in samples:
+                key = label_key(labels)
+                if _families[name]["type"] == "histogram":
+                    current = merged.setdefault(key, {"buckets": [0] * len(value["buckets"]), "sum": 0.0, "count": 0})
+                    current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                    current["sum"] += value["sum"]
+                    current["count"] += value["count"]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+    return totals
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(gauges=()):
+    """Prometheus text exposition of all metrics.
+
+    gauges are scrape-time families: (name, type, help, [(labels dict, value)]).
+    """
+    lines = []
+    totals = collect()
+    for name, family in _families.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for key, value in sorted(totals.get(name, {}).items()):
+            if family["type"] == "histogram":
+                cumulative = 0
+                for bound, count in zip(family["buckets"], value["buckets"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {value['count']}")
+                lines.append(f"{name}_sum{format_labels(key)} {format_value(value['sum'])}")
+                lines.append(f"{name}_count{format_labels(key)} {value['count']}")
+            else:
+                lines.append(f"{name}{format_labels(key)} {format_value(value)}")
+    for name, kind, help_text, samples in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{format_labels(label_key(labels))} {format_value(value)}")
+    return "\n".join(lines) + "\n"
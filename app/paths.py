@@ -0,0 +1,8 @@
+import os
+
+# Project layout shared by the web UI modules (mirrors the constants in main.py)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AMD_DIR = os.path.join(PROJECT_DIR, "apple-music-downloader")
+WRAPPER_DIR = os.path.join(PROJECT_DIR, "wrapper")
+CONFIG_PATH = os.path.join(AMD_DIR, "config.yaml")
+BUILD_DIR = os.path.join(PROJECT_DIR, "build")
@@ -0,0 +1,92 @@
+import os
+
+# Resource accounting for a job's process tree (the downloader plus the
+# ffmpeg/MP4Box/gpac children it spawns), read from /proc. Elsewhere every
+# sample is None and jobs simply go without resource figures.
+PROC_DIR = "/proc"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def read_stat(pid):
+    """(ppid, cpu seconds, rss bytes) from /proc/<pid>/stat, or None if it is gone"""
+    try:
+        with open(f"{PROC_DIR}/{pid}/stat") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces; fields resume after the last ')'
+    fields = data[data.rindex(")") + 2:].split()
+    ppid = int(fields[1])
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+    rss = int(fields[21]) * PAGE_SIZE
+    return ppid, cpu, rss
+
+def read_io(pid):
+    """(read_bytes, write_bytes) of storage I/O; zeros when not permitted"""
+    counters = {}
+    try:
+        with open(f"{PROC_DIR}/{pid}/io") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters.get("read_bytes", 0), counters.get("write_bytes", 0)
+
+def process_table():
+    """pid -> (ppid, cpu seconds, rss bytes) for every live process, one pass over /proc"""
+    table = {}
+    try:
+        entries = os.listdir(PROC_DIR)
+    except OSError:
+        return table
+    for entry in entries:
+        if entry.isdigit():
+            stat = read_stat(int(entry))
+            if stat:
+                table[int(entry)] = stat
+    return table
+
+def descendants(root, table=None):
+    """root and every live process below it, from `table` (read now if not given)"""
+    children = {}
+    for pid, stat in (process_table() if table is None else table).items():
+        children.setdefault(stat[0], []).append(pid)
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, ()))
+    return tree
+
+class ProcessTree:
+    """Cumulative CPU/I/O and current RSS of a process and its descendants.
+
+    Exited children keep their last sampled counters, so short-lived tools
+    that finish between samples are under-counted by at most one interval.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.last = {}  # pid -> (cpu, read_bytes, write_bytes)
+        self.available = os.path.isdir(f"{PROC_DIR}/{pid}")
+
+    def sample(self, table=None):
+        """Totals for the tree; pass a process_table() to share one /proc scan between trees"""
+        if not self.available:
+            return None
+        if table is None:
+            table = process_table()
+        rss = 0
+        for pid in descendants(self.pid, table):
+            stat = table.get(pid)
+            if not stat:
+                continue
+            rss += stat[2]
+            self.last[pid] = (stat[1],) + read_io(pid)
+        return {
+            "cpu_seconds": sum(cpu for cpu, _, _ in self.last.values()),
+            "read_bytes": sum(read for _, read, _ in self.last.values()),
+            "write_bytes": sum(write for _, _, write in self.last.values()),
+            "rss_bytes": rss,
+        }
@@ -0,0 +1,215 @@
+import re
+import time
+
+# Patterns for apple-music-downloader output
+TRACK_RE = re.compile(r"Track (\d+) of (\d+)(?::\s*(.*))?")
+PERCENT_RE = re.compile(r"(\d{1,3}(?:\.\d+)?)\s*%")
+BYTES_RE = re.compile(r"([\d.]+)\s*([KMGT]?i?B)?\s*/\s*([\d.]+)\s*([KMGT]?i?B)\b")
+RATE_RE = re.compile(r"([\d.]+)\s*([KMGT]?i?B)/s")
+SUMMARY_RE = re.compile(r"Completed:\s*(\d+)\s*/\s*(\d+)")
+PHASE_KEYWORDS = [
+    ("decrypt", ("Decrypting",)),
+    ("mux", ("MP4Box", "Muxing", "mp4box", "Fixing")),
+    ("convert", ("Converting",)),
+    ("tag", ("Tagging", "Writing tags")),
+    ("download", ("Downloading",)),
+]
+TRACK_DONE_MARKERS = ("Decrypted", "already exists")
+DECRYPTED_RE = re.compile(r"Decrypted:?\s+(.+\.\w+)\s*$")  # names the file a track was written to
+# Output before the first track (link resolution, metadata) counts as this phase
+FIRST_PHASE = "metadata"
+USAGE_FIELDS = ("cpu_seconds", "read_bytes", "write_bytes")
+
+UNITS = {"B": 1, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+         "KIB": 1024, "MIB": 1024 ** 2, "GIB": 1024 ** 3, "TIB": 1024 ** 4}
+
+def to_bytes(value, unit):
+    return int(float(value) * UNITS.get((unit or "B").upper(), 1))
+
+class JobProgress:
+    """Compact progress record built from a job's downloader output"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.phase = "queued"
+        self.current_track = None
+        self.track_title = None
+        self.track_started_at = None  # when the current track's output began, for cleaning up after a cancel
+        self.tracks_done = 0
+        self.tracks_total = None
+        self.completed_tracks = set()  # "Track N of M" numbers that finished, for checkpoints
+        self.files = []  # (file name or path, when it was reported) for each "Decrypted <name>"
+        self.percent = None
+        self.bytes_done = 0        # current transfer
+        self.bytes_total = None
+        self.completed_bytes = 0   # finished transfers
+        self.throughput_bps = None  # latest rate
+        self.started_at = None
+        self.updated_at = None
+        self._last_sample = None   # (time, bytes) for rate estimates
+        self.phase_seconds = {}    # phase -> wall time spent in it
+        self.phase_usage = {}      # phase -> cpu_seconds/read_bytes/write_bytes/peak_rss
+        self.peak_rss = None
+        self._phase_since = None
+        self._last_usage = None
+
+    def set_phase(self, phase, now):
+        """Switch phase, banking the wall time of the one that ended"""
+        if phase == self.phase:
+            return
+        if self._phase_since is not None:
+            self.phase_seconds[self.phase] = self.phase_seconds.get(self.phase, 0) + now - self._phase_since
+        self.phase = phase
+        self._phase_since = now
+
+    def account(self, usage):
+        """Charge process-tree resource use since the last sample to the current phase"""
+        if not usage:
+            return
+        phase = self.phase if self.phase != "queued" else FIRST_PHASE
+        totals = self.phase_usage.setdefault(phase, {"cpu_seconds": 0.0, "read_bytes": 0, "write_bytes": 0, "peak_rss": 0})
+        for field in USAGE_FIELDS:
+            totals[field] += usage[field] - (self._last_usage[field] if self._last_usage else 0)
+        totals["peak_rss"] = max(totals["peak_rss"], usage["rss_bytes"])
+        self.peak_rss = max(self.peak_rss or 0, usage["rss_bytes"])
+        self._last_usage = usage
+
+    def phases(self, now=None):
+        """Per-phase wall time and resource use, including the phase in progress"""
+        seconds = dict(self.phase_seconds)
+        if self._phase_since is not None and self.phase not in ("completed", "failed"):
+            seconds[self.phase] = seconds.get(self.phase, 0) + (now or time.time()) - self._phase_since
+        result = {}
+        for phase in list(seconds) + [p for p in self.phase_usage if p not in seconds]:
+            entry = {"seconds": round(seconds.get(phase, 0), 3)}
+            usage = self.phase_usage.get(phase)
+            if usage:
+                entry.update(usage, cpu_seconds=round(usage["cpu_seconds"], 3))
+            result[phase] = entry
+        return result
+
+    def feed(self, line):
+        """Update the record from one output line.
+
+        Returns True for progress-bar redraws, which callers need not keep in the log.
+        """
+        now = time.time()
+        self.updated_at = now
+        if self.started_at is None:
+            self.started_at = now
+            self.set_phase(FIRST_PHASE, now)
+
+        match = TRACK_RE.search(line)
+        if match:
+            self.current_track = int(match.group(1))
+            self.tracks_total = int(match.group(2))
+            self.track_title = (match.group(3) or "").strip() or None
+            self.track_started_at = now
+            self.tracks_done = max(self.tracks_done, self.current_track - 1)
+            self.percent = None
+            self.set_phase("download", now)
+            return False
+
+        match = SUMMARY_RE.search(line)
+        if match:
+            self.tracks_done = int(match.group(1))
+            self.tracks_total = int(match.group(2))
+            return False
+
+        for phase, keywords in PHASE_KEYWORDS:
+            if any(keyword in line for keyword in keywords):
+                self.set_phase(phase, now)
+                break
+
+        match = DECRYPTED_RE.search(line)
+        if match:
+            self.files.append((match.group(1).strip(), now))
+
+        if any(marker in line for marker in TRACK_DONE_MARKERS) and self.current_track:
+            self.tracks_done = max(self.tracks_done, self.current_track)
+            self.completed_tracks.add(self.current_track)
+
+        percent = PERCENT_RE.search(line)
+        if not percent:
+            return False
+        self.percent = float(percent.group(1))
+
+        sizes = BYTES_RE.search(line)
+        if sizes:
+            total_unit = sizes.group(4)
+            done = to_bytes(sizes.group(1), sizes.group(2) or total_unit)
+            total = to_bytes(sizes.group(3), total_unit)
+            if self.phase == "download":
+                if done < self.bytes_done:
+                    # A new transfer started, bank the previous one
+                    self.completed_bytes += self.bytes_total or self.bytes_done
+                    self._last_sample = None
+                self.update_rate(now, done)
+                self.bytes_done = done
+                self.bytes_total = total
+
+        rate = RATE_RE.search(line)
+        if rate and self.phase == "download":
+            self.throughput_bps = to_bytes(rate.group(1), rate.group(2))
+        # Only the final redraw of a bar is worth logging
+        return self.percent < 100
+
+    def update_rate(self, now, done):
+        if self._last_sample:
+            elapsed = now - self._last_sample[0]
+            if elapsed >= 0.5:
+                self.throughput_bps = int((done - self._last_sample[1]) / elapsed)
+                self._last_sample = (now, done)
+        else:
+            self._last_sample = (now, done)
+
+    def finish(self, exit_code):
+        self.updated_at = time.time()
+        self.set_phase("completed" if exit_code == 0 else "failed", self.updated_at)
+        if exit_code == 0 and self.tracks_total:
+            self.tracks_done = self.tracks_total
+
+    def to_dict(self):
+        total_bytes = self.completed_bytes + self.bytes_done
+        elapsed = (self.updated_at - self.started_at) if self.started_at else 0
+        return {
+            "job_id": self.job_id,
+            "phase": self.phase,
+            "current_track": self.current_track,
+            "track_title": self.track_title,
+            "tracks_done": self.tracks_done,
+            "tracks_total": self.tracks_total,
+            "percent": self.percent,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "total_bytes": total_bytes,
+            "throughput_bps": self.throughput_bps,
+            "average_bps": int(total_bytes / elapsed) if elapsed > 0 else None,
+            "phases": self.phases(),
+            "peak_rss": self.peak_rss,
+            "updated_at": self.updated_at,
+        }
+
+def aggregate_phases(progress_records):
+    """Sum per-phase time and resource use over finished jobs' progress dicts"""
+    phases = {}
+    jobs = 0
+    for progress in progress_records:
+        if not progress or not progress.get("phases"):
+            continue
+        jobs += 1
+        for phase, entry in progress["phases"].items():
+            totals = phases.setdefault(phase, {"jobs": 0, "seconds": 0.0, "cpu_seconds": 0.0,
+                                               "read_bytes": 0, "write_bytes": 0, "peak_rss": 0})
+            totals["jobs"] += 1
+            totals["seconds"] += entry.get("seconds", 0)
+            for field in USAGE_FIELDS:
+                totals[field] += entry.get(field, 0)
+            totals["peak_rss"] = max(totals["peak_rss"], entry.get("peak_rss", 0))
+    wall = sum(totals["seconds"] for totals in phases.values())
+    for totals in phases.values():
+        totals["mean_seconds"] = round(totals["seconds"] / totals["jobs"], 3)
+        totals["share"] = round(totals["seconds"] / wall, 4) if wall else None
+        totals["seconds"] = round(totals["seconds"], 3)
+        totals["cpu_seconds"] = round(totals["cpu_seconds"], 3)
+    return {"jobs": jobs, "phases": phases}
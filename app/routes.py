@@ -1,214 +1,176 @@
-import subprocess
 import threading
-from flask import render_template, request, jsonify
+import time
+from flask import render_template, request, jsonify, Response, g
 import shlex
-import yaml
-import os
 import json
-import base64
 from . import app
+from . import catalog, converter, jobs, library, logfiles, logstore, metrics, scheduler, store, subscriptions, wrappers
+from .builder import build_status
+from .config_store import downloader_config, download_folders, normalize_config
+from .credentials import delete_credentials, load_credentials, save_pending_login, take_pending_login
+from .httpcache import conditional_json, install_missing_assets
+from .logstore import LogStore, current_cursor, wait_for_lines
+from .progress import aggregate_phases
+from .settings import get_setting, load_settings, save_settings
 
-wrapper_process = None
-wrapper_running = False
-wrapper_needs_2fa = False
-download_process = None
-download_running = False
+wrapper_logs = LogStore(name="wrapper", maxlen=2000)
+downloader_logs = LogStore(name="downloader", maxlen=5000)
 
-def stream_download_logs(pipe, target_list):
-    """Thread target to read logs from download process and store them."""
-    global download_running, download_process
-    
-    try:
-        for line in iter(pipe.readline, ''):
-            line = line.strip()
-            if line:
-                target_list.append(line)
-                print(f"[DOWNLOAD LOG] {line}")  # Debug print
-                    
-    except Exception as e:
-        target_list.append(f"Error reading download logs: {str(e)}")
-    finally:
-        # Check if process ended
-        if download_process and download_process.poll() is not None:
-            exit_code = download_process.poll()
-            if exit_code == 0:
-                target_list.append("✅ Download completed successfully!")
-            else:
-                target_list.append(f"❌ Download failed with exit code: {exit_code}")
-            download_running = False
-        pipe.close()
-
-def stream_wrapper_logs(pipe, target_list, email=None, password=None, auto_login=False):
-    """Thread target to read logs from wrapper process and store them."""
-    global wrapper_running, wrapper_process, wrapper_needs_2fa
-    login_successful = False
-    
-    try:
-        for line in iter(pipe.readline, ''):
-            line = line.strip()
-            if line:
-                target_list.append(line)
-                print(f"[WRAPPER LOG] {line}")  # Debug print
-                
-                # Check for 2FA requirement
-                if "credentialHandler:" in line and "2FA: true" in line:
-                    wrapper_needs_2fa = True
-                    target_list.append("🔐 2FA Required - Please enter your 2FA code")
-                    
-                # Check for successful login message
-                if "[.] response type 6" in line:
-                    wrapper_running = True
-                    wrapper_needs_2fa = False
-                    login_successful = True
-                    if auto_login:
-                        target_list.append("✅ Auto-login successful! Ready for downloads.")
-                    else:
-                        target_list.append("✅ Wrapper login successful! Ready for downloads.")
-                        # Save credentials on successful manual login
-                        if email and password:
-                            if save_credentials(email, password):
-                                target_list.append("💾 Credentials saved for auto-login")
-                            else:
-                                target_list.append("⚠️ Failed to save credentials")
-                    
-    except Exception as e:
-        target_list.append(f"Error reading wrapper logs: {str(e)}")
-    finally:
-        # Check if process ended
-        if wrapper_process and wrapper_process.poll() is not None:
-            exit_code = wrapper_process.poll()
-            if not login_successful:
-                # Process ended before successful login
-                target_list.append(f"❌ Login failed - wrapper process exited with code: {exit_code}")
-                wrapper_running = False
-                wrapper_needs_2fa = False
-                # Delete credentials on failed auto-login
-                if auto_login:
-                    target_list.append("🗑️ Auto-login failed, deleting saved credentials")
-                    delete_credentials()
-            elif exit_code != 0:
-                target_list.append(f"❌ Wrapper process ended unexpectedly with exit code: {exit_code}")
-                wrapper_running = False
-                wrapper_needs_2fa = False
-            else:
-                target_list.append("Wrapper process ended normally")
-                wrapper_running = False
-                wrapper_needs_2fa = False
-        pipe.close()
-
-wrapper_logs = []
-downloader_logs = []
-
-def get_credentials_path():
-    """Get the path to the credentials file"""
-    script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    return os.path.join(script_dir, ".credentials")
-
-def save_credentials(email, password):
-    """Save credentials to file (base64 encoded for basic obfuscation)"""
-    try:
-        credentials = {
-            "email": base64.b64encode(email.encode()).decode(),
-            "password": base64.b64encode(password.encode()).decode()
-        }
-        with open(get_credentials_path(), 'w') as f:
-            json.dump(credentials, f)
-        return True
-    except Exception as e:
-        print(f"Error saving credentials: {e}")
-        return False
+# Let the wrapper pool and job workers write to the shared logs
+wrappers.log = wrapper_logs.append
+wrappers.clear_log = wrapper_logs.clear
+jobs.shared_log = lambda line: downloader_logs.append(line)
 
-def load_credentials():
-    """Load and decode saved credentials"""
-    try:
-        credentials_path = get_credentials_path()
-        if os.path.exists(credentials_path):
-            with open(credentials_path, 'r') as f:
-                credentials = json.load(f)
-            email = base64.b64decode(credentials["email"]).decode()
-            password = base64.b64decode(credentials["password"]).decode()
-            return email, password
-    except Exception as e:
-        print(f"Error loading credentials: {e}")
-    return None, None
+# Only the engine process runs the wrapper and downloads; other worker
+# processes serve from the shared store and forward actions to it
+is_engine = False
+engine_checked_at = 0
+engine_lock = threading.Lock()
 
-def delete_credentials():
-    """Delete saved credentials"""
-    try:
-        credentials_path = get_credentials_path()
-        if os.path.exists(credentials_path):
-            os.remove(credentials_path)
-        return True
-    except Exception as e:
-        print(f"Error deleting credentials: {e}")
-        return False
+DEFAULT_STATUS = {
+    "wrapper_running": False,
+    "download_running": False,
+    "jobs_running": 0,
+    "jobs_queued": 0,
+    "queued_by_priority": {},
+    "active_jobs": [],
+    "wrapper_needs_2fa": False,
+    "wrappers": [],
+    "conversions_running": 0,
+    "conversions_queued": 0,
+    "active_conversions": []
+}
+
+def ensure_engine():
+    """Become the engine process if no other worker holds the engine lock"""
+    global is_engine, engine_checked_at
+    if is_engine or time.time() - engine_checked_at < 5:
+        return
+    with engine_lock:
+        if is_engine or time.time() - engine_checked_at < 5:
+            return
+        engine_checked_at = time.time()
+        if not store.acquire_engine_lock():
+            return
+        
+        # Continue the shared log sequence and history where the last engine stopped
+        logstore.resume_sequence(max(store.last_log_seq(), store.read_cursor()))
+        wrapper_logs.preload(store.tail_log_rows("wrapper", 2000))
+        downloader_logs.preload(store.tail_log_rows("downloader", 5000))
+        logstore.mirror = store.mirror_log
+        logstore.mirror_clear = store.mirror_clear
+        store.start_publisher(get_status, jobs.running_job_dicts, handle_command)
+        library.start_library_refresher()
+        subscriptions.start_syncer()
+        wrappers.start_supervisor()
+        install_missing_assets()
+        is_engine = True
+        
+        if converter.resume_unfinished_conversions():
+            downloader_logs.append("♻️ Resumed unfinished conversions from the previous run")
+        
+        # Pick up jobs a crash or restart left behind; they wait for the wrapper login
+        if jobs.resume_unfinished_jobs():
+            downloader_logs.append("♻️ Resumed unfinished jobs from the previous run")
+            if not wrappers.wanted:
+                threading.Thread(target=attempt_auto_login, daemon=True).start()
+
+def start_engine():
+    """Start the engine when the process starts, not on its first request.
+
+    A worker that loses the election keeps trying in the background, so it
+    takes over when the engine process exits even if it serves no requests.
+    """
+    ensure_engine()
+    if is_engine:
+        return
+
+    def retry():
+        while not is_engine:
+            time.sleep(5)
+            try:
+                ensure_engine()
+            except Exception as e:
+                print(f"Error starting engine: {e}")
+    threading.Thread(target=retry, daemon=True).start()
+
+# Fallback for servers that import the app without calling start_engine
+app.before_request(ensure_engine)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start_flusher()
+
+@app.after_request
+def record_request_latency(response):
+    # /events responses stream long after this point, so they are not timed
+    started = g.pop("request_started", None)
+    if started is not None and request.url_rule and request.endpoint not in ("static", "events"):
+        metrics.observe("amdl_http_request_duration_seconds", time.perf_counter() - started,
+                        endpoint=request.url_rule.rule)
+    return response
+
+# Job control actions, also forwarded to the engine under these command names
+JOB_CONTROLS = {
+    "pause_job": jobs.pause_job,
+    "resume_job": jobs.resume_job,
+    "cancel_job": jobs.cancel_job,
+}
+
+def handle_command(name, payload):
+    """Run an action forwarded by another worker process"""
+    if name == "login":
+        email, password = take_pending_login()
+        if email and password:
+            start_wrapper_login(email, password, auto_login=False)
+    elif name == "auto_login":
+        attempt_auto_login()
+    elif name == "submit_2fa":
+        send_2fa_code(payload["code"])
+    elif name == "stop_wrapper":
+        terminate_wrapper()
+    elif name == "enqueue_job":
+        jobs.enqueue_job(payload["job_id"])
+    elif name == "retry_job":
+        jobs.enqueue_job(payload["job_id"], retried=True)
+    elif name in JOB_CONTROLS:
+        JOB_CONTROLS[name](payload["job_id"])
+    elif name == "sync_subscription":
+        subscriptions.sync_in_background(payload["subscription_id"])
+    elif name == "refresh_library":
+        threading.Thread(target=library.refresh_library, daemon=True).start()
+    else:
+        print(f"Unknown command from worker: {name}")
+
+def shared_status():
+    """Wrapper/download state as seen by this process"""
+    if is_engine:
+        return get_status()
+    return store.get_state("status", DEFAULT_STATUS)
 
 def attempt_auto_login():
     """Try to automatically login with saved credentials"""
-    email, password = load_credentials()
-    if email and password:
-        wrapper_logs.append("🔄 Found saved credentials, attempting auto-login...")
-        return start_wrapper_login(email, password, auto_login=True)
-    return False
+    return wrappers.auto_login_all()
 
 def start_wrapper_login(email, password, auto_login=False):
-    """Start wrapper login process"""
-    global wrapper_process, wrapper_running, wrapper_logs
-    
-    if wrapper_process and wrapper_process.poll() is None:
-        if not auto_login:
-            wrapper_logs.append("❌ Wrapper already running")
-        return False
-
-    if not auto_login:
-        wrapper_logs = []  # reset logs only for manual login
-    
-    prefix = "🤖 Auto-login: " if auto_login else ""
-    wrapper_logs.append(f"{prefix}Starting wrapper login for {email}...")
-    
-    # Use absolute path and proper command format
-    script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    wrapper_dir = os.path.join(script_dir, "wrapper")
-    wrapper_path = os.path.join(wrapper_dir, "wrapper")
-    
-    cmd = [wrapper_path, "-L", f"{email}:{password}"]
-    wrapper_logs.append(f"{prefix}Executing: {' '.join(cmd)}")
-    wrapper_logs.append(f"{prefix}Working directory: {wrapper_dir}")
-    
-    try:
-        wrapper_process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            stdin=subprocess.PIPE,
-            bufsize=1,
-            universal_newlines=True,
-            cwd=wrapper_dir  # Run from wrapper directory
-        )
-        
-        # Don't set wrapper_running=True yet, wait for the success message
-        threading.Thread(target=stream_wrapper_logs, args=(wrapper_process.stdout, wrapper_logs, email, password, auto_login), daemon=True).start()
-        
-        wrapper_logs.append(f"{prefix}Wrapper process started, waiting for login confirmation...")
-        return True
-        
-    except Exception as e:
-        wrapper_logs.append(f"{prefix}❌ Error starting wrapper: {str(e)}")
-        if auto_login:
-            wrapper_logs.append("🗑️ Auto-login failed, deleting saved credentials")
-            delete_credentials()
-        return False
+    """Log the wrapper pool in with the given account"""
+    return wrappers.start_all(email, password, auto_login)
 
 
 @app.route("/")
 def index():
     # Check for saved credentials and attempt auto-login on first load
     email, password = load_credentials()
-    if email and password and not wrapper_running and (not wrapper_process or wrapper_process.poll() is not None):
-        # Attempt auto-login in a separate thread to not block page load
-        threading.Thread(target=attempt_auto_login, daemon=True).start()
+    running = shared_status()["wrapper_running"]
+    if email and password and not running:
+        if not is_engine:
+            store.enqueue_command("auto_login")
+        elif not wrappers.all_running():
+            # Attempt auto-login in a separate thread to not block page load
+            threading.Thread(target=attempt_auto_login, daemon=True).start()
     
-    return render_template("index.html", wrapper_running=wrapper_running, has_saved_credentials=email is not None, saved_email=email if email else "")
+    return render_template("index.html", wrapper_running=running, has_saved_credentials=email is not None, saved_email=email if email else "")
 
 
 @app.route("/login_wrapper", methods=["POST"])
@@ -216,7 +178,13 @@ def login_wrapper():
     email = request.form.get("email")
     password = request.form.get("password")
 
-    if wrapper_process and wrapper_process.poll() is None:
+    if not is_engine:
+        if not save_pending_login(email or "", password or ""):
+            return jsonify({"status": "error", "msg": "Failed to start wrapper"})
+        store.enqueue_command("login")
+        return jsonify({"status": "ok", "msg": "Wrapper process started, waiting for login..."})
+
+    if wrappers.all_running():
         return jsonify({"status": "error", "msg": "Wrapper already running"})
 
     if start_wrapper_login(email, password, auto_login=False):
@@ -224,121 +192,511 @@ def login_wrapper():
     else:
         return jsonify({"status": "error", "msg": "Failed to start wrapper"})
 
+def send_2fa_code(two_fa_code):
+    """Send a 2FA code to the wrapper(s) waiting for one; returns (ok, message)"""
+    return wrappers.send_2fa(two_fa_code)
+
 @app.route("/submit_2fa", methods=["POST"])
 def submit_2fa():
-    global wrapper_process, wrapper_needs_2fa, wrapper_logs
-    
     two_fa_code = request.form.get("twofa_code")
+    status = shared_status()
     
-    if not wrapper_needs_2fa:
+    if not status["wrapper_needs_2fa"]:
         return jsonify({"status": "error", "msg": "2FA not required"})
     
-    if not wrapper_process or wrapper_process.poll() is not None:
-        return jsonify({"status": "error", "msg": "Wrapper not running"})
-    
     if not two_fa_code:
         return jsonify({"status": "error", "msg": "2FA code required"})
     
-    try:
-        # Send 2FA code to wrapper process
-        wrapper_process.stdin.write(f"{two_fa_code}\n")
-        wrapper_process.stdin.flush()
-        wrapper_logs.append(f"🔐 Submitted 2FA code: {two_fa_code}")
-        wrapper_needs_2fa = False
+    if not is_engine:
+        store.enqueue_command("submit_2fa", code=two_fa_code)
         return jsonify({"status": "ok", "msg": "2FA code submitted"})
-    except Exception as e:
-        wrapper_logs.append(f"❌ Error submitting 2FA code: {str(e)}")
-        return jsonify({"status": "error", "msg": f"Failed to submit 2FA code: {str(e)}"})
+    
+    ok, msg = send_2fa_code(two_fa_code)
+    return jsonify({"status": "ok" if ok else "error", "msg": msg})
 
 
 @app.route("/download", methods=["POST"])
 def download():
-    global download_process, download_running, downloader_logs
-    
     link = request.form.get("link")
     format_choice = request.form.get("format")
     special_audio = request.form.get("special_audio") == "true"
+    force = request.form.get("force") == "true"
+    priority = scheduler.normalize_priority(request.form.get("priority"))
     
-    if not wrapper_running:
+    if not shared_status()["wrapper_running"]:
         return jsonify({"status": "error", "msg": "Wrapper not running"})
     
-    if download_running:
-        return jsonify({"status": "error", "msg": "Download already in progress"})
-    
     if not link:
         return jsonify({"status": "error", "msg": "No URL provided"})
     
-    # Determine the command to run
-    script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    amd_dir = os.path.join(script_dir, "apple-music-downloader")
+    job_format = jobs.resolve_format(format_choice, special_audio)
+    if not job_format:
+        return jsonify({"status": "error", "msg": "Invalid format selected"})
+    
+    if not priority:
+        return jsonify({"status": "error", "msg": "Invalid priority selected"})
+    
+    # Albums and playlists become one job per track, so they spread over the workers
+    note = ""
+    expand = request.form.get("expand", "true" if get_setting("expand-collections") else "false") == "true"
+    if expand:
+        try:
+            collection = catalog.resolve(link)
+        except catalog.CatalogError as e:
+            collection = None
+            note = f" (could not list its tracks: {e})"
+        if collection and collection["links"]:
+            return queue_collection(link, collection, job_format, priority, force)
+    
+    job_id, state = queue_link(link, job_format, priority, force)
+    if state == "skipped":
+        return jsonify({"status": "ok", "msg": f"Already downloaded by job #{job_id}, skipping", "job_id": job_id, "skipped": True})
+    if state == "existing":
+        return jsonify({"status": "ok", "msg": f"Already queued as job #{job_id}", "job_id": job_id})
+    return jsonify({"status": "ok", "msg": f"Download queued as job #{job_id}{note}", "job_id": job_id})
+
+def queue_link(link, job_format, priority, force, collection=None, title=None):
+    """Queue a link unless it is downloaded or queued already; returns (job ID, "queued"/"skipped"/"existing")"""
+    # Skip links whose earlier download is still complete on disk
+    previous = None if force else library.completed_download(link, job_format, jobs.FORMAT_FOLDERS[job_format])
+    if previous:
+        return previous, "skipped"
+    
+    # The URL index makes re-submitting an active link cheap to detect
+    existing = store.find_active_job(link, job_format)
+    if existing:
+        return existing["id"], "existing"
+    
+    if is_engine:
+        return jobs.submit_job(link, job_format, priority, collection, title).id, "queued"
+    job_id = jobs.create_job(link, job_format, priority, collection, title)
+    store.enqueue_command("enqueue_job", job_id=job_id)
+    return job_id, "queued"
+
+def queue_collection(link, collection, job_format, priority, force):
+    """Queue each track of a resolved album/playlist as its own job"""
+    results = [queue_link(track_link, job_format, priority, force, collection=link, title=title)
+               for track_link, title in collection["links"]]
+    queued = [job_id for job_id, state in results if state == "queued"]
+    msg = f"Queued {len(queued)} of {len(results)} tracks from {collection['kind']} '{collection['title']}'"
+    skipped = sum(1 for _, state in results if state == "skipped")
+    existing = sum(1 for _, state in results if state == "existing")
+    if skipped:
+        msg += f", {skipped} already downloaded"
+    if existing:
+        msg += f", {existing} already queued"
+    return jsonify({
+        "status": "ok",
+        "msg": msg,
+        "job_id": queued[0] if queued else results[0][0],
+        "job_ids": [job_id for job_id, _ in results],
+        "collection": {"kind": collection["kind"], "title": collection["title"], "tracks": len(results)},
+    })
+
+
+@app.route("/jobs")
+def list_jobs():
+    """Job history, filterable with ?status=, ?link=, ?collection=, ?limit= and ?offset="""
+    history = store.load_jobs(
+        status=request.args.get("status"),
+        link=request.args.get("link"),
+        collection=request.args.get("collection"),
+        limit=request.args.get("limit", type=int),
+        offset=request.args.get("offset", 0, type=int)
+    )
+    return jsonify({"status": "ok", "jobs": history})
+
+@app.route("/jobs/<int:job_id>/retry", methods=["POST"])
+def retry_job(job_id):
+    """Queue a failed or cancelled job again; tracks its checkpoint records as done are not downloaded again"""
+    row = store.load_job(job_id)
+    if not row:
+        return jsonify({"status": "error", "msg": "Job not found"}), 404
+    if row["status"] not in ("failed", "cancelled"):
+        return jsonify({"status": "error", "msg": "Only failed or cancelled jobs can be retried"})
     
-    if special_audio:
-        if format_choice == "ATMOS":
-            cmd = ["go", "run", "main.go", "--atmos", link]
-            downloader_logs.append(f"🎵 Starting ATMOS download: {link}")
-        elif format_choice == "AAC":
-            cmd = ["go", "run", "main.go", "--aac", link]
-            downloader_logs.append(f"🎵 Starting AAC download: {link}")
+    if is_engine:
+        jobs.enqueue_job(job_id, retried=True)
+    else:
+        store.enqueue_command("retry_job", job_id=job_id)
+    return jsonify({"status": "ok", "msg": f"Job #{job_id} queued for retry", "job_id": job_id})
+
+@app.route("/jobs/<int:job_id>/<action>", methods=["POST"])
+def control_job(job_id, action):
+    """Pause, resume or cancel a queued or running job"""
+    command = f"{action}_job"
+    if command not in JOB_CONTROLS:
+        return jsonify({"status": "error", "msg": "Unknown action"}), 404
+    row = store.load_job(job_id)
+    if not row:
+        return jsonify({"status": "error", "msg": "Job not found"}), 404
+    if row["status"] not in ("queued", "running"):
+        return jsonify({"status": "error", "msg": f"Job #{job_id} is {row['status']}"})
+    
+    done = {"pause": "paused", "resume": "resumed", "cancel": "cancelled"}[action]
+    if is_engine:
+        if not JOB_CONTROLS[command](job_id):
+            return jsonify({"status": "error", "msg": f"Job #{job_id} cannot be {done} now"})
+    else:
+        store.enqueue_command(command, job_id=job_id)
+    return jsonify({"status": "ok", "msg": f"Job #{job_id} {done}", "job_id": job_id})
+
+@app.route("/profile")
+def profile_page():
+    return render_template("profile.html")
+
+@app.route("/jobs/profile")
+def get_job_profile():
+    """Per-phase time and resource use over the latest finished jobs (?limit=, ?status=)"""
+    limit = min(max(request.args.get("limit", 200, type=int), 1), 5000)
+    history = store.load_jobs(status=request.args.get("status", "completed"), limit=limit, newest_first=True)
+    by_format = {}
+    for job in history:
+        by_format.setdefault(job["format"], []).append(job["progress"])
+    profile = {
+        "all": aggregate_phases(job["progress"] for job in history),
+        "formats": {name: aggregate_phases(records) for name, records in by_format.items()},
+    }
+    return jsonify({"status": "ok", "profile": profile})
+
+def find_job(job_id):
+    """In-memory Job on the engine, None elsewhere (use the shared store then)"""
+    return jobs.get_job(job_id) if is_engine else None
+
+@app.route("/jobs/<int:job_id>")
+def get_job(job_id):
+    job = find_job(job_id)
+    data = job.to_dict() if job else store.load_job(job_id)
+    if not data:
+        return jsonify({"status": "error", "msg": "Job not found"}), 404
+    
+    since = request.args.get("since", type=int)
+    if job:
+        cursor = current_cursor()
+        if since is None:
+            data["logs"] = job.logs.tail()
         else:
-            return jsonify({"status": "error", "msg": "Invalid format selected"})
+            data["logs"], data["logs_reset"] = job.logs.since(since, cursor)
     else:
-        cmd = ["go", "run", "main.go", link]
-        downloader_logs.append(f"🎵 Starting standard download: {link}")
+        cursor = store.read_cursor()
+        if since is None:
+            data["logs"] = store.tail_logs(f"job:{job_id}", 2000)
+        else:
+            data["logs"], data["logs_reset"] = store.read_logs(f"job:{job_id}", since, cursor)
+    return jsonify({"status": "ok", "job": data, "cursor": cursor})
+
+
+def get_status():
+    """Current wrapper/download state shared by /get_logs and /events"""
+    running_jobs = jobs.count_jobs("running")
+    return {
+        "wrapper_running": wrappers.any_ready(),
+        "download_running": running_jobs > 0,
+        "jobs_running": running_jobs,
+        "jobs_queued": jobs.count_jobs("queued"),
+        "queued_by_priority": jobs.job_queue.queued(),
+        "active_jobs": jobs.active_progress(),
+        "wrapper_needs_2fa": wrappers.needs_2fa(),
+        "wrappers": wrappers.pool_status(),
+        "conversions_running": converter.count_conversions("running"),
+        "conversions_queued": converter.count_conversions("queued"),
+        "active_conversions": converter.active_conversions()
+    }
+
+def get_log_update(since):
+    """Log lines newer than since (or the last 200 lines when since is None) plus the new cursor"""
+    if not is_engine:
+        return get_shared_log_update(since)
+    cursor = current_cursor()
+    if since is None:
+        update = {
+            "wrapper": wrapper_logs.tail(200), "wrapper_reset": True,
+            "downloader": downloader_logs.tail(200), "downloader_reset": True
+        }
+    else:
+        update = {}
+        update["wrapper"], update["wrapper_reset"] = wrapper_logs.since(since, cursor)
+        update["downloader"], update["downloader_reset"] = downloader_logs.since(since, cursor)
+    update["cursor"] = cursor
+    return update
+
+def get_shared_log_update(since):
+    """get_log_update() served from the shared store"""
+    cursor = store.read_cursor()
+    if since is None:
+        update = {
+            "wrapper": store.tail_logs("wrapper", 200), "wrapper_reset": True,
+            "downloader": store.tail_logs("downloader", 200), "downloader_reset": True
+        }
+    else:
+        update = {}
+        update["wrapper"], update["wrapper_reset"] = store.read_logs("wrapper", since, cursor)
+        update["downloader"], update["downloader_reset"] = store.read_logs("downloader", since, cursor)
+    update["cursor"] = cursor
+    return update
+
+def wait_for_update(cursor, timeout):
+    """Block until new log lines may be available; returns the latest cursor"""
+    if is_engine:
+        return wait_for_lines(cursor, timeout)
+    time.sleep(min(timeout, store.FLUSH_INTERVAL * 2))
+    return store.read_cursor()
+
+def log_file_range(name):
+    """A range of an on-disk log: ?offset=&limit= in lines, or in bytes with ?unit=bytes"""
+    if not logfiles.exists(name):
+        return jsonify({"status": "error", "msg": "Log not found"}), 404
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    if request.args.get("unit") == "bytes":
+        limit = min(max(request.args.get("limit", 65536, type=int), 1), 4 * 1024 * 1024)
+        data, total = logfiles.read_bytes(name, offset, limit)
+        return jsonify({"status": "ok", "unit": "bytes", "offset": offset, "next_offset": offset + len(data),
+                        "total": total, "data": data.decode("utf-8", "replace")})
+    limit = min(max(request.args.get("limit", 1000, type=int), 1), 10000)
+    lines, total = logfiles.read_lines(name, offset, limit)
+    return jsonify({"status": "ok", "unit": "lines", "offset": offset, "next_offset": offset + len(lines),
+                    "total": total, "lines": lines})
+
+@app.route("/jobs/<int:job_id>/log")
+def get_job_log(job_id):
+    """Complete output of a job, including lines past the in-memory window"""
+    return log_file_range(f"jobs/{job_id}")
+
+@app.route("/wrappers/<int:index>/logs")
+def list_wrapper_logs(index):
+    """Logged sessions of a wrapper instance, newest first"""
+    return jsonify({"status": "ok", "sessions": logfiles.sessions(f"wrappers/{index}")})
+
+@app.route("/wrappers/<int:index>/logs/<session>")
+def get_wrapper_log(index, session):
+    if session not in logfiles.sessions(f"wrappers/{index}"):
+        return jsonify({"status": "error", "msg": "Log not found"}), 404
+    return log_file_range(f"wrappers/{index}/{session}")
+
+@app.route("/conversions")
+def list_conversions():
+    """Conversion queue/history (newest first, ?status=, ?job_id=, ?limit=, ?offset=)
+    plus conversion log lines newer than ?since=<cursor>"""
+    history = store.load_conversions(
+        status=request.args.get("status"),
+        job_id=request.args.get("job_id", type=int),
+        limit=min(max(request.args.get("limit", 100, type=int), 1), 1000),
+        offset=max(request.args.get("offset", 0, type=int), 0)
+    )
+    since = request.args.get("since", type=int)
+    if is_engine:
+        cursor = current_cursor()
+        if since is None:
+            logs, reset = converter.logs.tail(200), True
+        else:
+            logs, reset = converter.logs.since(since, cursor)
+    else:
+        cursor = store.read_cursor()
+        if since is None:
+            logs, reset = store.tail_logs("convert", 200), True
+        else:
+            logs, reset = store.read_logs("convert", since, cursor)
+    return jsonify({"status": "ok", "conversions": history, "logs": logs, "logs_reset": reset, "cursor": cursor})
+
+@app.route("/jobs/<int:job_id>/progress")
+def get_job_progress(job_id):
+    job = find_job(job_id)
+    if job:
+        return jsonify({"status": "ok", "progress": job.progress.to_dict()})
+    data = store.load_job(job_id)
+    if not data:
+        return jsonify({"status": "error", "msg": "Job not found"}), 404
+    return jsonify({"status": "ok", "progress": data["progress"]})
+
+
+@app.route("/get_logs")
+def get_logs():
+    # With ?since=<cursor> only lines newer than the cursor are returned
+    response = dict(shared_status())
+    response.update(get_log_update(request.args.get("since", type=int)))
+    return conditional_json(response)
+
+@app.route("/events")
+def events():
+    """Server-Sent Events stream of new log lines and status changes"""
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", type=int)
     
-    downloader_logs.append(f"📁 Working directory: {amd_dir}")
-    downloader_logs.append(f"⚡ Executing: {' '.join(cmd)}")
+    def generate():
+        cursor = since
+        last_status = None
+        idle = 0.0
+        while True:
+            update = get_log_update(cursor)
+            if update["wrapper"] or update["downloader"] or update["wrapper_reset"] or update["downloader_reset"]:
+                yield f"id: {update['cursor']}\nevent: logs\ndata: {json.dumps(update)}\n\n"
+                idle = 0.0
+            cursor = update["cursor"]
+            
+            status = shared_status()
+            if status != last_status:
+                yield f"event: status\ndata: {json.dumps(status)}\n\n"
+                last_status = status
+                idle = 0.0
+            
+            # Wake on new lines, or every second to pick up status changes
+            if wait_for_update(cursor, timeout=1.0) == cursor:
+                idle += 1.0
+                if idle >= 15:
+                    yield ": keep-alive\n\n"
+                    idle = 0.0
     
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/library")
+def library_page():
+    return render_template("library.html")
+
+@app.route("/library/files")
+def list_library_files():
+    """Paginated listing of the indexed save folders.
+
+    ?q= searches artist/album/track (?match=prefix|substring), ?folder=, ?artist=
+    and ?album= filter exactly, ?sort=, ?order=asc|desc, ?limit= and ?offset= page.
+    """
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 500)
     try:
-        download_process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            bufsize=1,
-            universal_newlines=True,
-            cwd=amd_dir  # Run from apple-music-downloader directory
+        page = library.query_library(
+            search=request.args.get("q", "").strip() or None,
+            match=request.args.get("match", "substring"),
+            folder=request.args.get("folder") or None,
+            artist=request.args.get("artist") or None,
+            album=request.args.get("album") or None,
+            sort=request.args.get("sort", "artist"),
+            descending=request.args.get("order") == "desc",
+            limit=limit,
+            offset=max(request.args.get("offset", 0, type=int), 0)
         )
-        
-        download_running = True
-        threading.Thread(target=stream_download_logs, args=(download_process.stdout, downloader_logs), daemon=True).start()
-        
-        return jsonify({"status": "ok", "msg": "Download started successfully"})
-        
-    except Exception as e:
-        downloader_logs.append(f"❌ Error starting download: {str(e)}")
-        return jsonify({"status": "error", "msg": f"Failed to start download: {str(e)}"})
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
+    return jsonify({"status": "ok", "limit": limit, **page})
 
+@app.route("/library/refresh", methods=["POST"])
+def refresh_library():
+    """Re-index changed directories now instead of waiting for the next refresh"""
+    if is_engine:
+        handle_command("refresh_library", {})
+    else:
+        store.enqueue_command("refresh_library")
+    return jsonify({"status": "ok", "msg": "Library refresh started"})
 
-@app.route("/get_logs")
-def get_logs():
-    global wrapper_running, wrapper_process, download_running, download_process, wrapper_needs_2fa
+@app.route("/library/status")
+def get_library_status():
+    """Size and freshness of the save folder index"""
+    return jsonify({"status": "ok", "library": store.get_state("library_status", library.library_status)})
+
+@app.route("/subscriptions")
+def subscriptions_page():
+    return render_template("subscriptions.html")
+
+@app.route("/subscriptions/list")
+def list_subscriptions():
+    return jsonify({"status": "ok", "subscriptions": store.load_subscriptions()})
+
+@app.route("/subscriptions", methods=["POST"])
+def add_subscription():
+    """Follow a playlist or artist link; its tracks are queued by the first sync"""
+    link = (request.form.get("link") or "").strip()
+    format_choice = request.form.get("format")
+    special_audio = request.form.get("special_audio") == "true"
+    priority = scheduler.normalize_priority(request.form.get("priority") or "low")
+    
+    if not link:
+        return jsonify({"status": "error", "msg": "No URL provided"})
     
-    # Check if wrapper process is still running
-    if wrapper_process and wrapper_process.poll() is not None:
-        if wrapper_running:  # Process ended but we thought it was still running
-            wrapper_running = False
+    job_format = jobs.resolve_format(format_choice, special_audio)
+    if not job_format:
+        return jsonify({"status": "error", "msg": "Invalid format selected"})
     
-    # Check if download process is still running
-    if download_process and download_process.poll() is not None:
-        if download_running:  # Process ended but we thought it was still running
-            download_running = False
+    if not priority:
+        return jsonify({"status": "error", "msg": "Invalid priority selected"})
     
-    return jsonify({
-        "wrapper": wrapper_logs[-200:],  # last 200 lines
-        "downloader": downloader_logs[-200:],
-        "wrapper_running": wrapper_running,
-        "download_running": download_running,
-        "wrapper_needs_2fa": wrapper_needs_2fa
-    })
+    try:
+        interval = subscriptions.normalize_interval(request.form.get("interval"))
+        subscription_id, created = subscriptions.add(link, job_format, priority, interval)
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)})
+    if not created:
+        return jsonify({"status": "ok", "msg": f"Already following as subscription #{subscription_id}",
+                        "subscription_id": subscription_id})
+    
+    request_sync(subscription_id)
+    return jsonify({"status": "ok", "msg": f"Following as subscription #{subscription_id}, syncing now",
+                    "subscription_id": subscription_id})
+
+@app.route("/subscriptions/<int:subscription_id>/sync", methods=["POST"])
+def sync_subscription(subscription_id):
+    """Sync a subscription now instead of waiting for its interval"""
+    if not store.load_subscription(subscription_id):
+        return jsonify({"status": "error", "msg": "Subscription not found"}), 404
+    request_sync(subscription_id)
+    return jsonify({"status": "ok", "msg": f"Syncing subscription #{subscription_id}"})
+
+@app.route("/subscriptions/<int:subscription_id>/delete", methods=["POST"])
+def delete_subscription(subscription_id):
+    """Stop following a link; jobs it queued are kept"""
+    if not store.delete_subscription(subscription_id):
+        return jsonify({"status": "error", "msg": "Subscription not found"}), 404
+    return jsonify({"status": "ok", "msg": f"Subscription #{subscription_id} removed"})
+
+def request_sync(subscription_id):
+    if is_engine:
+        subscriptions.sync_in_background(subscription_id)
+    else:
+        store.enqueue_command("sync_subscription", subscription_id=subscription_id)
+
+@app.route("/metrics")
+def get_metrics():
+    """Prometheus metrics for jobs, wrappers and the log pipeline"""
+    status = shared_status()
+    now = time.time()
+    instances = status.get("wrappers", [])
+    uptime = lambda w: round(now - w["started_at"], 3) if w["state"] in ("starting", "needs_2fa", "ready") and w["started_at"] else 0
+    gauges = [
+        ("amdl_queue_depth", "gauge", "Downloads waiting for a worker", [({}, status["jobs_queued"])]),
+        ("amdl_workers_active", "gauge", "Workers running a download", [({}, status["jobs_running"])]),
+        ("amdl_workers", "gauge", "Download worker pool size", [({}, jobs.pool_size())]),
+        ("amdl_lane_depth", "gauge", "Downloads waiting in each priority lane",
+         [({"priority": lane}, count) for lane, count in status.get("queued_by_priority", {}).items()]),
+        ("amdl_conversion_queue_depth", "gauge", "Files waiting for a conversion worker",
+         [({}, status.get("conversions_queued", 0))]),
+        ("amdl_conversions_active", "gauge", "ffmpeg conversions running", [({}, status.get("conversions_running", 0))]),
+        ("amdl_wrapper_up", "gauge", "1 while a wrapper instance is logged in",
+         [({"instance": str(w["index"])}, int(w["state"] == "ready")) for w in instances]),
+        ("amdl_wrapper_uptime_seconds", "gauge", "Seconds since a wrapper instance was (re)started",
+         [({"instance": str(w["index"])}, uptime(w)) for w in instances]),
+        ("amdl_wrapper_restarts_total", "counter", "Wrapper instance restarts",
+         [({"instance": str(w["index"])}, w["restarts"]) for w in instances]),
+        ("amdl_wrapper_active_jobs", "gauge", "Downloads running on a wrapper instance",
+         [({"instance": str(w["index"])}, w["active_jobs"]) for w in instances]),
+    ]
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.route("/build_status")
+def get_build_status():
+    """Report the downloader build cache state and time spent building"""
+    return jsonify({"status": "ok", "build": build_status})
+
+def terminate_wrapper():
+    """Stop the wrapper pool; returns True if any instance was running"""
+    return wrappers.stop_all()
 
 @app.route("/stop_wrapper", methods=["POST"])
 def stop_wrapper():
-    global wrapper_process, wrapper_running, wrapper_logs, wrapper_needs_2fa
+    if not is_engine:
+        if not shared_status()["wrapper_running"]:
+            return jsonify({"status": "error", "msg": "Wrapper not running"})
+        store.enqueue_command("stop_wrapper")
+        return jsonify({"status": "ok", "msg": "Wrapper stopped"})
     
-    if wrapper_process and wrapper_process.poll() is None:
-        wrapper_process.terminate()
-        wrapper_logs.append("Wrapper process terminated by user")
-        wrapper_running = False
-        wrapper_needs_2fa = False
+    if terminate_wrapper():
         return jsonify({"status": "ok", "msg": "Wrapper stopped"})
     else:
         return jsonify({"status": "error", "msg": "Wrapper not running"})
@@ -347,82 +705,41 @@ def stop_wrapper():
 def settings():
     return render_template("settings.html")
 
+@app.route("/get_scheduler")
+def get_scheduler():
+    """Concurrency and bandwidth limits of the download scheduler"""
+    settings = load_settings()
+    return jsonify({"status": "ok", "scheduler": {
+        "download-workers": settings["download-workers"],
+        "download-concurrency": settings["download-concurrency"],
+        "format-concurrency": settings["format-concurrency"] or {},
+        "bandwidth-limit-mbps": settings["bandwidth-limit-mbps"],
+    }})
+
+@app.route("/save_scheduler", methods=["POST"])
+def save_scheduler():
+    """Change the scheduler limits in webui.yaml; running workers pick them up within a second"""
+    try:
+        save_settings(scheduler.normalize_settings(request.json or {}))
+        if is_engine and jobs.workers:
+            jobs.ensure_workers()  # a limit above download-workers needs more workers
+        return jsonify({"status": "ok", "msg": "Scheduler settings saved"})
+    except Exception as e:
+        return jsonify({"status": "error", "msg": str(e)})
+
 @app.route("/get_config")
 def get_config():
     try:
-        script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        config_path = os.path.join(script_dir, "apple-music-downloader", "config.yaml")
-        
-        with open(config_path, 'r', encoding='utf-8') as file:
-            config = yaml.safe_load(file)
-            return jsonify({"status": "ok", "config": config})
+        config = downloader_config.load()
+        return conditional_json({"status": "ok", "config": config})
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)})
 
 @app.route("/save_config", methods=["POST"])
 def save_config():
     try:
-        script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        config_path = os.path.join(script_dir, "apple-music-downloader", "config.yaml")
-        
-        config_data = request.json
-        
-        # Define fields that should be integers
-        integer_fields = {
-            'alac-max', 'atmos-max', 'limit-max', 'max-memory-limit', 'mv-max'
-        }
-        
-        # Define fields that should be booleans
-        boolean_fields = {
-            'embed-lrc', 'save-lrc-file', 'save-artist-cover', 'save-animated-artwork',
-            'emby-animated-artwork', 'embed-cover', 'get-m3u8-from-device',
-            'use-songinfo-for-playlist', 'dl-albumcover-for-playlist',
-            'convert-after-download', 'convert-keep-original', 'convert-skip-if-source-matches'
-        }
-        
-        # Define fields that are folder paths and need Windows to WSL translation
-        path_fields = {
-            'alac-save-folder', 'atmos-save-folder', 'aac-save-folder'
-        }
-        
-        def translate_path_to_wsl(path):
-            """Translate Windows paths to WSL paths when saving config"""
-            if not path:
-                return path
-            # Check if it's a Windows-style path (e.g., C:/, D:/)
-            if len(path) >= 3 and path[1:3] == ':\\':
-                # Convert C:\ to /mnt/c/
-                drive = path[0].lower()
-                rest = path[3:].replace('\\', '/')
-                return f"/mnt/{drive}/{rest}"
-            elif len(path) >= 3 and path[1:3] == ':/':
-                # Convert C:/ to /mnt/c/
-                drive = path[0].lower()
-                rest = path[3:]
-                return f"/mnt/{drive}/{rest}"
-            return path
-        
-        # Convert data types properly
-        for key, value in config_data.items():
-            if key in integer_fields:
-                try:
-                    config_data[key] = int(value) if value else 0
-                except (ValueError, TypeError):
-                    config_data[key] = 0
-            elif key in boolean_fields:
-                # Handle boolean conversion
-                if isinstance(value, str):
-                    config_data[key] = value.lower() in ('true', '1', 'yes', 'on')
-                else:
-                    config_data[key] = bool(value)
-            elif key in path_fields:
-                # Translate Windows paths to WSL format
-                config_data[key] = translate_path_to_wsl(str(value))
-            # Strings remain as strings (default)
-        
-        with open(config_path, 'w', encoding='utf-8') as file:
-            yaml.dump(config_data, file, default_flow_style=False, allow_unicode=True)
-            
+        # Convert data types properly before writing
+        downloader_config.save(normalize_config(request.json))
         return jsonify({"status": "ok", "msg": "Configuration saved successfully"})
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)})
@@ -431,7 +748,7 @@ def save_config():
 def check_saved_credentials():
     """Check if saved credentials exist"""
     email, password = load_credentials()
-    return jsonify({"has_credentials": email is not None, "email": email if email else ""})
+    return conditional_json({"has_credentials": email is not None, "email": email if email else ""})
 
 @app.route("/delete_saved_credentials", methods=["POST"])
 def delete_saved_credentials():
@@ -444,6 +761,13 @@ def delete_saved_credentials():
 @app.route("/auto_login", methods=["POST"])
 def auto_login():
     """Attempt auto-login with saved credentials"""
+    if not is_engine:
+        email, password = load_credentials()
+        if not email:
+            return jsonify({"status": "error", "msg": "No saved credentials or login failed"})
+        store.enqueue_command("auto_login")
+        return jsonify({"status": "ok", "msg": "Auto-login started"})
+    
     if attempt_auto_login():
         return jsonify({"status": "ok", "msg": "Auto-login started"})
     else:
@@ -453,19 +777,8 @@ def auto_login():
 def get_download_folders():
     """Get download folder paths from config with Windows to WSL path translation"""
     try:
-        script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        config_path = os.path.join(script_dir, "apple-music-downloader", "config.yaml")
-        
-        with open(config_path, 'r', encoding='utf-8') as file:
-            config = yaml.safe_load(file)
-            
         # Paths are now already in correct format in config file, no need to translate
-        folders = {
-            "alac": config.get("alac-save-folder", "AM-DL downloads"),
-            "atmos": config.get("atmos-save-folder", "AM-DL-Atmos downloads"),
-            "aac": config.get("aac-save-folder", "AM-DL-AAC downloads")
-        }
-        
-        return jsonify({"status": "ok", "folders": folders})
+        folders = download_folders()
+        return conditional_json({"status": "ok", "folders": folders})
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)})
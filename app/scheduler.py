@@ -0,0 +1,221 @@
+import os
+import signal
+import threading
+import time
+from collections import deque
+from .settings import get_setting
+from . import metrics
+
+# Which queued download a free worker runs next, and how fast running ones may
+# pull. Jobs wait in priority lanes served high -> normal -> low (FIFO within a
+# lane); a job whose format is at its `format-concurrency` cap is passed over
+# for the next one that fits, and nothing starts past `download-concurrency`.
+# Failed downloads waiting for an automatic retry stay in their lane until
+# their retry_at, and paused ones until they are resumed. A running download
+# that is paused gives its slot back, so another job can start in its place.
+# `bandwidth-limit-mbps` is a token bucket over the bytes every running
+# download reports: while it is overdrawn the downloaders' process groups are
+# stopped (SIGSTOP), so their sockets stall until the budget refills.
+# All three settings are read again on every decision, so changes to
+# webui.yaml (e.g. from the settings page) apply without a restart.
+PRIORITIES = ("high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+FORMATS = ("ATMOS", "AAC", "STANDARD")
+THROTTLE_INTERVAL = 0.25  # seconds between bandwidth checks
+BURST_SECONDS = 1         # budget a download may use ahead of the limit
+
+# Held while a job is paused, resumed or cancelled and while the throttle
+# stops or continues it, so the throttle never undoes the user's pause
+control_lock = threading.RLock()
+
+def normalize_priority(priority):
+    priority = (priority or DEFAULT_PRIORITY).lower()
+    return priority if priority in PRIORITIES else None
+
+def concurrency_limit():
+    """Downloads allowed to run at once (paused ones do not count)"""
+    return int(get_setting("download-concurrency") or get_setting("download-workers"))
+
+def format_limits():
+    """format -> downloads of that format allowed at once, for the formats that have a cap"""
+    return {name: int(limit) for name, limit in (get_setting("format-concurrency") or {}).items() if limit}
+
+def bandwidth_limit():
+    """Total download budget in bytes per second, or None when unlimited"""
+    mbps = float(get_setting("bandwidth-limit-mbps") or 0)
+    return mbps * 1e6 / 8 if mbps > 0 else None
+
+def normalize_settings(data):
+    """Scheduler settings from the settings page, checked and typed for webui.yaml"""
+    def count(value, name):
+        if value in (None, "", 0, "0"):
+            return None
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a whole number")
+        if value < 0:
+            raise ValueError(f"{name} cannot be negative")
+        return value or None
+
+    try:
+        mbps = float(data.get("bandwidth-limit-mbps") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("bandwidth-limit-mbps must be a number")
+    if mbps < 0:
+        raise ValueError("bandwidth-limit-mbps cannot be negative")
+    caps = data.get("format-concurrency") or {}
+    format_caps = {name: count(caps.get(name), f"{name} limit") for name in FORMATS}
+    return {
+        "download-concurrency": count(data.get("download-concurrency"), "download-concurrency"),
+        "format-concurrency": {name: cap for name, cap in format_caps.items() if cap},
+        "bandwidth-limit-mbps": mbps,
+    }
+
+class Scheduler:
+    """Queued downloads in priority lanes, handed to workers within the concurrency budget"""
+
+    def __init__(self):
+        self.lanes = {priority: deque() for priority in PRIORITIES}
+        self.running = {}  # format -> downloads taken and not yet done
+        self.cond = threading.Condition()
+
+    def put(self, job):
+        with self.cond:
+            self.lanes[normalize_priority(job.priority) or DEFAULT_PRIORITY].append(job)
+            self.cond.notify_all()
+
+    def take(self):
+        """Block until a queued job may start, then claim its slot"""
+        with self.cond:
+            while True:
+                job = self.next_job()
+                if job:
+                    self.lanes[normalize_priority(job.priority) or DEFAULT_PRIORITY].remove(job)
+                    self.running[job.format] = self.running.get(job.format, 0) + 1
+                    return job
+                # Time out now and then so raised limits apply without a notify
+                self.cond.wait(1)
+
+    def next_job(self):
+        # Settings are read once per decision, not once per queued job under the lock
+        limit = concurrency_limit()
+        if limit and sum(self.running.values()) >= limit:
+            return None
+        caps = format_limits()
+        now = time.time()
+        for priority in PRIORITIES:
+            for job in self.lanes[priority]:
+                if job.retry_at and job.retry_at > now:
+                    continue  # failed download waiting out its backoff
+                if job.paused:
+                    continue
+                cap = caps.get(job.format)
+                if not cap or self.running.get(job.format, 0) < cap:
+                    return job
+        return None
+
+    def done(self, job):
+        """Release the slot of a job a worker finished with"""
+        with self.cond:
+            self.running[job.format] = max(0, self.running.get(job.format, 0) - 1)
+            self.cond.notify_all()
+
+    def remove(self, job):
+        """Take a job out of its lane; False if a worker already took it"""
+        with self.cond:
+            try:
+                self.lanes[normalize_priority(job.priority) or DEFAULT_PRIORITY].remove(job)
+                return True
+            except ValueError:
+                return False
+
+    def hold(self, job):
+        """Mark a queued job paused; False if a worker already took it"""
+        with self.cond:
+            if job not in self.lanes[normalize_priority(job.priority) or DEFAULT_PRIORITY]:
+                return False
+            job.paused = True
+            return True
+
+    def release(self, job):
+        """Free the slot of a running job that was paused"""
+        self.done(job)
+
+    def reclaim(self, job):
+        """Take the slot of a paused job back when it resumes, even past the limits"""
+        with self.cond:
+            self.running[job.format] = self.running.get(job.format, 0) + 1
+
+    def notify(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def queued(self):
+        """Queued job count per lane"""
+        with self.cond:
+            return {priority: len(lane) for priority, lane in self.lanes.items()}
+
+def signal_group(process, sig):
+    """Signal a downloader and everything it started (its own process group)"""
+    try:
+        os.killpg(process.pid, sig)
+    except OSError:
+        pass  # already gone
+
+def pause(job):
+    with control_lock:
+        if job.paused or job.cancelled:
+            return  # job control took over since the throttle looked
+        job.throttled = True
+        signal_group(job.process, signal.SIGSTOP)
+
+def resume(job):
+    with control_lock:
+        if job.paused:
+            return  # stays stopped until the user resumes it
+        job.throttled = False
+        signal_group(job.process, signal.SIGCONT)
+
+def throttle_loop(list_jobs):
+    """Keep the combined download rate of running jobs under `bandwidth-limit-mbps`"""
+    if not hasattr(signal, "SIGSTOP"):
+        return  # no job control on this platform
+    seen = {}  # job id -> bytes reported at the last check
+    tokens = 0.0
+    while True:
+        time.sleep(THROTTLE_INTERVAL)
+        try:
+            running = [job for job in list_jobs() if job.status == "running" and job.process]
+            moved = 0
+            for job in running:
+                total = job.progress.completed_bytes + job.progress.bytes_done
+                moved += max(0, total - seen.get(job.id, 0))
+                seen[job.id] = total
+            ids = {job.id for job in running}
+            for job_id in list(seen):
+                if job_id not in ids:
+                    del seen[job_id]
+            # Paused and cancelled downloads are left to job control
+            running = [job for job in running if not job.paused and not job.cancelled]
+
+            limit = bandwidth_limit()
+            if not limit:
+                tokens = 0.0
+                for job in running:
+                    if job.throttled:
+                        resume(job)
+                continue
+            tokens = min(tokens + limit * THROTTLE_INTERVAL, limit * BURST_SECONDS) - moved
+            throttled = False
+            for job in running:
+                if tokens < 0 and job.progress.phase == "download":
+                    if not job.throttled:
+                        pause(job)
+                    throttled = True
+                elif job.throttled:
+                    resume(job)
+            if throttled:
+                metrics.inc("amdl_bandwidth_throttled_seconds_total", THROTTLE_INTERVAL)
+        except Exception as e:
+            print(f"Error enforcing the bandwidth limit: {e}")
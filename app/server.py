@@ -0,0 +1,46 @@
+import os
+import glob
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+from .paths import PROJECT_DIR, WRAPPER_DIR
+from .settings import get_setting
+
+def prepare_environment():
+    """Ensure Bento4 and Wrapper are in PATH locally"""
+    bin_candidates = glob.glob(os.path.join(PROJECT_DIR, "bento4", "Bento4*"))  # find extracted folder
+    if bin_candidates:
+        bin_dir = os.path.join(bin_candidates[0], "bin")
+        os.environ["PATH"] = f"{bin_dir}:{os.environ['PATH']}"
+
+    os.environ["PATH"] = f"{WRAPPER_DIR}:{os.environ['PATH']}"
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve_production(app, host="0.0.0.0", port=5000):
+    """Serve through a multi-threaded WSGI server (no reloader or debugger).
+
+    Uses waitress when it is installed and falls back to a threaded wsgiref
+    server. For several worker processes run gunicorn against wsgi.py instead.
+    """
+    from .routes import start_engine
+    start_engine()
+
+    threads = int(get_setting("server-threads"))
+    try:
+        from waitress import serve
+    except ImportError:
+        serve = None
+
+    if serve:
+        print(f"🏭 Serving with waitress on {host}:{port} ({threads} threads)")
+        serve(app, host=host, port=port, threads=threads)
+    else:
+        print(f"🏭 Serving with threaded wsgiref server on {host}:{port}")
+        server = make_server(host, port, app, server_class=ThreadingWSGIServer,
+                             handler_class=QuietRequestHandler)
+        server.serve_forever()
@@ -0,0 +1,55 @@
+import os
+from .config_store import CachedYamlFile
+from .paths import PROJECT_DIR
+
+# Settings for the web UI itself (config.yaml belongs to the downloader)
+SETTINGS_PATH = os.path.join(PROJECT_DIR, "webui.yaml")
+
+DEFAULT_SETTINGS = {
+    "download-workers": 2,
+    "server-threads": 16,   # production mode; each open page holds one for /events
+    "library-refresh-seconds": 300,
+    "wrapper-instances": 1,
+    "wrapper-binary": None,  # defaults to wrapper/wrapper; point at a stub for local testing
+    "wrapper-supervisor": True,
+    "wrapper-login-timeout": 120,    # seconds; 0 disables
+    "wrapper-silence-seconds": 300,  # max output gap while downloads run; 0 disables
+    "webui-conversion": True,        # convert-after-download runs here instead of in the downloader
+    "conversion-workers": None,      # parallel ffmpeg processes; defaults to the CPU count
+    "log-file-bytes": 4 * 1024 * 1024,  # job/wrapper log files are gzipped in segments of this size
+    "download-concurrency": None,    # downloads running at once; defaults to download-workers
+    "format-concurrency": None,      # per-format caps, e.g. {"ATMOS": 1, "AAC": 2}
+    "bandwidth-limit-mbps": 0,       # combined download rate of all jobs; 0 disables
+    "job-retries": 3,                # automatic retries of a failed download
+    "retry-backoff-seconds": 30,     # wait before the first retry; doubles for each further one
+    "expand-collections": True,      # queue album/playlist links as one job per track
+    "catalog-cache-seconds": 86400,  # how long album/playlist track lists are reused; 0 disables
+    "catalog-url": None,             # stand-in catalog service (bench/stub_catalog.py); defaults to Apple's
+    "subscription-interval-seconds": 21600,  # how often followed playlists/artists are synced
+    "asset-cdn-fallback": False,     # load missing static/vendor/ files from the CDN instead
+}
+
+settings_file = CachedYamlFile(SETTINGS_PATH)
+
+def load_settings():
+    """Load web UI settings, falling back to the defaults for missing keys"""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        settings.update(settings_file.load())
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error loading web UI settings: {e}")
+    return settings
+
+def get_setting(key):
+    return load_settings().get(key, DEFAULT_SETTINGS.get(key))
+
+def save_settings(updates):
+    """Write keys to webui.yaml, keeping the others already in the file"""
+    try:
+        current = dict(settings_file.load())
+    except FileNotFoundError:
+        current = {}
+    current.update(updates)
+    settings_file.save(current)
@@ -0,0 +1,533 @@
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from .paths import PROJECT_DIR
+
+# Shared state for every web worker process. One process (the engine) owns the
+# wrapper/downloader child processes and publishes its state here; the others
+# read it and forward control actions through the commands table.
+DB_PATH = os.path.join(PROJECT_DIR, "webui.db")
+ENGINE_LOCK_PATH = os.path.join(PROJECT_DIR, "webui.lock")
+LOG_RETENTION = 100000   # log lines kept in the database
+READ_LOGS_LIMIT = 2000   # most lines one read_logs call returns, like a LogStore's maxlen
+FLUSH_INTERVAL = 0.25    # seconds between log/status publishes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS logs (
+    seq INTEGER PRIMARY KEY,
+    stream TEXT NOT NULL,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_stream_seq ON logs(stream, seq);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS library_files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    artist TEXT COLLATE NOCASE,
+    album TEXT COLLATE NOCASE,
+    track TEXT COLLATE NOCASE,
+    track_number INTEGER
+);
+CREATE INDEX IF NOT EXISTS library_files_dir ON library_files(dir);
+CREATE INDEX IF NOT EXISTS library_files_album ON library_files(album, track_number);
+CREATE INDEX IF NOT EXISTS library_files_artist ON library_files(artist, album, track_number);
+CREATE INDEX IF NOT EXISTS library_files_track ON library_files(track);
+CREATE TABLE IF NOT EXISTS library_dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    artist TEXT,
+    album TEXT,
+    track TEXT,
+    PRIMARY KEY (job_id, path)
+);
+CREATE TABLE IF NOT EXISTS conversions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT,
+    format TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    percent REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS catalog_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    link TEXT NOT NULL,
+    format TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    title TEXT,
+    interval_seconds INTEGER,
+    created_at REAL NOT NULL,
+    next_sync_at REAL NOT NULL,
+    last_sync_at REAL,
+    last_sync_seconds REAL,
+    last_error TEXT,
+    tracks_total INTEGER,
+    tracks_queued INTEGER NOT NULL DEFAULT 0,
+    queued_total INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (link, format)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    link TEXT NOT NULL,
+    format TEXT NOT NULL,
+    status TEXT NOT NULL,
+    exit_code INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    progress TEXT,
+    output_folder TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    priority TEXT NOT NULL DEFAULT 'normal',
+    collection TEXT,
+    title TEXT,
+    retries INTEGER NOT NULL DEFAULT 0,
+    retry_at REAL,
+    checkpoint TEXT
+);
+"""
+
+# Columns added after the first release of the jobs table
+JOB_COLUMNS = {
+    "output_folder": "TEXT",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "priority": "TEXT NOT NULL DEFAULT 'normal'",
+    "collection": "TEXT",
+    "title": "TEXT",
+    "retries": "INTEGER NOT NULL DEFAULT 0",
+    "retry_at": "REAL",
+    "checkpoint": "TEXT",
+}
+
+# Columns added after the first release of the job_files table
+JOB_FILE_COLUMNS = {
+    "artist": "TEXT",
+    "album": "TEXT",
+    "track": "TEXT",
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_link ON jobs(link);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS jobs_collection ON jobs(collection);
+CREATE INDEX IF NOT EXISTS conversions_job ON conversions(job_id);
+CREATE INDEX IF NOT EXISTS conversions_status ON conversions(status);
+"""
+
+_local = threading.local()
+_pending_logs = []
+_pending_lock = threading.Lock()
+_flush_lock = threading.RLock()  # one flush at a time, so the cursor only moves forward
+_engine_lock_file = None
+
+def connect():
+    """Per-thread connection to the shared database"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        migrate(conn)
+        conn.executescript(INDEXES)
+        _local.conn = conn
+    return conn
+
+def migrate(conn):
+    """Add columns missing from databases created by older versions"""
+    for table, columns in (("jobs", JOB_COLUMNS), ("job_files", JOB_FILE_COLUMNS)):
+        existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column, definition in columns.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def acquire_engine_lock():
+    """Try to become the engine process; only one process can hold the lock"""
+    global _engine_lock_file
+    if _engine_lock_file:
+        return True
+    lock_file = open(ENGINE_LOCK_PATH, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _engine_lock_file = lock_file
+    return True
+
+# --- Key/value state ---
+
+def set_state(key, value):
+    connect().execute(
+        "INSERT INTO state (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, json.dumps(value))
+    )
+
+def get_state(key, default=None):
+    row = connect().execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+    return json.loads(row["value"]) if row else default
+
+def delete_state(key):
+    connect().execute("DELETE FROM state WHERE key = ?", (key,))
+
+def get_states(prefix):
+    """(key, value) pairs for every key starting with prefix"""
+    rows = connect().execute(
+        "SELECT key, value FROM state WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+    ).fetchall()
+    return [(row["key"], json.loads(row["value"])) for row in rows]
+
+# --- Logs ---
+
+def mirror_log(stream, seq, line):
+    """Queue a log line for the next batched write (called from LogStore.append)"""
+    with _pending_lock:
+        _pending_logs.append((seq, stream, line))
+
+def mirror_clear(stream, seq):
+    with _flush_lock:
+        flush_logs()
+        set_state(f"cleared:{stream}", seq)
+        set_state("cursor", max(read_cursor(), seq))
+
+def flush_logs():
+    """Write the queued lines and move the cursor past them in one transaction.
+
+    Called by the publisher and by workers finishing a job; the flush lock
+    keeps a later batch from publishing its cursor before an earlier one is in.
+    """
+    global _pending_logs
+    with _flush_lock:
+        with _pending_lock:
+            batch, _pending_logs = _pending_logs, []
+        if not batch:
+            return
+        conn = connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO logs (seq, stream, line) VALUES (?, ?, ?)", batch)
+            set_state("cursor", max(read_cursor(), batch[-1][0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def last_log_seq():
+    row = connect().execute("SELECT MAX(seq) AS seq FROM logs").fetchone()
+    return row["seq"] or 0
+
+def read_cursor():
+    return get_state("cursor", 0)
+
+def read_logs(stream, since, upto, limit=READ_LOGS_LIMIT):
+    """Same contract as LogStore.since, read from the shared database
+
+    At most the newest `limit` lines are returned; a caller further behind
+    than that has a gap and is told to reset, as if the lines were evicted.
+    """
+    rows = connect().execute(
+        "SELECT line FROM logs WHERE stream = ? AND seq > ? AND seq <= ? ORDER BY seq DESC LIMIT ?",
+        (stream, since, upto, limit + 1)
+    ).fetchall()
+    reset = since < get_state(f"cleared:{stream}", 0) <= upto or since < get_state("logs_trimmed", 0)
+    if len(rows) > limit:
+        rows, reset = rows[:limit], True
+    return [row["line"] for row in reversed(rows)], reset
+
+def tail_log_rows(stream, count):
+    """Newest (seq, line) rows of a stream since it was last cleared, oldest first"""
+    rows = connect().execute(
+        "SELECT seq, line FROM logs WHERE stream = ? AND seq > ? ORDER BY seq DESC LIMIT ?",
+        (stream, get_state(f"cleared:{stream}", 0), count)
+    ).fetchall()
+    return [(row["seq"], row["line"]) for row in reversed(rows)]
+
+def tail_logs(stream, count):
+    return [line for _, line in tail_log_rows(stream, count)]
+
+def trim_logs():
+    cutoff = last_log_seq() - LOG_RETENTION
+    if cutoff > 0:
+        connect().execute("DELETE FROM logs WHERE seq <= ?", (cutoff,))
+        set_state("logs_trimmed", cutoff)
+
+# --- Commands from non-engine workers ---
+
+def enqueue_command(name, **payload):
+    connect().execute(
+        "INSERT INTO commands (name, payload, created_at) VALUES (?, ?, ?)",
+        (name, json.dumps(payload), time.time())
+    )
+
+def take_commands():
+    conn = connect()
+    rows = conn.execute("SELECT id, name, payload FROM commands ORDER BY id").fetchall()
+    if rows:
+        conn.execute("DELETE FROM commands WHERE id <= ?", (rows[-1]["id"],))
+    return [(row["name"], json.loads(row["payload"])) for row in rows]
+
+# --- Jobs ---
+
+def create_job(link, format_choice, output_folder=None, status="queued", priority="normal",
+               collection=None, title=None):
+    cursor = connect().execute(
+        "INSERT INTO jobs (link, format, status, created_at, output_folder, priority, collection, title) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (link, format_choice, status, time.time(), output_folder, priority, collection, title)
+    )
+    return cursor.lastrowid
+
+def find_active_job(link, format_choice):
+    """Queued or running job for the same link and format, if any"""
+    row = connect().execute(
+        "SELECT * FROM jobs WHERE link = ? AND format = ? AND status IN ('queued', 'running') "
+        "ORDER BY id LIMIT 1",
+        (link, format_choice)
+    ).fetchone()
+    return row_to_job(row) if row else None
+
+def save_job(job):
+    """Write a job dict (Job.to_dict()) back to its row"""
+    connect().execute(
+        "UPDATE jobs SET status = ?, exit_code = ?, started_at = ?, finished_at = ?, progress = ?, "
+        "retries = ?, retry_at = ?, checkpoint = ? WHERE id = ?",
+        (job["status"], job["exit_code"], job["started_at"], job["finished_at"], json.dumps(job["progress"]),
+         job["retries"], job["retry_at"], json.dumps(job["checkpoint"]), job["id"])
+    )
+
+def requeue_unfinished_jobs():
+    """Reset jobs left queued/running by a previous engine; returns their IDs"""
+    conn = connect()
+    rows = conn.execute(
+        "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY id"
+    ).fetchall()
+    conn.execute(
+        "UPDATE jobs SET status = 'queued', exit_code = NULL, started_at = NULL, "
+        "finished_at = NULL, attempts = attempts + 1 WHERE status = 'running'"
+    )
+    return [row["id"] for row in rows]
+
+def row_to_job(row):
+    job = dict(row)
+    job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+    job["checkpoint"] = json.loads(job["checkpoint"]) if job["checkpoint"] else None
+    return job
+
+def load_job(job_id):
+    row = connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return row_to_job(row) if row else None
+
+def load_jobs(status=None, link=None, limit=None, offset=0, newest_first=False, collection=None):
+    """Job history, optionally filtered by status, link and/or the album/playlist it came from"""
+    query = "SELECT * FROM jobs"
+    conditions, params = [], []
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if link:
+        conditions.append("link = ?")
+        params.append(link)
+    if collection:
+        conditions.append("collection = ?")
+        params.append(collection)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id DESC" if newest_first else " ORDER BY id"
+    if limit:
+        query += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+    rows = connect().execute(query, params).fetchall()
+    return [row_to_job(row) for row in rows]
+
+def known_links(links, format_choice):
+    """The links with a completed, queued, running or cancelled job in this format"""
+    conn = connect()
+    known = set()
+    links = list(links)
+    for start in range(0, len(links), 500):
+        chunk = links[start:start + 500]
+        rows = conn.execute(
+            f"SELECT DISTINCT link FROM jobs WHERE format = ? AND status IN ('completed', 'queued', 'running', 'cancelled') "
+            f"AND link IN ({', '.join('?' * len(chunk))})",
+            [format_choice] + chunk
+        ).fetchall()
+        known.update(row["link"] for row in rows)
+    return known
+
+# --- Subscriptions ---
+
+def create_subscription(link, format_choice, priority, interval_seconds=None):
+    now = time.time()
+    cursor = connect().execute(
+        "INSERT INTO subscriptions (link, format, priority, interval_seconds, created_at, next_sync_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (link, format_choice, priority, interval_seconds, now, now)
+    )
+    return cursor.lastrowid
+
+def find_subscription(link, format_choice):
+    row = connect().execute(
+        "SELECT * FROM subscriptions WHERE link = ? AND format = ?", (link, format_choice)
+    ).fetchone()
+    return dict(row) if row else None
+
+def load_subscription(subscription_id):
+    row = connect().execute("SELECT * FROM subscriptions WHERE id = ?", (subscription_id,)).fetchone()
+    return dict(row) if row else None
+
+def load_subscriptions():
+    return [dict(row) for row in connect().execute("SELECT * FROM subscriptions ORDER BY id").fetchall()]
+
+def update_subscription(subscription_id, **fields):
+    """Set sync state columns (names come from the caller, never from requests)"""
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    connect().execute(f"UPDATE subscriptions SET {assignments} WHERE id = ?",
+                      list(fields.values()) + [subscription_id])
+
+def delete_subscription(subscription_id):
+    return connect().execute("DELETE FROM subscriptions WHERE id = ?", (subscription_id,)).rowcount > 0
+
+def due_subscriptions(now):
+    rows = connect().execute(
+        "SELECT id FROM subscriptions WHERE next_sync_at <= ? ORDER BY next_sync_at", (now,)
+    ).fetchall()
+    return [row["id"] for row in rows]
+
+# --- Catalog lookups ---
+
+def get_catalog(key, max_age):
+    """Cached catalog lookup no older than max_age seconds, or None"""
+    row = connect().execute(
+        "SELECT value FROM catalog_cache WHERE key = ? AND fetched_at >= ?", (key, time.time() - max_age)
+    ).fetchone()
+    return json.loads(row["value"]) if row else None
+
+def put_catalog(key, value):
+    connect().execute(
+        "INSERT INTO catalog_cache (key, value, fetched_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value, fetched_at = excluded.fetched_at",
+        (key, json.dumps(value), time.time())
+    )
+
+def prune_catalog(max_age):
+    connect().execute("DELETE FROM catalog_cache WHERE fetched_at < ?", (time.time() - max_age,))
+
+# --- Conversions ---
+
+def create_conversion(job_id, source, target_format):
+    cursor = connect().execute(
+        "INSERT INTO conversions (job_id, source, format, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+        (job_id, source, target_format, time.time())
+    )
+    return cursor.lastrowid
+
+def completed_conversion(source, target_format):
+    """Target of the latest completed conversion of source to target_format, if any"""
+    row = connect().execute(
+        "SELECT target FROM conversions WHERE source = ? AND format = ? AND status = 'completed' "
+        "ORDER BY id DESC LIMIT 1",
+        (source, target_format)
+    ).fetchone()
+    return row["target"] if row else None
+
+def save_conversion(conversion):
+    """Write a conversion dict (Conversion.to_dict()) back to its row"""
+    connect().execute(
+        "UPDATE conversions SET target = ?, status = ?, error = ?, percent = ?, started_at = ?, "
+        "finished_at = ? WHERE id = ?",
+        (conversion["target"], conversion["status"], conversion["error"], conversion["percent"],
+         conversion["started_at"], conversion["finished_at"], conversion["id"])
+    )
+
+def load_conversion(conversion_id):
+    row = connect().execute("SELECT * FROM conversions WHERE id = ?", (conversion_id,)).fetchone()
+    return dict(row) if row else None
+
+def load_conversions(status=None, job_id=None, limit=None, offset=0):
+    """Conversion history, newest first, optionally filtered by status and/or job"""
+    query = "SELECT * FROM conversions"
+    conditions, params = [], []
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if job_id:
+        conditions.append("job_id = ?")
+        params.append(job_id)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id DESC"
+    if limit:
+        query += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+    return [dict(row) for row in connect().execute(query, params).fetchall()]
+
+def requeue_unfinished_conversions():
+    """Reset conversions left queued/running by a previous engine; returns their IDs"""
+    conn = connect()
+    rows = conn.execute(
+        "SELECT id FROM conversions WHERE status IN ('queued', 'running') ORDER BY id"
+    ).fetchall()
+    conn.execute(
+        "UPDATE conversions SET status = 'queued', percent = NULL, started_at = NULL "
+        "WHERE status = 'running'"
+    )
+    return [row["id"] for row in rows]
+
+# --- Engine publisher ---
+
+def start_publisher(get_status, get_running_jobs, handle_command):
+    """Engine thread: flush logs, publish status/progress and run forwarded commands"""
+    def loop():
+        last_status = None
+        last_trim = time.time()
+        while True:
+            try:
+                flush_logs()
+                status = get_status()
+                if status != last_status:
+                    set_state("status", status)
+                    last_status = status
+                for job in get_running_jobs():
+                    save_job(job)
+                for name, payload in take_commands():
+                    handle_command(name, payload)
+                if time.time() - last_trim > 60:
+                    trim_logs()
+                    last_trim = time.time()
+            except Exception as e:
+                print(f"Error publishing shared state: {e}")
+            time.sleep(FLUSH_INTERVAL)
+    threading.Thread(target=loop, daemon=True).start()
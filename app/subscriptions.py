@@ -0,0 +1,101 @@
+import threading
+import time
+from .settings import get_setting
+from . import catalog, jobs, library, metrics, store
+
+# Followed playlists and artists. The engine lists each one again every
+# `subscription-interval-seconds` (or the subscription's own interval) and
+# queues only the tracks that have no completed or pending job in its format
+# and are not in its save folder already (same album and track name, e.g.
+# downloaded through the album), so a sync of an unchanged playlist costs one
+# catalog request and two queries.
+# Failed tracks are picked up again by the next sync.
+SUBSCRIPTION_KINDS = ("playlists", "artists")
+CHECK_INTERVAL = 30     # seconds between looks for due subscriptions
+MIN_INTERVAL = 300      # shortest sync interval a subscription may ask for
+ERROR_RETRY_SECONDS = 900  # wait after a failed sync (capped at the interval)
+
+sync_lock = threading.Lock()  # one sync at a time, from the syncer or "sync now"
+syncer_started = False
+
+def normalize_interval(value):
+    """Seconds between syncs from a form value; None for the default"""
+    if value in (None, "", 0, "0"):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Interval must be a whole number of seconds")
+    if value < MIN_INTERVAL:
+        raise ValueError(f"Interval must be at least {MIN_INTERVAL} seconds")
+    return value
+
+def interval_of(subscription):
+    return subscription["interval_seconds"] or max(MIN_INTERVAL, int(get_setting("subscription-interval-seconds")))
+
+def add(link, format_choice, priority, interval_seconds=None):
+    """Follow a playlist/artist link; returns (subscription ID, created)"""
+    link = link.strip()
+    if not catalog.parse_link(link, SUBSCRIPTION_KINDS):
+        raise ValueError("Only playlist and artist links can be followed")
+    existing = store.find_subscription(link, format_choice)
+    if existing:
+        return existing["id"], False
+    return store.create_subscription(link, format_choice, priority, interval_seconds), True
+
+def sync(subscription_id):
+    """List a subscription now and queue the tracks it gained (engine process only); returns its row"""
+    with sync_lock:
+        subscription = store.load_subscription(subscription_id)
+        if not subscription:
+            return None
+        started = time.time()
+        fields = {"last_sync_at": started}
+        try:
+            collection = catalog.resolve(subscription["link"], SUBSCRIPTION_KINDS, fresh=True)
+            if not collection:
+                raise catalog.CatalogError("not a playlist or artist link")
+            known = store.known_links([link for link, _ in collection["links"]], subscription["format"])
+            tracks = [(link, title, album) for (link, title), album in zip(collection["links"], collection["albums"])
+                      if link not in known]
+            in_library = library.indexed_tracks(jobs.FORMAT_FOLDERS[subscription["format"]],
+                                                [(album, title) for _, title, album in tracks])
+            missing = [(link, title) for link, title, album in tracks if (album, title) not in in_library]
+            for link, title in missing:
+                jobs.submit_job(link, subscription["format"], subscription["priority"], subscription["link"], title)
+            if missing:
+                jobs.shared_log(f"🔔 {collection['title']}: queued {len(missing)} new track(s)")
+            fields.update(title=collection["title"], tracks_total=len(collection["links"]),
+                          tracks_queued=len(missing), queued_total=subscription["queued_total"] + len(missing),
+                          last_error=None, next_sync_at=started + interval_of(subscription))
+            status = "ok"
+        except catalog.CatalogError as e:
+            jobs.shared_log(f"⚠️ Sync of {subscription['title'] or subscription['link']} failed: {e}")
+            fields.update(last_error=str(e), tracks_queued=0,
+                          next_sync_at=started + min(ERROR_RETRY_SECONDS, interval_of(subscription)))
+            status = "error"
+        fields["last_sync_seconds"] = round(time.time() - started, 3)
+        store.update_subscription(subscription_id, **fields)
+        metrics.inc("amdl_subscription_syncs_total", status=status)
+        metrics.observe("amdl_subscription_sync_duration_seconds", fields["last_sync_seconds"])
+        return store.load_subscription(subscription_id)
+
+def sync_in_background(subscription_id):
+    threading.Thread(target=sync, args=(subscription_id,), daemon=True).start()
+
+def start_syncer():
+    """Sync subscriptions as they come due, on a background thread of the engine"""
+    global syncer_started
+    if syncer_started:
+        return
+    syncer_started = True
+
+    def loop():
+        while True:
+            try:
+                for subscription_id in store.due_subscriptions(time.time()):
+                    sync(subscription_id)
+            except Exception as e:
+                print(f"Error syncing subscriptions: {e}")
+            time.sleep(CHECK_INTERVAL)
+    threading.Thread(target=loop, daemon=True).start()
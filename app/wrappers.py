@@ -0,0 +1,483 @@
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from . import iomux, logfiles, metrics
+from .config_store import CachedYamlFile, FORMAT_FOLDERS, downloader_config
+from .credentials import delete_credentials, has_own_credentials, load_credentials, save_credentials
+from .library import resolve_folder
+from .paths import AMD_DIR, BUILD_DIR, PROJECT_DIR, WRAPPER_DIR
+from .settings import get_setting
+
+# Instance 0 runs from the wrapper folder; extra instances get their own copy
+# (the wrapper keeps its login session inside its folder) and their own ports
+INSTANCES_DIR = os.path.join(PROJECT_DIR, "wrappers")
+PORT_KEYS = {"decrypt-m3u8-port": "127.0.0.1:10020", "get-m3u8-port": "127.0.0.1:20020"}
+ACCOUNT_PORT = 30020
+
+# Supervisor: restart delays double from BACKOFF_BASE up to BACKOFF_MAX and
+# reset once an instance has stayed logged in for STABLE_SECONDS
+SUPERVISOR_INTERVAL = 2
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+STABLE_SECONDS = 60
+MAX_FAILURES = 8
+PROBE_FAILURES = 3       # consecutive failed port probes before a wrapper counts as hung
+
+# Hooks set by routes: the shared wrapper log
+log = print
+clear_log = lambda: None
+
+instances = []
+pool_lock = threading.Lock()
+wanted = False  # whether the wrappers should be kept running (False after Stop Wrapper)
+
+def split_address(address):
+    host, _, port = str(address).rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+class Session:
+    """One wrapper process: how it was started and whether it has logged in"""
+
+    def __init__(self, email, password, auto_login, supervised, log_name):
+        self.email = email
+        self.password = password
+        self.auto_login = auto_login
+        self.supervised = supervised
+        self.log_name = log_name
+        self.login_successful = False
+
+class WrapperInstance:
+    """One wrapper process, its login state and the downloads dispatched to it"""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.state = "stopped"  # stopped, starting, needs_2fa, ready, failed
+        self.email = None
+        self.exit_code = None
+        self.started_at = None
+        self.last_output_at = None
+        self.stop_requested = False
+        self.active_jobs = 0
+        self.jobs_dispatched = 0
+        self.generation = 0     # bumped on every start; jobs use it to notice restarts
+        self.ready_since = None
+        self.failures = 0
+        self.restart_at = None
+        self.probe_failures = 0
+        self.given_up = False
+        self.log_name = None  # this session's log file, see logfiles
+        self.watch = None     # iomux.Watch of the running process
+        self.start_lock = threading.Lock()
+
+    @property
+    def workdir(self):
+        if self.index == 0:
+            return WRAPPER_DIR
+        return os.path.join(INSTANCES_DIR, str(self.index))
+
+    @property
+    def credentials_slot(self):
+        """Instances with their own saved account use it, the rest share the main one"""
+        return self.index if has_own_credentials(self.index) else 0
+
+    def log(self, line):
+        line = logfiles.redact(line)  # the password is on the command line and may be echoed
+        log(line if self.index == 0 else f"[w{self.index}] {line}")
+        if self.log_name:
+            logfiles.write(self.log_name, line)
+
+    def end_session_log(self, name=None):
+        """Close the session's log file (only if it is still `name`, when given)"""
+        if self.log_name and name in (None, self.log_name):
+            logfiles.close(self.log_name)
+            self.log_name = None
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def ready(self):
+        return self.state == "ready" and self.running()
+
+    def addresses(self):
+        """decrypt/m3u8 addresses from config.yaml, shifted by the instance index"""
+        try:
+            config = downloader_config.load()
+        except Exception:
+            config = {}
+        addresses = {}
+        for key, default in PORT_KEYS.items():
+            host, port = split_address(config.get(key) or default)
+            addresses[key] = f"{host}:{port + self.index}"
+        return addresses
+
+    def command(self, email, password):
+        binary = get_setting("wrapper-binary") or os.path.join(WRAPPER_DIR, "wrapper")
+        cmd = [binary, "-L", f"{email}:{password}"]
+        if self.index:
+            addresses = self.addresses()
+            cmd += [
+                "-D", str(split_address(addresses["decrypt-m3u8-port"])[1]),
+                "-M", str(split_address(addresses["get-m3u8-port"])[1]),
+                "-A", str(ACCOUNT_PORT + self.index),
+            ]
+        return cmd
+
+    def prepare_workdir(self):
+        if os.path.isdir(self.workdir):
+            return
+        if os.path.isdir(WRAPPER_DIR):
+            self.log(f"📁 Copying wrapper into {self.workdir}...")
+            shutil.copytree(WRAPPER_DIR, self.workdir, symlinks=True)
+        else:
+            os.makedirs(self.workdir)
+
+    def start(self, email, password, auto_login=False, supervised=False):
+        """Start the wrapper login process"""
+        with self.start_lock:
+            return self.start_locked(email, password, auto_login, supervised)
+
+    def start_locked(self, email, password, auto_login, supervised):
+        if self.running():
+            if not auto_login:
+                self.log("❌ Wrapper already running")
+            return False
+
+        prefix = "🤖 Auto-login: " if auto_login else ""
+        self.end_session_log()
+        self.log_name = f"wrappers/{self.index}/{time.strftime('%Y%m%d-%H%M%S')}"
+        self.log(f"{prefix}Starting wrapper login for {email}...")
+
+        try:
+            self.prepare_workdir()
+            logfiles.add_secret(password)  # self.log prints it as -L email:***
+            cmd = self.command(email, password)
+            self.log(f"{prefix}Executing: {' '.join(cmd)}")
+            self.log(f"{prefix}Working directory: {self.workdir}")
+            self.process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.PIPE,
+                cwd=self.workdir  # Run from wrapper directory
+            )
+        except Exception as e:
+            self.state = "failed"
+            self.log(f"{prefix}❌ Error starting wrapper: {str(e)}")
+            if auto_login and not supervised:
+                self.log("🗑️ Auto-login failed, deleting saved credentials")
+                delete_credentials(self.credentials_slot)
+            self.end_session_log()
+            return False
+
+        # Not ready until the success message arrives
+        self.state = "starting"
+        self.email = email
+        self.exit_code = None
+        self.stop_requested = False
+        self.generation += 1
+        self.probe_failures = 0
+        self.restart_at = None
+        self.started_at = self.last_output_at = time.time()
+        session = Session(email, password, auto_login, supervised, self.log_name)
+        self.watch = iomux.watch(self.process, lambda line: self.handle_line(session, line),
+                                 lambda exit_code: self.handle_exit(session, exit_code))
+        self.log(f"{prefix}Wrapper process started, waiting for login confirmation...")
+        return True
+
+    def handle_line(self, session, line):
+        """Output of the wrapper process (on the I/O loop): log it and track the login state"""
+        line = line.strip()
+        if not line:
+            return
+        self.last_output_at = time.time()
+        self.log(line)
+
+        # Check for 2FA requirement
+        if "credentialHandler:" in line and "2FA: true" in line:
+            self.state = "needs_2fa"
+            metrics.inc("amdl_2fa_prompts_total", instance=str(self.index))
+            self.log("🔐 2FA Required - Please enter your 2FA code")
+
+        # Check for successful login message
+        if "[.] response type 6" in line:
+            self.state = "ready"
+            self.ready_since = time.time()
+            session.login_successful = True
+            if session.auto_login:
+                self.log("✅ Auto-login successful! Ready for downloads.")
+            else:
+                self.log("✅ Wrapper login successful! Ready for downloads.")
+                # Save credentials on successful manual login
+                if session.email and session.password:
+                    if save_credentials(session.email, session.password, self.credentials_slot):
+                        self.log("💾 Credentials saved for auto-login")
+                    else:
+                        self.log("⚠️ Failed to save credentials")
+
+    def handle_exit(self, session, exit_code):
+        """The wrapper process exited and its output is drained (on the I/O loop)"""
+        self.exit_code = exit_code
+        if self.stop_requested:
+            self.state = "stopped"
+        elif not session.login_successful:
+            # Process ended before successful login
+            self.log(f"❌ Login failed - wrapper process exited with code: {exit_code}")
+            self.state = "failed"
+            # Delete credentials on failed auto-login (a supervised restart may just have crashed)
+            if session.auto_login and not session.supervised:
+                self.log("🗑️ Auto-login failed, deleting saved credentials")
+                delete_credentials(self.credentials_slot)
+        elif exit_code != 0:
+            self.log(f"❌ Wrapper process ended unexpectedly with exit code: {exit_code}")
+            self.state = "failed"
+        else:
+            self.log("Wrapper process ended normally")
+            self.state = "stopped"
+        self.end_session_log(session.log_name)
+
+    def send_2fa(self, code):
+        try:
+            iomux.write(self.watch, f"{code}\n")
+            self.log(f"🔐 Submitted 2FA code: {code}")
+            self.state = "starting"
+            return True, "2FA code submitted"
+        except Exception as e:
+            self.log(f"❌ Error submitting 2FA code: {str(e)}")
+            return False, f"Failed to submit 2FA code: {str(e)}"
+
+    def kill(self):
+        """Terminate a hung wrapper so the supervisor restarts it"""
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def probe(self):
+        """Liveness probe: the decrypt port accepts connections once logged in"""
+        host, port = split_address(self.addresses()["decrypt-m3u8-port"])
+        try:
+            socket.create_connection((host, port), timeout=2).close()
+            return True
+        except OSError:
+            return False
+
+    def health_problem(self, now):
+        """Why a running wrapper looks hung, or None if it looks healthy"""
+        login_timeout = int(get_setting("wrapper-login-timeout"))
+        silence = int(get_setting("wrapper-silence-seconds"))
+        if self.state == "starting" and login_timeout and now - self.started_at > login_timeout:
+            return f"No login confirmation after {login_timeout}s"
+        if self.state != "ready":
+            return None
+        if silence and self.active_jobs and now - self.last_output_at > silence:
+            return f"No output for {silence}s while downloads are running"
+        self.probe_failures = 0 if self.probe() else self.probe_failures + 1
+        if self.probe_failures >= PROBE_FAILURES:
+            return "Decrypt port is not accepting connections"
+        return None
+
+    def check(self, now):
+        """Supervisor pass: restart this instance if it crashed or hung while wanted"""
+        if not wanted or self.given_up:
+            return
+        if self.running():
+            problem = self.health_problem(now)
+            if problem:
+                self.log(f"🩺 {problem}, restarting wrapper")
+                self.kill()
+            elif self.state == "ready" and now - self.ready_since > STABLE_SECONDS:
+                self.failures = 0
+            return
+        if self.restart_at is None and self.generation == 0:
+            self.restart_at = now  # first start, e.g. the engine just came up
+        elif self.restart_at is None:
+            if self.failures >= MAX_FAILURES:
+                self.given_up = True
+                self.log(f"🛑 Wrapper failed {self.failures} times in a row, giving up; log in again to retry")
+                return
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** self.failures)
+            self.failures += 1
+            self.restart_at = now + delay
+            self.log(f"🔁 Wrapper is down, restarting in {delay}s")
+        elif now >= self.restart_at:
+            self.restart_at = None
+            email, password = load_credentials(self.credentials_slot)
+            if not email:
+                self.given_up = True
+                self.log("⚠️ No saved credentials, cannot restart the wrapper")
+                return
+            self.log("🔄 Found saved credentials, attempting auto-login...")
+            self.start(email, password, auto_login=True, supervised=True)
+
+    def stop(self):
+        """Stop the wrapper process; returns True if one was running"""
+        if self.running():
+            self.stop_requested = True
+            self.process.terminate()
+            self.log("Wrapper process terminated by user")
+            self.state = "stopped"
+            return True
+        return False
+
+    def downloader_dir(self, overrides=None):
+        """Directory to run the downloader from so it talks to this instance.
+
+        Extra instances, and any run with config overrides, get a copy of
+        config.yaml with their ports and absolute save folders.
+        """
+        if self.index == 0 and not overrides:
+            return AMD_DIR
+        run_dir = os.path.join(BUILD_DIR, f"wrapper-{self.index}")
+        os.makedirs(run_dir, exist_ok=True)
+        config = dict(downloader_config.load())
+        config.update(self.addresses())
+        config.update(overrides or {})
+        for key, default in FORMAT_FOLDERS.values():
+            config[key] = resolve_folder(config.get(key) or default)
+        CachedYamlFile(os.path.join(run_dir, "config.yaml")).save(config)
+        return run_dir
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "state": self.state if self.running() or self.state == "failed" else "stopped",
+            "email": self.email,
+            "exit_code": self.exit_code,
+            "started_at": self.started_at,
+            "last_output_at": self.last_output_at,
+            "active_jobs": self.active_jobs,
+            "jobs_dispatched": self.jobs_dispatched,
+            "restarts": self.generation - 1 if self.generation else 0,
+            "failures": self.failures,
+            "restart_at": self.restart_at,
+        }
+
+def ensure_pool():
+    """Size the pool from the `wrapper-instances` setting; stopped idle instances are dropped"""
+    size = max(1, int(get_setting("wrapper-instances")))
+    with pool_lock:
+        while len(instances) < size:
+            instances.append(WrapperInstance(len(instances)))
+        while len(instances) > size and not instances[-1].running() and not instances[-1].active_jobs:
+            instances.pop()
+        return list(instances)
+
+def any_running():
+    return any(instance.running() for instance in ensure_pool())
+
+def all_running():
+    return all(instance.running() for instance in ensure_pool())
+
+def any_ready():
+    return any(instance.ready() for instance in ensure_pool())
+
+def needs_2fa():
+    return any(instance.state == "needs_2fa" and instance.running() for instance in ensure_pool())
+
+def keep_running():
+    """Have the supervisor keep every instance logged in from now on"""
+    global wanted
+    wanted = True
+    for instance in ensure_pool():
+        instance.given_up = False
+        instance.failures = 0
+
+def start_all(email, password, auto_login=False):
+    """Log in every stopped instance; returns True if any was started"""
+    keep_running()
+    pool = [instance for instance in ensure_pool() if not instance.running()]
+    if not pool:
+        if not auto_login:
+            log("❌ Wrapper already running")
+        return False
+    if not auto_login:
+        clear_log()  # reset logs only for manual login
+    started = False
+    for instance in pool:
+        if instance.credentials_slot:
+            own_email, own_password = load_credentials(instance.index)
+            started |= instance.start(own_email, own_password, auto_login)
+        else:
+            started |= instance.start(email, password, auto_login)
+    return started
+
+def auto_login_all():
+    """Start stopped instances with their saved credentials"""
+    keep_running()
+    started = False
+    email, password = load_credentials()
+    for instance in ensure_pool():
+        if instance.running():
+            continue
+        if instance.credentials_slot:
+            own_email, own_password = load_credentials(instance.index)
+            instance.log("🔄 Found saved credentials, attempting auto-login...")
+            started |= instance.start(own_email, own_password, auto_login=True)
+        elif email and password:
+            instance.log("🔄 Found saved credentials, attempting auto-login...")
+            started |= instance.start(email, password, auto_login=True)
+    return started
+
+def send_2fa(code):
+    """Write a 2FA code to every instance waiting for one; returns (ok, message)"""
+    waiting = [instance for instance in ensure_pool() if instance.state == "needs_2fa" and instance.running()]
+    if not waiting:
+        waiting = [instance for instance in ensure_pool() if instance.running()][:1]
+    if not waiting:
+        return False, "Wrapper not running"
+    results = [instance.send_2fa(code) for instance in waiting]
+    failed = [result for result in results if not result[0]]
+    return failed[0] if failed else results[0]
+
+def stop_all():
+    """Stop every running instance; returns True if any was running"""
+    global wanted
+    wanted = False
+    return any([instance.stop() for instance in ensure_pool()])
+
+def acquire():
+    """Reserve the least-loaded logged-in instance for a download, or None"""
+    ensure_pool()
+    with pool_lock:
+        ready = [instance for instance in instances if instance.ready()]
+        if not ready:
+            return None
+        instance = min(ready, key=lambda i: (i.active_jobs, i.jobs_dispatched))
+        instance.active_jobs += 1
+        instance.jobs_dispatched += 1
+        return instance
+
+def release(instance):
+    with pool_lock:
+        instance.active_jobs -= 1
+
+def pool_status():
+    return [instance.to_dict() for instance in ensure_pool()]
+
+def start_supervisor():
+    """Engine thread: keep the wrappers logged in, restarting crashed or hung ones.
+
+    Saved credentials make the engine log in on startup instead of waiting for
+    someone to open the page.
+    """
+    global wanted
+    if not get_setting("wrapper-supervisor"):
+        return
+    if any(load_credentials(instance.credentials_slot)[0] for instance in ensure_pool()):
+        wanted = True
+
+    def loop():
+        while True:
+            now = time.time()
+            for instance in ensure_pool():
+                try:
+                    instance.check(now)
+                except Exception as e:
+                    print(f"Error supervising wrapper {instance.index}: {e}")
+            time.sleep(SUPERVISOR_INTERVAL)
+    threading.Thread(target=loop, daemon=True).start()
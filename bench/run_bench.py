@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""Offline benchmark of the web UI control plane.
+
+Runs the app against the stub wrapper and stub downloader in a throwaway
+directory (nothing in the project folder is touched), serves it over HTTP and
+measures:
+
+  wrapper_ingest     wrapper log lines/s through the wrapper log reader thread
+  downloader_ingest  downloader log lines/s through a job's log reader thread
+  job_start          submit -> running latency for single jobs on idle workers
+  throughput         end-to-end jobs/minute for a batch of jobs
+  get_logs           /get_logs latency and payload size with many polling clients
+                     while a job streams output
+  expand             an album link resolved against bench/stub_catalog.py into
+                     per-track jobs: /download latency cold and from the
+                     catalog cache, and tracks/minute across the workers
+  sync               a followed playlist synced when added, after it grew and
+                     when unchanged: sync time and how many tracks each queued
+
+Results are printed (or written with --output) as JSON so runs can be compared.
+
+    python bench/run_bench.py --clients 50 --output bench_output.txt
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PROJECT_DIR)
+
+STUB_WRAPPER = os.path.join(BENCH_DIR, "stub_wrapper.py")
+STUB_DOWNLOADER = os.path.join(BENCH_DIR, "stub_downloader.py")
+sys.path.insert(0, BENCH_DIR)
+
+def stub_output_lines(tracks, redraws):
+    """Lines stub_downloader.py prints for an album"""
+    return 3 + tracks * (redraws + 4)
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": round(pick(0.50), 3),
+        "p95": round(pick(0.95), 3),
+        "p99": round(pick(0.99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Bench:
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.chatter_lines = 0
+        self.chatter_first = self.chatter_last = None
+        self.isolate()
+
+        from app import app, routes
+        from app.server import ThreadingWSGIServer, QuietRequestHandler
+        from wsgiref.simple_server import make_server
+        self.routes = routes
+
+        # Time the stub's chatter as the reader thread hands it to the log
+        append = routes.wrapper_logs.append
+        def counting_append(line):
+            if "decrypt request" in line:
+                now = time.perf_counter()
+                self.chatter_first = self.chatter_first or now
+                self.chatter_last = now
+                self.chatter_lines += 1
+            append(line)
+        self.wrappers.log = counting_append
+
+        routes.ensure_engine()
+        self.server = make_server("127.0.0.1", 0, app, server_class=ThreadingWSGIServer,
+                                  handler_class=QuietRequestHandler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def isolate(self):
+        """Point every runtime file at the scratch directory before the engine starts"""
+        import yaml
+        from app import config_store, credentials, jobs, logfiles, routes, settings, store, wrappers
+        self.wrappers = wrappers
+        port = free_port()
+        save_dir = os.path.join(self.workdir, "downloads")
+
+        config_path = os.path.join(self.workdir, "config.yaml")
+        with open(config_path, "w") as f:
+            yaml.safe_dump({
+                "alac-save-folder": os.path.join(save_dir, "alac"),
+                "atmos-save-folder": os.path.join(save_dir, "atmos"),
+                "aac-save-folder": os.path.join(save_dir, "aac"),
+                "decrypt-m3u8-port": f"127.0.0.1:{port}",
+                "get-m3u8-port": f"127.0.0.1:{free_port()}",
+            }, f)
+        settings_path = os.path.join(self.workdir, "webui.yaml")
+        with open(settings_path, "w") as f:
+            yaml.safe_dump({
+                "download-workers": self.args.workers,
+                "wrapper-binary": STUB_WRAPPER,
+                "library-refresh-seconds": 3600,
+                # Nothing may reach Apple's catalog; expand and sync start their own stub
+                "catalog-url": "http://127.0.0.1:9",
+            }, f)
+
+        config_store.downloader_config.path = config_path
+        settings.settings_file.path = settings_path
+        store.DB_PATH = os.path.join(self.workdir, "webui.db")
+        store.ENGINE_LOCK_PATH = os.path.join(self.workdir, "webui.lock")
+        logfiles.LOG_DIR = os.path.join(self.workdir, "logs")
+        credentials.PROJECT_DIR = self.workdir
+        wrappers.WRAPPER_DIR = os.path.join(self.workdir, "wrapper")
+        wrappers.INSTANCES_DIR = os.path.join(self.workdir, "wrappers")
+        wrappers.BUILD_DIR = os.path.join(self.workdir, "build")
+        wrappers.AMD_DIR = self.workdir
+        os.makedirs(wrappers.WRAPPER_DIR)
+        jobs.ensure_downloader_binary = lambda log=None: STUB_DOWNLOADER
+        routes.install_missing_assets = lambda: None  # no CDN downloads from the bench
+
+    # --- HTTP helpers ---
+
+    def get(self, path, **params):
+        url = self.base_url + path + ("?" + urllib.parse.urlencode(params) if params else "")
+        started = time.perf_counter()
+        with urllib.request.urlopen(url) as response:
+            body = response.read()
+        return json.loads(body), len(body), time.perf_counter() - started
+
+    def post(self, path, **form):
+        data = urllib.parse.urlencode(form).encode()
+        with urllib.request.urlopen(self.base_url + path, data=data) as response:
+            return json.loads(response.read())
+
+    def submit(self, index):
+        return self.post("/download", link=f"https://music.apple.com/us/album/bench/{index}",
+                         format="STANDARD", special_audio="false", force="true", expand="false")["job_id"]
+
+    def job(self, job_id):
+        return self.get(f"/jobs/{job_id}", since=2 ** 62)[0]["job"]  # no log lines
+
+    def wait_for_jobs(self, job_ids, timeout=600):
+        deadline = time.time() + timeout
+        pending = set(job_ids)
+        while pending and time.time() < deadline:
+            for job_id in list(pending):
+                job = self.job(job_id)
+                if job["status"] in ("completed", "failed"):
+                    pending.discard(job_id)
+            time.sleep(0.05)
+        if pending:
+            raise RuntimeError(f"jobs did not finish: {sorted(pending)}")
+        return [self.job(job_id) for job_id in job_ids]
+
+    def set_stub(self, tracks, redraws, rate=0):
+        os.environ["STUB_DL_TRACKS"] = str(tracks)
+        os.environ["STUB_DL_REDRAWS"] = str(redraws)
+        os.environ["STUB_DL_RATE"] = str(rate)
+
+    # --- Scenarios ---
+
+    def wrapper_ingest(self):
+        os.environ["STUB_WRAPPER_CHATTER"] = str(self.args.wrapper_lines)
+        os.environ["STUB_WRAPPER_LOGIN_DELAY"] = "0"
+        started = time.perf_counter()
+        self.post("/login_wrapper", email="bench@example.com", password="bench")
+        while not self.get("/get_logs", since=0)[0]["wrapper_running"]:
+            time.sleep(0.01)
+        login_seconds = time.perf_counter() - started
+
+        deadline = time.time() + 120
+        while self.chatter_lines < self.args.wrapper_lines and time.time() < deadline:
+            time.sleep(0.01)
+        elapsed = (self.chatter_last - self.chatter_first) if self.chatter_lines > 1 else 0
+        return {
+            "login_seconds": round(login_seconds, 3),
+            "lines": self.chatter_lines,
+            "seconds": round(elapsed, 3),
+            "lines_per_second": round(self.chatter_lines / elapsed, 1) if elapsed else None,
+        }
+
+    def downloader_ingest(self):
+        tracks, redraws = self.args.ingest_tracks, 50
+        self.set_stub(tracks, redraws)
+        job = self.wait_for_jobs([self.submit("ingest")])[0]
+        lines = stub_output_lines(tracks, redraws)
+        elapsed = job["finished_at"] - job["started_at"]
+        return {
+            "lines": lines,
+            "seconds": round(elapsed, 3),
+            "lines_per_second": round(lines / elapsed, 1),
+            "status": job["status"],
+        }
+
+    def job_start(self):
+        self.set_stub(1, 1)
+        submit_ms, start_ms = [], []
+        for i in range(self.args.start_samples):
+            started = time.perf_counter()
+            job_id = self.submit(f"start-{i}")
+            submit_ms.append((time.perf_counter() - started) * 1000)
+            job = self.wait_for_jobs([job_id])[0]
+            start_ms.append((job["started_at"] - job["created_at"]) * 1000)
+        return {"submit_ms": percentiles(submit_ms), "queued_to_running_ms": percentiles(start_ms)}
+
+    def throughput(self):
+        self.set_stub(10, 20)
+        started = time.perf_counter()
+        job_ids = [self.submit(f"batch-{i}") for i in range(self.args.jobs)]
+        finished = self.wait_for_jobs(job_ids)
+        elapsed = time.perf_counter() - started
+        return {
+            "jobs": len(job_ids),
+            "workers": self.args.workers,
+            "seconds": round(elapsed, 3),
+            "jobs_per_minute": round(len(job_ids) / elapsed * 60, 1),
+            "failed": sum(1 for job in finished if job["status"] != "completed"),
+        }
+
+    def get_logs(self):
+        # A job streaming at a steady rate keeps every poll returning new lines
+        rate = self.args.stream_rate
+        self.set_stub(10000, 50, rate)
+        job_id = self.submit("stream")
+        full_payload = self.get("/get_logs")[1]
+
+        latencies, payloads, errors = [], [], []
+        lock = threading.Lock()
+        stop_at = time.time() + self.args.duration
+
+        def client():
+            cursor = self.get("/get_logs")[0]["cursor"]
+            while time.time() < stop_at:
+                try:
+                    data, size, seconds = self.get("/get_logs", since=cursor)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                cursor = data["cursor"]
+                with lock:
+                    latencies.append(seconds * 1000)
+                    payloads.append(size)
+                time.sleep(self.args.poll_interval)
+
+        threads = [threading.Thread(target=client) for _ in range(self.args.clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        self.routes.jobs.get_job(job_id).process.terminate()
+
+        return {
+            "clients": self.args.clients,
+            "stream_lines_per_second": rate,
+            "requests": len(latencies),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "errors": len(errors),
+            "latency_ms": percentiles(latencies),
+            "payload_bytes": percentiles(payloads),
+            "full_payload_bytes": full_payload,
+        }
+
+    def expand(self):
+        import stub_catalog
+        from app import settings
+        os.environ["STUB_CATALOG_TRACKS"] = str(self.args.album_tracks)
+        catalog = stub_catalog.serve()
+        settings.save_settings({"catalog-url": f"http://127.0.0.1:{catalog.server_port}"})
+        self.set_stub(1, 20)
+        link = "https://music.apple.com/us/album/bench-album/1000"
+
+        def submit():
+            started = time.perf_counter()
+            response = self.post("/download", link=link, format="STANDARD", special_audio="false", force="true")
+            return response, (time.perf_counter() - started) * 1000
+
+        try:
+            started = time.perf_counter()
+            cold, cold_ms = submit()
+            finished = self.wait_for_jobs(cold["job_ids"])
+            elapsed = time.perf_counter() - started
+            lookups = stub_catalog.requests_served
+            cached, cached_ms = submit()
+            self.wait_for_jobs(cached["job_ids"])
+        finally:
+            catalog.shutdown()
+        return {
+            "tracks": len(cold["job_ids"]),
+            "workers": self.args.workers,
+            "cold_submit_ms": round(cold_ms, 1),
+            "cached_submit_ms": round(cached_ms, 1),
+            "catalog_requests": lookups,
+            "catalog_requests_when_cached": stub_catalog.requests_served - lookups,
+            "seconds": round(elapsed, 3),
+            "tracks_per_minute": round(len(finished) / elapsed * 60, 1),
+            "failed": sum(1 for job in finished if job["status"] != "completed"),
+        }
+
+    def wait_for_sync(self, subscription_id, after, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for subscription in self.get("/subscriptions/list")[0]["subscriptions"]:
+                if subscription["id"] == subscription_id and (subscription["last_sync_at"] or 0) > after:
+                    return subscription
+            time.sleep(0.05)
+        raise RuntimeError(f"subscription #{subscription_id} did not sync")
+
+    def sync(self):
+        import stub_catalog
+        from app import settings
+        os.environ["STUB_CATALOG_TRACKS"] = str(self.args.album_tracks)
+        catalog = stub_catalog.serve()
+        settings.save_settings({"catalog-url": f"http://127.0.0.1:{catalog.server_port}"})
+        self.set_stub(1, 20)
+        link = "https://music.apple.com/us/playlist/bench-playlist/pl.2000"
+
+        def run_sync(subscription_id, started):
+            subscription = self.wait_for_sync(subscription_id, started)
+            jobs = self.get("/jobs", collection=link)[0]["jobs"]
+            self.wait_for_jobs([job["id"] for job in jobs])
+            return subscription
+
+        try:
+            started = time.time()
+            subscription_id = self.post("/subscriptions", link=link, format="STANDARD", special_audio="false",
+                                        priority="normal")["subscription_id"]
+            first = run_sync(subscription_id, started)
+            os.environ["STUB_CATALOG_TRACKS"] = str(self.args.album_tracks + self.args.sync_growth)
+            started = time.time()
+            self.post(f"/subscriptions/{subscription_id}/sync")
+            grown = run_sync(subscription_id, started)
+            started = time.time()
+            self.post(f"/subscriptions/{subscription_id}/sync")
+            unchanged = run_sync(subscription_id, started)
+        finally:
+            catalog.shutdown()
+        return {
+            "tracks": first["tracks_total"],
+            "first_sync": {"queued": first["tracks_queued"], "seconds": first["last_sync_seconds"]},
+            "after_growth": {"queued": grown["tracks_queued"], "seconds": grown["last_sync_seconds"]},
+            "unchanged": {"queued": unchanged["tracks_queued"], "seconds": unchanged["last_sync_seconds"]},
+            "jobs": len(self.get("/jobs", collection=link)[0]["jobs"]),
+        }
+
+    def run(self, scenarios):
+        results = {}
+        # Every other scenario needs a logged-in wrapper
+        for name in ["wrapper_ingest"] + [s for s in scenarios if s != "wrapper_ingest"]:
+            print(f"… {name}", file=sys.stderr)
+            results[name] = getattr(self, name)()
+        self.wrappers.stop_all()
+        self.server.shutdown()
+        return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+SCENARIOS = ["wrapper_ingest", "downloader_ingest", "job_start", "throughput", "get_logs", "expand", "sync"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="run only this scenario (repeatable); default all")
+    parser.add_argument("--workers", type=int, default=2, help="download-workers setting")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent /get_logs clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of /get_logs load")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds between a client's polls")
+    parser.add_argument("--stream-rate", type=int, default=500, help="downloader lines/s during /get_logs load")
+    parser.add_argument("--jobs", type=int, default=20, help="jobs in the throughput batch")
+    parser.add_argument("--start-samples", type=int, default=10, help="jobs timed for start latency")
+    parser.add_argument("--ingest-tracks", type=int, default=200, help="album size for downloader ingestion")
+    parser.add_argument("--wrapper-lines", type=int, default=20000, help="wrapper lines for wrapper ingestion")
+    parser.add_argument("--album-tracks", type=int, default=250, help="album/playlist size for expand and sync")
+    parser.add_argument("--sync-growth", type=int, default=10, help="tracks added to the playlist between syncs")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    parser.add_argument("--verbose", action="store_true", help="show the app's debug output on stderr")
+    args = parser.parse_args()
+
+    # The app prints every log line; keep stdout for the report
+    report_stream = sys.stdout
+    sys.stdout = sys.stderr if args.verbose else open(os.devnull, "w")
+    workdir = tempfile.mkdtemp(prefix="amdl-bench-")
+    try:
+        bench = Bench(args, workdir)
+        results = bench.run(args.scenario or SCENARIOS)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        sys.stdout = report_stream
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "keep")},
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
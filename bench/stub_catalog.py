@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Stand-in for the Apple Music catalog API and web player, for testing album/playlist expansion and subscriptions.
+
+Serves what app/catalog.py reads: a web player page whose script carries the
+bearer token, and /v1/catalog/<storefront>/(albums|playlists)/<id>?include=tracks
+with the track list paged like the real API (the first page inline, the rest
+through "next" links), plus /v1/catalog/<storefront>/artists/<id>?include=albums.
+Settings are read on every request, so raising STUB_CATALOG_TRACKS between
+syncs makes playlists grow. Requests without the token get 401. IDs starting
+with 0 do not exist (404). /stats reports how many API requests were
+served, for checking the web UI's cache.
+
+Set `catalog-url` in webui.yaml to http://127.0.0.1:<port> to use it.
+
+    python bench/stub_catalog.py --port 8020
+
+Environment:
+  STUB_CATALOG_TRACKS=n     tracks per album/playlist (default 12)
+  STUB_CATALOG_PAGE=n       tracks per page (default 100)
+  STUB_CATALOG_ALBUMS=n     albums per artist (default 3)
+  STUB_CATALOG_LATENCY=s    seconds to wait before each API response (default 0.05)
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN = "eyJhbGciOiJFUzI1NiJ9.stub-catalog-token"
+COLLECTION_RE = re.compile(r"^/v1/catalog/(\w{2})/(albums|playlists|artists)/([\w.-]+)(/tracks)?$")
+
+requests_served = 0
+counter_lock = threading.Lock()
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def track(kind, collection_id, number):
+    return {
+        "id": f"{zlib.crc32(f'{kind}/{collection_id}'.encode()) % 10 ** 8}{number:04d}",
+        "type": "songs",
+        "attributes": {"name": f"Stub Song {number}", "trackNumber": number, "discNumber": 1,
+                       "albumName": "Stub Album", "artistName": "Stub Artist"},
+    }
+
+def track_page(storefront, kind, collection_id, offset):
+    total = env_int("STUB_CATALOG_TRACKS", 12)
+    size = env_int("STUB_CATALOG_PAGE", 100)
+    page = {"data": [track(kind, collection_id, n) for n in range(offset + 1, min(offset + size, total) + 1)]}
+    if offset + size < total:
+        page["next"] = f"/v1/catalog/{storefront}/{kind}/{collection_id}/tracks?offset={offset + size}"
+    return page
+
+def artist_albums(storefront, artist_id):
+    return {"data": [{
+        "id": f"{artist_id}{number:02d}",
+        "type": "albums",
+        "href": f"/v1/catalog/{storefront}/albums/{artist_id}{number:02d}",
+    } for number in range(1, env_int("STUB_CATALOG_ALBUMS", 3) + 1)]}
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type="application/json"):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        global requests_served
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/":
+            return self.send(200, '<script type="module" src="/assets/index-stub.js"></script>', "text/html")
+        if url.path == "/assets/index-stub.js":
+            return self.send(200, f'const config = {{token: "{TOKEN}"}};', "application/javascript")
+        if url.path == "/stats":
+            return self.send(200, {"requests": requests_served})
+        match = COLLECTION_RE.match(url.path)
+        if not match:
+            return self.send(404, {"errors": [{"status": "404"}]})
+        with counter_lock:
+            requests_served += 1
+        time.sleep(float(os.environ.get("STUB_CATALOG_LATENCY", "0.05")))
+        if self.headers.get("Authorization") != f"Bearer {TOKEN}":
+            return self.send(401, {"errors": [{"status": "401"}]})
+        storefront, kind, collection_id, tracks_only = match.groups()
+        if collection_id.startswith("0"):
+            return self.send(404, {"errors": [{"status": "404"}]})
+        if kind == "artists":
+            return self.send(200, {"data": [{
+                "id": collection_id,
+                "type": kind,
+                "attributes": {"name": f"Stub Artist {collection_id}"},
+                "relationships": {"albums": artist_albums(storefront, collection_id)},
+            }]})
+        offset = int(urllib.parse.parse_qs(url.query).get("offset", ["0"])[0])
+        if tracks_only:
+            return self.send(200, track_page(storefront, kind, collection_id, offset))
+        return self.send(200, {"data": [{
+            "id": collection_id,
+            "type": kind,
+            "attributes": {"name": f"Stub {kind[:-1].title()} {collection_id}"},
+            "relationships": {"tracks": track_page(storefront, kind, collection_id, 0)},
+        }]})
+
+def serve(port=0):
+    """Start the stand-in on a background thread; returns the server (server_port is the port)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8020)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"[+] stub catalog on http://127.0.0.1:{server.server_port}", flush=True)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Stand-in for the apple-music-downloader binary.
+
+Invoked like the real one (`[--atmos|--aac] <link>`). Prints apple-music-downloader
+style output for a fake album: track headers, download progress-bar redraws with
+byte counts and rates, decrypt/tag steps and a completion summary. Writes no files.
+
+Environment:
+  STUB_DL_TRACKS=n          tracks in the album (default 10)
+  STUB_DL_REDRAWS=n         progress-bar redraws per track (default 20)
+  STUB_DL_RATE=n            output lines per second, 0 for as fast as possible (default 0)
+  STUB_DL_TRACK_BYTES=n     bytes per track (default 30000000)
+  STUB_DL_EXIT=code         exit code (default 0)
+"""
+import os
+import sys
+import time
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def main():
+    link = sys.argv[-1] if len(sys.argv) > 1 else "https://music.apple.com/us/album/stub/1"
+    tracks = env_int("STUB_DL_TRACKS", 10)
+    redraws = env_int("STUB_DL_REDRAWS", 20)
+    rate = float(os.environ.get("STUB_DL_RATE", "0"))
+    track_bytes = env_int("STUB_DL_TRACK_BYTES", 30000000)
+    interval = 1 / rate if rate > 0 else 0
+    next_line = time.time()
+
+    def emit(line):
+        nonlocal next_line
+        sys.stdout.write(line + "\n")
+        if interval:  # paced output is flushed line by line, like a live process
+            sys.stdout.flush()
+            next_line += interval
+            delay = next_line - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    emit(f"Fetching album metadata for {link}")
+    emit("Album: Stub Album - Stub Artist")
+    for track in range(1, tracks + 1):
+        emit(f"Track {track} of {tracks}: Stub Song {track}")
+        for step in range(1, redraws + 1):
+            done = track_bytes * step // redraws
+            emit(f"Downloading... {done / 1e6:.2f} MB / {track_bytes / 1e6:.2f} MB "
+                 f"{100 * step // redraws}% 12.50 MB/s")
+        emit("Decrypting...")
+        emit(f"Decrypted {track:02d}. Stub Song {track}.m4a")
+        emit("Writing tags...")
+    emit(f"Completed: {tracks}/{tracks}  Warnings: 0  Errors: 0")
+    sys.stdout.flush()
+    sys.exit(env_int("STUB_DL_EXIT", 0))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Stand-in for the wrapper binary, for running the web UI without an Apple account.
+
+Accepts the wrapper's -L/-D/-M/-A flags, prints a plausible login sequence
+ending in "[.] response type 6", then listens on the decrypt port (so the
+supervisor's liveness probe passes) until terminated.
+
+Set `wrapper-binary` in webui.yaml to this file's path to use it.
+
+Environment:
+  STUB_WRAPPER_2FA=1          ask for a 2FA code on stdin before logging in
+  STUB_WRAPPER_LOGIN_DELAY=s  seconds to wait before the login succeeds (default 0.5)
+  STUB_WRAPPER_EXIT_AFTER=s   exit with code 1 after this many seconds (crash testing)
+  STUB_WRAPPER_HANG_AFTER=s   stop listening and go silent after this many seconds (hang testing)
+  STUB_WRAPPER_CHATTER=n      print n decrypt-style lines right after logging in (log ingestion)
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-L", dest="login", required=True)
+    parser.add_argument("-D", dest="decrypt_port", type=int, default=10020)
+    parser.add_argument("-M", dest="m3u8_port", type=int, default=20020)
+    parser.add_argument("-A", dest="account_port", type=int, default=30020)
+    args = parser.parse_args()
+
+    email = args.login.split(":", 1)[0]
+    print(f"[+] starting stub wrapper for {email}", flush=True)
+    print(f"[+] decrypt port {args.decrypt_port}, m3u8 port {args.m3u8_port}, account port {args.account_port}", flush=True)
+
+    if os.environ.get("STUB_WRAPPER_2FA") == "1":
+        print("[.] credentialHandler: 2FA: true", flush=True)
+        code = sys.stdin.readline().strip()
+        print(f"[.] received 2FA code ({len(code)} digits)", flush=True)
+
+    time.sleep(float(os.environ.get("STUB_WRAPPER_LOGIN_DELAY", "0.5")))
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", args.decrypt_port))
+    listener.listen(64)
+    listener.settimeout(0.2)
+    print("[.] response type 6", flush=True)
+    for i in range(int(os.environ.get("STUB_WRAPPER_CHATTER", "0"))):
+        sys.stdout.write(f"[.] decrypt request {i}: adamId 1{i:09d} key uri skd://itunes.apple.com/P000000000/s1/e1\n")
+    sys.stdout.flush()
+
+    exit_after = os.environ.get("STUB_WRAPPER_EXIT_AFTER")
+    hang_after = os.environ.get("STUB_WRAPPER_HANG_AFTER")
+    started = time.time()
+    while True:
+        try:
+            listener.accept()[0].close()
+        except socket.timeout:
+            pass
+        elapsed = time.time() - started
+        if exit_after and elapsed >= float(exit_after):
+            print("[!] stub wrapper exiting", flush=True)
+            sys.exit(1)
+        if hang_after and elapsed >= float(hang_after):
+            listener.close()
+            while True:
+                time.sleep(60)
+
+if __name__ == "__main__":
+    main()
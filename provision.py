@@ -0,0 +1,457 @@
+"""First-time setup: system packages, Bento4, the wrapper, the downloader and the web UI's assets.
+
+Everything is fetched into an artifact cache (`artifacts/`, or $AMDL_ARTIFACT_CACHE)
+in parallel, verified against pinned SHA-256 hashes (commit hash for the
+downloader repo) and installed from there. Interrupted downloads resume where
+they stopped. Copy a filled cache to another machine to provision it offline:
+
+    python3 provision.py --fetch-only            # fill the cache, install nothing
+    sudo python3 provision.py --cache /media/artifacts --offline
+    python3 provision.py --assets-only           # just the web UI's scripts/styles, no root
+    python3 provision.py --update-lock           # record pins in setup.lock.json, then commit it
+
+Pins are read from setup.lock.json (committed with the project). An artifact
+whose pin there is still empty is refused, unless --allow-unpinned (or
+AMDL_ALLOW_UNPINNED=1) is given: it is then pinned on its first download, with
+a warning, and recorded in pins.json in the cache, so every later install from
+that cache is checked against the same bytes. --update-lock implies it.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent
+BENTO4_DIR = PROJECT_DIR / "bento4"
+WRAPPER_DIR = PROJECT_DIR / "wrapper"
+AMD_DIR = PROJECT_DIR / "apple-music-downloader"
+DEFAULT_CACHE_DIR = PROJECT_DIR / "artifacts"
+LOCK_PATH = PROJECT_DIR / "setup.lock.json"
+VENDOR_DIR = PROJECT_DIR / "app" / "static" / "vendor"
+LINK_DIR = Path("/usr/local/bin")
+
+PACKAGES = ["git", "ffmpeg", "gpac", "golang-go", "wget", "python3-flask", "python3-yaml"]
+
+# name -> (url, file name in the cache, install directory)
+ARCHIVES = {
+    "bento4": ("https://www.bok.net/Bento4/binaries/Bento4-SDK-1-6-0-641.x86_64-unknown-linux.zip",
+               "Bento4-SDK-1-6-0-641.x86_64-unknown-linux.zip", BENTO4_DIR),
+    "wrapper": ("https://github.com/zhaarey/wrapper/releases/download/linux.V2/wrapper.x86_64.tar.gz",
+                "wrapper.x86_64.tar.gz", WRAPPER_DIR),
+}
+# name -> (url, file name in the cache and in app/static/vendor/); the pages
+# load these from the CDN until they are installed
+ASSETS = {
+    "axios": ("https://cdn.jsdelivr.net/npm/axios@1.7.7/dist/axios.min.js", "axios.min.js"),
+    "bootstrap": ("https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css", "bootstrap.min.css"),
+}
+DOWNLOADER_REPO = "https://github.com/zhaarey/apple-music-downloader"
+DOWNLOADER_BUNDLE = "apple-music-downloader.bundle"
+
+CHUNK_SIZE = 1024 * 1024
+FETCH_ATTEMPTS = 4
+RETRY_DELAY = 2  # seconds, doubled per attempt
+
+print_lock = threading.Lock()
+pins_lock = threading.Lock()
+
+class SetupError(Exception):
+    pass
+
+def log(name, message):
+    with print_lock:
+        print(f"[{name}] {message}", flush=True)
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class Provisioner:
+    def __init__(self, cache_dir, offline=False, allow_unpinned=False):
+        self.cache_dir = Path(cache_dir)
+        self.offline = offline
+        self.allow_unpinned = allow_unpinned
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.pins_path = self.cache_dir / "pins.json"
+        self.pins = {}
+        self.locked = {}  # name -> {key: value} of the pins in setup.lock.json
+        for path in (self.pins_path, LOCK_PATH):  # the project lock file wins
+            if path.exists():
+                with open(path) as f:
+                    for name, entry in json.load(f).items():
+                        # Empty values in the lock file are pins still to be recorded
+                        entry = {key: value for key, value in entry.items() if value}
+                        self.pins.setdefault(name, {}).update(entry)
+                        if path == LOCK_PATH:
+                            self.locked[name] = entry
+        if allow_unpinned:
+            print("⚠️ --allow-unpinned: artifacts without a pin in setup.lock.json are trusted on first download")
+
+    def require_pin(self, name, key):
+        """Refuse an artifact that setup.lock.json has no pin for, unless unpinned ones are allowed"""
+        if not self.allow_unpinned and not self.locked.get(name, {}).get(key):
+            raise SetupError(f"no {key} pinned for {name} in setup.lock.json; refusing to trust an unverified "
+                             "download. Record the pins with --update-lock, or pass --allow-unpinned")
+
+    def pin(self, name, key, value):
+        """The pinned value for an artifact, recording value if there is none yet"""
+        with pins_lock:
+            entry = self.pins.setdefault(name, {})
+            if entry.get(key):
+                return entry[key]
+            entry[key] = value
+            tmp_path = self.pins_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.pins, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.pins_path)
+        log(name, f"⚠️ No {key} for {name} in setup.lock.json, trusting this first download: {value}")
+        return value
+
+    def write_lock(self):
+        """Record the pins of every artifact in setup.lock.json (after fetch_all)"""
+        keys = dict({name: "sha256" for name in list(ARCHIVES) + list(ASSETS)}, **{"apple-music-downloader": "commit"})
+        lock = {name: {key: self.pins.get(name, {}).get(key)} for name, key in keys.items()}
+        tmp_path = LOCK_PATH.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(lock, f, indent=2, sort_keys=True)
+            f.write("\n")
+        os.replace(tmp_path, LOCK_PATH)
+        print(f"📌 Wrote {LOCK_PATH.name}, commit it so every install checks these pins")
+
+    # --- Archives ---
+
+    def download(self, name, url, part_path):
+        """Fetch url into part_path, continuing from whatever is already there"""
+        for attempt in range(1, FETCH_ATTEMPTS + 1):
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=60) as response:
+                    if offset and response.status != 206:
+                        offset = 0  # no range support, start over
+                    if offset:
+                        log(name, f"⏯️ Resuming at {offset / 1e6:.1f} MB")
+                    with open(part_path, "ab" if offset else "wb") as f:
+                        shutil.copyfileobj(response, f, CHUNK_SIZE)
+                return
+            except urllib.error.HTTPError as e:
+                if e.code == 416 and offset:
+                    return  # the partial file is already complete
+                error = e
+            except (OSError, urllib.error.URLError) as e:
+                error = e
+            if attempt < FETCH_ATTEMPTS:
+                delay = RETRY_DELAY * 2 ** (attempt - 1)
+                log(name, f"⚠️ Download interrupted ({error}), retrying in {delay}s")
+                time.sleep(delay)
+        raise SetupError(f"download of {url} failed: {error}")
+
+    def fetch_archive(self, name):
+        """Verified path of an archive in the cache, downloading it if needed"""
+        url, filename, _ = ARCHIVES[name]
+        return self.fetch_file(name, url, filename)
+
+    def fetch_file(self, name, url, filename):
+        self.require_pin(name, "sha256")
+        path = self.cache_dir / filename
+        if path.exists():
+            digest = sha256_of(path)
+            if digest == self.pin(name, "sha256", digest):
+                log(name, "✅ Using cached archive")
+                return path
+            log(name, "⚠️ Cached archive does not match its pinned hash, fetching again")
+            path.unlink()
+        if self.offline:
+            raise SetupError(f"{filename} is not in the artifact cache {self.cache_dir}")
+
+        part_path = self.cache_dir / (filename + ".part")
+        log(name, f"⬇️ Downloading {url}")
+        self.download(name, url, part_path)
+        digest = sha256_of(part_path)
+        expected = self.pin(name, "sha256", digest)
+        if digest != expected:
+            part_path.unlink()
+            raise SetupError(f"{filename} has SHA-256 {digest}, expected {expected}")
+        os.replace(part_path, path)
+        log(name, "✅ Downloaded and verified")
+        return path
+
+    def install_archive(self, name):
+        _, _, dest = ARCHIVES[name]
+        if dest.exists():
+            log(name, f"ℹ️ {dest.name} already exists, skipping")
+            return
+        path = self.fetch_archive(name)
+        # Extract beside the destination and rename, so an interrupted run leaves nothing half-done
+        staging = Path(tempfile.mkdtemp(dir=PROJECT_DIR, prefix=f".{dest.name}-"))
+        try:
+            if path.suffix == ".zip":
+                with zipfile.ZipFile(path) as archive:
+                    archive.extractall(staging)
+            else:
+                with tarfile.open(path, "r:gz") as archive:
+                    archive.extractall(staging)
+            staging.chmod(0o755)  # mkdtemp creates it owner-only
+            os.replace(staging, dest)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        log(name, f"✅ Installed into {dest.name}/")
+
+    # --- Web UI assets ---
+
+    def install_asset(self, name):
+        _, filename = ASSETS[name]
+        dest = VENDOR_DIR / filename
+        path = self.fetch_asset(name)
+        if dest.exists() and sha256_of(dest) == sha256_of(path):
+            log(name, f"ℹ️ {filename} already installed, skipping")
+            return
+        VENDOR_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = dest.with_suffix(dest.suffix + ".tmp")
+        shutil.copyfile(path, tmp_path)
+        tmp_path.chmod(0o644)
+        os.replace(tmp_path, dest)
+        log(name, f"✅ Installed into app/static/vendor/{filename}")
+
+    def fetch_asset(self, name):
+        url, filename = ASSETS[name]
+        return self.fetch_file(name, url, filename)
+
+    def install_assets(self):
+        return self.run([(name, lambda name=name: self.install_asset(name)) for name in ASSETS])
+
+    # --- Downloader repository ---
+
+    def fetch_downloader(self):
+        """Verified git bundle of the downloader at its pinned commit"""
+        name = "apple-music-downloader"
+        self.require_pin(name, "commit")
+        bundle = self.cache_dir / DOWNLOADER_BUNDLE
+        if bundle.exists():
+            commit = bundle_head(bundle)
+            if commit and commit == self.pin(name, "commit", commit):
+                log(name, "✅ Using cached repository bundle")
+                return bundle, commit
+            log(name, "⚠️ Cached bundle is not at the pinned commit, fetching again")
+            bundle.unlink()
+        if self.offline:
+            raise SetupError(f"{DOWNLOADER_BUNDLE} is not in the artifact cache {self.cache_dir}")
+
+        log(name, f"⬇️ Cloning {DOWNLOADER_REPO}")
+        with tempfile.TemporaryDirectory(dir=self.cache_dir) as scratch:
+            clone = os.path.join(scratch, "repo")
+            git("clone", "--quiet", DOWNLOADER_REPO, clone)
+            pinned = self.pins.get(name, {}).get("commit")
+            if pinned:
+                git("checkout", "--quiet", "--detach", pinned, cwd=clone)
+            commit = self.pin(name, "commit", git("rev-parse", "HEAD", cwd=clone))
+            part_path = self.cache_dir / (DOWNLOADER_BUNDLE + ".part")
+            git("bundle", "create", "--quiet", str(part_path), "HEAD", "--all", cwd=clone)
+        os.replace(part_path, bundle)
+        log(name, f"✅ Cloned and bundled at {commit[:12]}")
+        return bundle, commit
+
+    def install_downloader(self):
+        name = "apple-music-downloader"
+        if AMD_DIR.exists():
+            log(name, "ℹ️ Apple Music Downloader already exists, skipping clone")
+            return
+        bundle, commit = self.fetch_downloader()
+        staging = Path(tempfile.mkdtemp(dir=PROJECT_DIR, prefix=".apple-music-downloader-"))
+        try:
+            git("clone", "--quiet", str(bundle), str(staging / "repo"))
+            repo = staging / "repo"
+            if git("rev-parse", "HEAD", cwd=repo) != commit:
+                raise SetupError(f"cloned downloader is not at the pinned commit {commit}")
+            git("remote", "set-url", "origin", DOWNLOADER_REPO, cwd=repo)  # so `git pull` still works
+            os.replace(repo, AMD_DIR)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        log(name, f"✅ Installed at {commit[:12]}")
+
+    # --- System packages ---
+
+    def install_packages(self):
+        name = "packages"
+        missing = [package for package in PACKAGES if not package_installed(package)]
+        if not missing:
+            log(name, "✅ Already installed")
+            return
+        # Pre-downloaded .deb files in <cache>/debs install without a network
+        debs = sorted(str(path) for path in (self.cache_dir / "debs").glob("*.deb"))
+        if debs:
+            log(name, f"📦 Installing {', '.join(missing)} from {len(debs)} cached .deb files")
+            subprocess.run(["apt-get", "install", "-y"] + debs, check=True)
+        elif self.offline:
+            raise SetupError(f"missing packages {', '.join(missing)} and no .deb files in {self.cache_dir / 'debs'}")
+        else:
+            log(name, f"📦 Installing {', '.join(missing)}")
+            subprocess.run(["apt-get", "install", "-y"] + missing, check=True)
+        log(name, "✅ Packages installed successfully!")
+
+    # --- Entry points ---
+
+    def run(self, tasks, after=None):
+        """Run tasks concurrently; returns True if all of them succeeded.
+
+        after maps a task's label to the label of a task it has to wait for.
+        """
+        ok = True
+        after = after or {}
+        started = {}
+
+        def wait_then(label, task):
+            dependency = after.get(label)
+            if dependency:
+                try:
+                    started[dependency].result()
+                except Exception:
+                    raise SetupError(f"skipped, {dependency} failed")
+            return task()
+
+        with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+            for label, task in tasks:  # in order, so a dependency is submitted first
+                started[label] = pool.submit(wait_then, label, task)
+            futures = {future: label for label, future in started.items()}
+            for future, label in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    log(label, f"❌ {e}")
+                    ok = False
+        return ok
+
+    def fetch_all(self):
+        tasks = [(name, lambda name=name: self.fetch_archive(name)) for name in ARCHIVES]
+        tasks += [(name, lambda name=name: self.fetch_asset(name)) for name in ASSETS]
+        tasks.append(("apple-music-downloader", self.fetch_downloader))
+        return self.run(tasks)
+
+    def install_all(self):
+        tasks = [("packages", self.install_packages)]
+        tasks += [(name, lambda name=name: self.install_archive(name)) for name in ARCHIVES]
+        tasks += [(name, lambda name=name: self.install_asset(name)) for name in ASSETS]
+        tasks.append(("apple-music-downloader", self.install_downloader))
+        # The downloader is cloned with git, which is one of the packages
+        if not self.run(tasks, after={"apple-music-downloader": "packages"}):
+            return False
+        link_bento4_tools()
+        return True
+
+def git(*args, cwd=None):
+    if not shutil.which("git"):
+        raise SetupError("git is not installed")
+    result = subprocess.run(["git", "-c", "advice.detachedHead=false"] + list(args),
+                            cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SetupError(f"git {args[0]} failed: {result.stderr.strip()}")
+    return result.stdout.strip()
+
+def bundle_head(bundle):
+    """Commit a bundle's HEAD points at, or None if the bundle is unreadable"""
+    try:
+        heads = git("bundle", "list-heads", str(bundle))
+    except (SetupError, OSError):
+        return None
+    for line in heads.splitlines():
+        commit, _, ref = line.partition(" ")
+        if ref == "HEAD":
+            return commit
+    return None
+
+def package_installed(package):
+    result = subprocess.run(["dpkg-query", "-W", "-f=${Status}", package],
+                            capture_output=True, text=True)
+    return result.returncode == 0 and "install ok installed" in result.stdout
+
+def link_bento4_tools():
+    """Make the Bento4 tools executable and link them into /usr/local/bin"""
+    bin_candidates = list(BENTO4_DIR.glob("Bento4*"))
+    if not bin_candidates:
+        print("⚠️ Could not find Bento4 extracted folder")
+        return
+    bin_dir = bin_candidates[0] / "bin"
+    os.environ["PATH"] = f"{bin_dir}:{os.environ['PATH']}"
+    created = 0
+    for exe_file in bin_dir.glob("*"):
+        if not exe_file.is_file():
+            continue
+        # ZIP extraction doesn't preserve execute permissions
+        exe_file.chmod(exe_file.stat().st_mode | 0o755)
+        link_path = LINK_DIR / exe_file.name
+        if link_path.exists() or link_path.is_symlink():
+            continue
+        try:
+            os.symlink(exe_file.absolute(), link_path)
+            created += 1
+        except OSError as e:
+            print(f"⚠️ Could not link {exe_file.name}: {e}")
+    if created:
+        print(f"🔗 Linked {created} Bento4 tools into {LINK_DIR}")
+    else:
+        print("✅ Bento4 tools already available system-wide")
+
+def provision(cache_dir=None, offline=False, allow_unpinned=False):
+    """Install everything first-time setup needs; returns True on success"""
+    cache_dir = cache_dir or os.environ.get("AMDL_ARTIFACT_CACHE") or DEFAULT_CACHE_DIR
+    offline = offline or os.environ.get("AMDL_OFFLINE") == "1"
+    started = time.time()
+    ok = Provisioner(cache_dir, offline, allow_unpinned or unpinned_allowed()).install_all()
+    if ok:
+        print(f"⏱️ Setup finished in {time.time() - started:.1f}s")
+    return ok
+
+def unpinned_allowed():
+    return os.environ.get("AMDL_ALLOW_UNPINNED") == "1"
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch, verify and install the web UI's dependencies.")
+    parser.add_argument("--cache", help="artifact cache directory (default: artifacts/ or $AMDL_ARTIFACT_CACHE)")
+    parser.add_argument("--offline", action="store_true", help="install from the cache only, never use the network")
+    parser.add_argument("--fetch-only", action="store_true", help="fill the cache without installing anything")
+    parser.add_argument("--assets-only", action="store_true",
+                        help="install only the web UI's scripts and styles (no root needed)")
+    parser.add_argument("--update-lock", action="store_true",
+                        help="fetch everything and record its pins in setup.lock.json")
+    parser.add_argument("--allow-unpinned", action="store_true",
+                        help="trust the first download of artifacts setup.lock.json has no pin for")
+    args = parser.parse_args()
+    allow_unpinned = args.allow_unpinned or unpinned_allowed()
+
+    if args.assets_only:
+        cache_dir = args.cache or os.environ.get("AMDL_ARTIFACT_CACHE") or DEFAULT_CACHE_DIR
+        ok = Provisioner(cache_dir, args.offline, allow_unpinned).install_assets()
+    elif args.update_lock:
+        cache_dir = args.cache or os.environ.get("AMDL_ARTIFACT_CACHE") or DEFAULT_CACHE_DIR
+        provisioner = Provisioner(cache_dir, args.offline, allow_unpinned=True)
+        ok = provisioner.fetch_all()
+        if ok:
+            provisioner.write_lock()
+    elif args.fetch_only:
+        cache_dir = args.cache or os.environ.get("AMDL_ARTIFACT_CACHE") or DEFAULT_CACHE_DIR
+        ok = Provisioner(cache_dir, args.offline, allow_unpinned).fetch_all()
+    else:
+        if os.geteuid() != 0:
+            print("❌ Installing requires root. Use --fetch-only to just fill the cache.")
+            sys.exit(1)
+        ok = provision(args.cache, args.offline, allow_unpinned)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from app import jobs, library, logstore, routes, store, subscriptions, wrappers
+from app.scheduler import Scheduler
+
+@pytest.fixture
+def fresh_process(tmp_path, monkeypatch):
+    """Module state of a process that has just started, over a database left by an earlier one"""
+    monkeypatch.setattr(store, "DB_PATH", str(tmp_path / "webui.db"))
+    monkeypatch.setattr(store, "ENGINE_LOCK_PATH", str(tmp_path / "webui.lock"))
+    monkeypatch.setattr(store, "_local", threading.local())
+    monkeypatch.setattr(store, "_engine_lock_file", None)
+    monkeypatch.setattr(routes, "is_engine", False)
+    monkeypatch.setattr(routes, "engine_checked_at", 0)
+    monkeypatch.setattr(routes, "attempt_auto_login", lambda: False)
+    monkeypatch.setattr(logstore, "mirror", None)
+    monkeypatch.setattr(logstore, "mirror_clear", None)
+    monkeypatch.setattr(jobs, "jobs", {})
+    monkeypatch.setattr(jobs, "job_queue", Scheduler())
+    # Only resuming is under test; no background services or download workers
+    for module, name in ((store, "start_publisher"), (library, "start_library_refresher"),
+                         (subscriptions, "start_syncer"), (wrappers, "start_supervisor"),
+                         (jobs, "ensure_workers"), (routes, "install_missing_assets")):
+        monkeypatch.setattr(module, name, lambda *args: None)
+    yield
+    if store._engine_lock_file:
+        store._engine_lock_file.close()
+
+def test_engine_startup_requeues_unfinished_jobs(fresh_process):
+    queued = store.create_job("https://music.apple.com/us/album/a/1", "STANDARD")
+    running = store.create_job("https://music.apple.com/us/album/b/2", "STANDARD", status="running")
+    done = store.create_job("https://music.apple.com/us/album/c/3", "STANDARD", status="completed")
+
+    routes.start_engine()  # as main.py/wsgi.py do, without any request
+
+    assert routes.is_engine
+    assert {job.id for job in jobs.list_jobs()} == {queued, running}
+    assert sum(jobs.job_queue.queued().values()) == 2
+    assert store.load_job(running)["status"] == "queued"
+    assert store.load_job(done)["status"] == "completed"
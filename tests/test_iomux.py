@@ -0,0 +1,101 @@
+import os
+import threading
+
+from app import iomux
+
+class FakeProcess:
+    """Popen stand-in over plain pipes: the test writes its output and decides its exit code"""
+
+    def __init__(self, stdin=False):
+        read_fd, self.output = os.pipe()
+        self.stdout = os.fdopen(read_fd, "rb", buffering=0)
+        self.stdin = None
+        if stdin:
+            self.input, write_fd = os.pipe()
+            self.stdin = os.fdopen(write_fd, "wb", buffering=0)
+        self.pid = -1
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def exit(self, code):
+        self.returncode = code
+        os.close(self.output)
+
+def collect(process):
+    lines, exits = [], []
+    watcher = iomux.watch(process, lines.append, exits.append)
+    return watcher, lines, exits
+
+def test_feed_splits_on_every_kind_of_line_break():
+    lines = []
+    watcher = iomux.Watch(None, lines.append)
+    watcher.feed(b"one\r\ntwo\rthr")
+    watcher.feed(b"ee\n\xffbad\n")
+
+    assert lines == ["one", "two", "three", "�bad"]
+    assert watcher.buffer == b""
+
+def test_output_lines_then_exit_code():
+    process = FakeProcess()
+    watcher, lines, exits = collect(process)
+    os.write(process.output, b"first\nsecond\n 50%\r100%\rlast without newline")
+    process.exit(3)
+
+    assert watcher.wait(5) == 3
+    assert lines == ["first", "second", " 50%", "100%", "last without newline"]
+    assert exits == [3]
+
+def test_exit_is_reported_once_the_process_is_reaped():
+    process = FakeProcess()
+    watcher, _, exits = collect(process)
+    os.close(process.output)  # output ends before the exit status is known
+
+    assert not watcher.done.wait(0.3)
+    process.returncode = 0
+    assert watcher.wait(5) == 0
+    assert exits == [0]
+
+def test_many_processes_share_one_loop_thread():
+    processes = [FakeProcess() for _ in range(20)]
+    watchers = [collect(process) for process in processes]
+    threads = threading.active_count()
+    for index, process in enumerate(processes):
+        os.write(process.output, f"process {index}\n".encode())
+        process.exit(index)
+
+    for index, (watcher, lines, _) in enumerate(watchers):
+        assert watcher.wait(5) == index
+        assert lines == [f"process {index}"]
+    assert threading.active_count() <= threads
+
+def test_writes_reach_stdin():
+    process = FakeProcess(stdin=True)
+    watcher, _, _ = collect(process)
+    iomux.write(watcher, "123456\n")
+
+    received = b""
+    while not received.endswith(b"\n"):
+        received += os.read(process.input, 64)
+    assert received == b"123456\n"
+
+    process.exit(0)
+    assert watcher.wait(5) == 0
+    assert process.stdin.closed
+    os.close(process.input)
+
+def test_a_failing_callback_does_not_stop_the_loop():
+    process = FakeProcess()
+    lines = []
+
+    def on_line(line):
+        if line == "boom":
+            raise ValueError(line)
+        lines.append(line)
+    watcher = iomux.watch(process, on_line)
+    os.write(process.output, b"boom\nafter\n")
+    process.exit(0)
+
+    assert watcher.wait(5) == 0
+    assert lines == ["after"]
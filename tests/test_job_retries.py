@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from app import catalog, jobs
+from app.scheduler import Scheduler
+
+ALBUM = "https://music.apple.com/us/album/a/1"
+
+@pytest.fixture
+def engine(monkeypatch):
+    """Job functions without the store, log files or download workers behind them"""
+    values = {"job-retries": 3, "retry-backoff-seconds": 30, "download-workers": 1, "download-concurrency": None}
+    monkeypatch.setattr(jobs, "get_setting", values.get)
+    monkeypatch.setattr(jobs, "job_queue", Scheduler())
+    monkeypatch.setattr(jobs.Job, "save", lambda self: None)
+    monkeypatch.setattr(jobs.logfiles, "write", lambda name, line: None)
+    monkeypatch.setattr(jobs, "shared_log", lambda line: None)
+    return values
+
+def make_job(link=ALBUM):
+    return jobs.Job(1, link, "STANDARD")
+
+def stub_album(monkeypatch, tracks):
+    links = [(f"https://music.apple.com/us/song/{n}", f"Track {n}") for n in range(1, tracks + 1)]
+    monkeypatch.setattr(catalog, "resolve", lambda link: {"kind": "album", "title": "A", "links": links,
+                                                          "albums": ["A"] * tracks})
+    return links
+
+def test_retry_backoff_doubles_and_requeues(engine):
+    job = make_job()
+    job.status, job.exit_code, job.finished_at = "failed", 1, time.time()
+
+    delays = []
+    for _ in range(3):
+        before = time.time()
+        jobs.schedule_retry(job)
+        delays.append(job.retry_at - before)
+
+    assert job.retries == 3
+    assert job.status == "queued" and job.exit_code is None and job.finished_at is None
+    for retry, delay in enumerate(delays):
+        base = 30 * 2 ** retry
+        assert base * 0.8 - 1 <= delay <= base * 1.2 + 1  # jittered by ±20%
+    assert jobs.job_queue.queued()["normal"] == 3
+    assert jobs.job_queue.next_job() is None  # held back until retry_at
+
+def test_retry_backoff_is_capped(engine):
+    engine["retry-backoff-seconds"] = 10 ** 6
+    job = make_job()
+
+    before = time.time()
+    jobs.schedule_retry(job)
+
+    assert job.retry_at - before <= jobs.RETRY_BACKOFF_MAX * 1.2 + 1
+
+def test_no_checkpoint_runs_the_whole_link(engine):
+    assert jobs.pending_runs(make_job()) == [(None, ALBUM)]
+
+def test_checkpoint_resumes_only_missing_tracks(engine, monkeypatch):
+    links = stub_album(monkeypatch, 4)
+    job = make_job()
+    job.checkpoint = {"tracks_total": 4, "done": [1, 3], "files": 2}
+
+    assert jobs.pending_runs(job) == [(2, links[1][0]), (4, links[3][0])]
+
+def test_checkpoint_falls_back_to_the_whole_link(engine, monkeypatch):
+    job = make_job()
+    job.checkpoint = {"tracks_total": 5, "done": [1], "files": 1}
+
+    stub_album(monkeypatch, 4)  # the album changed since the first attempt
+    assert jobs.pending_runs(job) == [(None, ALBUM)]
+
+    def unreachable(link):
+        raise catalog.CatalogError("offline")
+    monkeypatch.setattr(catalog, "resolve", unreachable)
+    assert jobs.pending_runs(job) == [(None, ALBUM)]
+
+def test_update_checkpoint_merges_finished_tracks(engine):
+    job = make_job()
+    job.progress.tracks_total = 4
+    job.progress.completed_tracks = {1, 2}
+
+    jobs.update_checkpoint(job, None, 1)
+    assert job.checkpoint["tracks_total"] == 4 and job.checkpoint["done"] == [1, 2]
+
+    jobs.update_checkpoint(job, 3, 0)
+    jobs.update_checkpoint(job, 4, 1)
+    assert job.checkpoint["done"] == [1, 2, 3]
+
+    jobs.update_checkpoint(job, None, 0)  # a whole-link run that succeeded covers every track
+    assert job.checkpoint["done"] == [1, 2, 3, 4]
@@ -0,0 +1,43 @@
+import gzip
+import os
+
+import pytest
+
+from app import logfiles, wrappers
+
+SECRET = "hunter2-secret"
+
+@pytest.fixture
+def log_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(logfiles, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(logfiles, "get_setting", lambda key: 64)  # rotate into .gz segments quickly
+    monkeypatch.setattr(wrappers, "log", lambda line: None)
+    return tmp_path
+
+def written_text(directory):
+    text = ""
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            opener = gzip.open if name.endswith(".gz") else open
+            with opener(path, "rb") as f:
+                text += f.read().decode("utf-8", "replace")
+    return text
+
+def test_wrapper_password_never_reaches_log_files(log_dir):
+    logfiles.add_secret(SECRET)
+    instance = wrappers.WrapperInstance(0)
+    instance.log_name = "wrappers/0/test"
+    instance.log(f"Executing: wrapper -L user@example.com:{SECRET}")
+    for i in range(20):
+        instance.log(f"line {i}: echoed {SECRET}")
+    logfiles.write("jobs/1", f"job output with {SECRET}")
+    logfiles.flush_pending()
+    instance.end_session_log()
+    logfiles.close("jobs/1")
+    logfiles.flush_pending()
+
+    assert any(name.endswith(".gz") for name in os.listdir(log_dir / "wrappers" / "0"))
+    text = written_text(log_dir)
+    assert "user@example.com:***" in text
+    assert SECRET not in text
@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from app import logstore, store
+from app.logstore import LogStore
+
+@pytest.fixture(autouse=True)
+def unmirrored(monkeypatch):
+    monkeypatch.setattr(logstore, "mirror", None)
+    monkeypatch.setattr(logstore, "mirror_clear", None)
+
+def test_since_returns_lines_after_the_cursor():
+    logs = LogStore(maxlen=10)
+    start = logstore.current_cursor()
+    for i in range(3):
+        logs.append(f"line {i}")
+
+    assert logs.since(start) == (["line 0", "line 1", "line 2"], False)
+    assert logs.since(logstore.current_cursor()) == ([], False)
+
+def test_upto_holds_back_newer_lines():
+    logs = LogStore(maxlen=10)
+    start = logstore.current_cursor()
+    logs.append("first")
+    cursor = logstore.current_cursor()
+    logs.append("second")
+
+    assert logs.since(start, cursor) == (["first"], False)
+    assert logs.since(cursor) == (["second"], False)
+
+def test_one_cursor_covers_every_store():
+    wrapper, downloader = LogStore(maxlen=10), LogStore(maxlen=10)
+    start = logstore.current_cursor()
+    wrapper.append("w")
+    downloader.append("d")
+
+    assert wrapper.since(start)[0] == ["w"]
+    assert downloader.since(start)[0] == ["d"]
+
+def test_readers_behind_a_clear_reset():
+    logs = LogStore(maxlen=10)
+    logs.append("old")
+    before = logstore.current_cursor()
+    logs.clear()
+    logs.append("new")
+
+    assert logs.since(before) == (["new"], True)
+    assert logs.since(logstore.current_cursor()) == ([], False)
+
+def test_readers_behind_evicted_lines_reset():
+    logs = LogStore(maxlen=3)
+    start = logstore.current_cursor()
+    for i in range(5):
+        logs.append(f"line {i}")
+
+    assert logs.since(start) == (["line 2", "line 3", "line 4"], True)
+    assert len(logs) == 3
+    assert logs.tail(2) == ["line 3", "line 4"]
+
+def test_wait_for_lines_wakes_on_append():
+    logs = LogStore(maxlen=10)
+    cursor = logstore.current_cursor()
+    threading.Timer(0.05, logs.append, ("late",)).start()
+
+    assert logstore.wait_for_lines(cursor, 5) > cursor
+
+def test_shared_store_reads_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "DB_PATH", str(tmp_path / "webui.db"))
+    monkeypatch.setattr(store, "_local", threading.local())
+    for seq in range(1, 11):
+        store.mirror_log("downloader", seq, f"line {seq}")
+    store.flush_logs()
+
+    assert store.read_cursor() == 10
+    assert store.read_logs("downloader", 7, 10, limit=3) == (["line 8", "line 9", "line 10"], False)
+    assert store.read_logs("downloader", 0, 10, limit=3) == (["line 8", "line 9", "line 10"], True)
+    assert store.read_logs("downloader", 0, 5, limit=10) == ([f"line {seq}" for seq in range(1, 6)], False)
+
+    store.mirror_clear("downloader", 11)
+    assert store.read_logs("downloader", 10, 11) == ([], True)
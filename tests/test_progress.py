@@ -0,0 +1,84 @@
+from app.progress import JobProgress, aggregate_phases
+
+def feed_all(progress, lines):
+    return [progress.feed(line) for line in lines]
+
+def test_tracks_phases_and_files():
+    progress = JobProgress(1)
+    feed_all(progress, [
+        "Fetching album metadata",
+        "Track 1 of 3: Intro",
+        "Downloading...",
+        "Decrypting...",
+        "Decrypted: /music/alac/Artist/Album/01. Intro.m4a",
+        "Track 2 of 3: Song",
+    ])
+
+    assert progress.current_track == 2 and progress.tracks_total == 3
+    assert progress.track_title == "Song"
+    assert progress.tracks_done == 1
+    assert progress.completed_tracks == {1}
+    assert [name for name, _ in progress.files] == ["/music/alac/Artist/Album/01. Intro.m4a"]
+    assert progress.phase == "download"
+    assert {"metadata", "download", "decrypt"} <= set(progress.phases())
+
+def test_existing_file_counts_as_done():
+    progress = JobProgress(1)
+    feed_all(progress, ["Track 4 of 4", "Song already exists, skipping"])
+
+    assert progress.completed_tracks == {4}
+    assert progress.tracks_done == 4
+
+def test_summary_line_sets_counts():
+    progress = JobProgress(1)
+    progress.feed("Completed: 7/9")
+
+    assert (progress.tracks_done, progress.tracks_total) == (7, 9)
+
+def test_progress_bars_track_bytes_and_are_not_logged_until_done():
+    progress = JobProgress(1)
+    progress.feed("Track 1 of 2")
+
+    redraws = feed_all(progress, [
+        " 50% |#####     | 5.0/10.0 MB 2.0 MB/s",
+        "100% |##########| 10.0/10.0 MB 2.5 MB/s",
+    ])
+    assert redraws == [True, False]
+    assert progress.percent == 100.0
+    assert (progress.bytes_done, progress.bytes_total) == (10 ** 7, 10 ** 7)
+    assert progress.throughput_bps == 2_500_000
+
+    progress.feed("Track 2 of 2")
+    progress.feed("10% | 512.0 KiB/5.0 MiB")  # a new transfer banks the finished one
+    assert progress.completed_bytes == 10 ** 7
+    assert progress.bytes_done == 512 * 1024
+    assert progress.to_dict()["total_bytes"] == 10 ** 7 + 512 * 1024
+
+def test_finish_completes_every_track():
+    progress = JobProgress(1)
+    feed_all(progress, ["Track 1 of 5", "Downloading"])
+    progress.finish(0)
+
+    assert progress.phase == "completed"
+    assert progress.tracks_done == 5
+
+    failed = JobProgress(2)
+    failed.feed("Track 1 of 5")
+    failed.finish(1)
+    assert failed.phase == "failed" and failed.tracks_done == 0
+
+def test_resource_use_is_charged_to_the_current_phase():
+    progress = JobProgress(1)
+    progress.feed("Track 1 of 1")
+    progress.account({"cpu_seconds": 1.0, "read_bytes": 0, "write_bytes": 100, "rss_bytes": 50})
+    progress.feed("Decrypting")
+    progress.account({"cpu_seconds": 3.0, "read_bytes": 10, "write_bytes": 300, "rss_bytes": 80})
+
+    phases = progress.phases()
+    assert phases["download"]["cpu_seconds"] == 1.0 and phases["download"]["write_bytes"] == 100
+    assert phases["decrypt"]["cpu_seconds"] == 2.0 and phases["decrypt"]["write_bytes"] == 200
+    assert progress.peak_rss == 80
+
+    summary = aggregate_phases([progress.to_dict(), None, {"phases": {}}])
+    assert summary["jobs"] == 1
+    assert summary["phases"]["decrypt"]["cpu_seconds"] == 2.0
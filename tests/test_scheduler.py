@@ -0,0 +1,91 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import scheduler
+from app.scheduler import Scheduler
+
+@pytest.fixture
+def settings(monkeypatch):
+    """webui.yaml values the scheduler reads, editable by each test"""
+    values = {"download-workers": 2, "download-concurrency": None, "format-concurrency": None}
+    monkeypatch.setattr(scheduler, "get_setting", values.get)
+    return values
+
+def make_job(job_id, format_choice="STANDARD", priority="normal"):
+    return SimpleNamespace(id=job_id, format=format_choice, priority=priority, retry_at=None, paused=False)
+
+def test_lanes_are_served_by_priority_then_fifo(settings):
+    queue = Scheduler()
+    low, normal1, normal2, high = make_job(1, priority="low"), make_job(2), make_job(3), make_job(4, priority="high")
+    for job in (low, normal1, normal2, high):
+        queue.put(job)
+    settings["download-workers"] = 4
+
+    assert [queue.take().id for _ in range(4)] == [4, 2, 3, 1]
+
+def test_unknown_priority_goes_to_the_normal_lane(settings):
+    queue = Scheduler()
+    queue.put(make_job(1, priority="urgent"))
+
+    assert queue.queued() == {"high": 0, "normal": 1, "low": 0}
+
+def test_nothing_starts_past_the_concurrency_limit(settings):
+    queue = Scheduler()
+    for job_id in range(3):
+        queue.put(make_job(job_id))
+    first, second = queue.take(), queue.take()
+
+    assert queue.next_job() is None
+    queue.done(first)
+    assert queue.next_job().id == 2
+    queue.reclaim(first)  # a resumed job takes its slot back
+    assert queue.next_job() is None
+    settings["download-concurrency"] = 3  # download-concurrency wins over download-workers
+    assert queue.next_job().id == 2
+
+def test_a_capped_format_is_passed_over_for_one_that_fits(settings):
+    settings["download-workers"] = 3
+    settings["format-concurrency"] = {"ATMOS": 1}
+    queue = Scheduler()
+    queue.put(make_job(1, "ATMOS"))
+    queue.put(make_job(2, "ATMOS", priority="high"))
+    queue.put(make_job(3, "AAC"))
+
+    assert queue.take().id == 2
+    assert queue.take().id == 3
+    assert queue.next_job() is None
+
+def test_jobs_wait_out_their_retry_backoff(settings):
+    queue = Scheduler()
+    retrying, fresh = make_job(1, priority="high"), make_job(2)
+    retrying.retry_at = time.time() + 60
+    queue.put(retrying)
+    queue.put(fresh)
+
+    assert queue.next_job() is fresh
+    retrying.retry_at = time.time() - 1
+    assert queue.next_job() is retrying
+
+def test_held_jobs_are_skipped_until_resumed(settings):
+    queue = Scheduler()
+    held, other = make_job(1), make_job(2)
+    queue.put(held)
+    queue.put(other)
+
+    assert queue.hold(held)
+    assert queue.next_job() is other
+    taken = queue.take()
+    assert not queue.hold(taken)  # already with a worker
+    assert queue.next_job() is None
+    held.paused = False
+    assert queue.next_job() is held
+
+def test_remove_fails_once_a_worker_took_the_job(settings):
+    queue = Scheduler()
+    job = make_job(1)
+    queue.put(job)
+    queue.take()
+
+    assert not queue.remove(job)
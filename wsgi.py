@@ -0,0 +1,15 @@
+"""WSGI entry point for serving with several worker processes, e.g.
+
+    gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:5000 wsgi:app
+
+Workers share wrapper, job and log state through webui.db; one of them
+becomes the engine that runs the wrapper and the downloads.
+"""
+from app.server import prepare_environment
+
+prepare_environment()
+
+from app import app
+from app.routes import start_engine
+
+start_engine()